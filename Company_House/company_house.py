@@ -1,28 +1,42 @@
 import aiohttp
 import asyncio
-import base64
-import json
 import os
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-from Models.models import CompanyInfo, DirectorInfo, FilingInfo, LegalInfo, BusinessProfile
+from Models.models import CompanyInfo, DirectorInfo, FilingInfo, LegalInfo, BusinessProfile, to_dict
 from typing import Dict, Optional, Any
 from pathlib import Path
-from dataclasses import asdict
 from aiolimiter import AsyncLimiter
+from Processor.metrics import METRICS, limited
+from Processor.resilience import RESILIENCE
+from Processor.errors import NotFoundError, PermanentError, UpstreamError, error_for_exception, error_for_status, is_retryable
+from Processor.negative_cache import NEGATIVE_CACHE
+from Processor.eligibility import ELIGIBILITY
+from Processor.user_agent import USER_AGENT
+from Processor.serialization import dumps, loads
+from Company_House.snapshot import SNAPSHOT
+from Company_House.credentials import COMPANY_HOUSE_KEYS
 
 
-SIC_CODES = Path("Company_House/sic_codes/sic_codes_grouped.json")
+SIC_CODES = Path(__file__).parent / "sic_codes" / "sic_codes_grouped.json"
+COMPANY_HOUSE_API_URL = os.environ.get("COMPANY_HOUSE_API_URL", "https://api.company-information.service.gov.uk")
+OFFICERS_PAGE_SIZE = 100
+# Profiles already fetched for a record that then hit a retryable error. They ride on the record itself,
+# which the pipeline hands unchanged to the next attempt, so nothing outlives the retries.
+FETCHED_PROFILES_KEY = "_fetched_profiles"
 
 class CompanyHouseAPI:
-    __search_url = "https://api.company-information.service.gov.uk/advanced-search/companies"
-    __get_company_url = "https://api.company-information.service.gov.uk/company"
-    __base_url = "https://api.company-information.service.gov.uk"
-    __sic_data = []
+    __search_url = f"{COMPANY_HOUSE_API_URL}/advanced-search/companies"
+    __get_company_url = f"{COMPANY_HOUSE_API_URL}/company"
+    __base_url = COMPANY_HOUSE_API_URL
+    __sic_data = None
 
-    def __init__(self):
-        with open(SIC_CODES, "r") as file:
-            self.__sic_data = json.loads(file.read())
+    def __init__(self, limiter: Optional[AsyncLimiter] = None):
+        self.limiter = limiter
+        if CompanyHouseAPI.__sic_data is None:
+            # Parsed once per process rather than for every company looked up.
+            with open(SIC_CODES, "rb") as file:
+                CompanyHouseAPI.__sic_data = loads(file.read())
 
     def age_str(self, dob: dict):
         dt = datetime(dob.get("year", ""), dob.get("month", ""), 1)
@@ -61,164 +75,243 @@ class CompanyHouseAPI:
                     }
         return None
 
+    async def __get_json(self, session: aiohttp.ClientSession, url: str, headers: dict, endpoint: str, params: Optional[dict] = None) -> dict:
+        async def request():
+            # A key rejected with 401/429 is evicted and the request moves to the next one.
+            for attempt in range(max(len(COMPANY_HOUSE_KEYS), 1)):
+                key = COMPANY_HOUSE_KEYS.choose(endpoint)
+                key.in_flight += 1
+                try:
+                    async with limited(key.limiter, key=key.name):
+                        with METRICS.time("http_request_seconds", endpoint=endpoint):
+                            async with session.get(url, headers={**headers, "Authorization": key.authorization}, params=params) as resp:
+                                METRICS.inc("http_requests_total", endpoint=endpoint, status=resp.status)
+                                key.observe(resp.headers)
+                                if resp.status == 200:
+                                    return await resp.json(loads=loads)
+                                error_text = await resp.text()
+                                raise error_for_status(resp.status, f"Company House API returned {resp.status}: {error_text}", endpoint, resp.headers)
+                except UpstreamError as e:
+                    METRICS.inc("http_errors_total", endpoint=endpoint, error=type(e).__name__)
+                    if e.status in (401, 429):
+                        COMPANY_HOUSE_KEYS.evict(key, e)
+                        if attempt + 1 < len(COMPANY_HOUSE_KEYS):
+                            continue
+                    raise
+                except Exception as e:
+                    METRICS.inc("http_errors_total", endpoint=endpoint, error=type(e).__name__)
+                    raise error_for_exception(e, endpoint) from e
+                finally:
+                    key.in_flight -= 1
+
+        return await RESILIENCE.call(endpoint, request, self.limiter)
+
     async def search_company(self, session: aiohttp.ClientSession, headers: dict, **kwargs) -> dict:
-        try:
-            async with session.get(self.__search_url, headers=headers, params=kwargs) as resp:
-                if resp.status == 200:
-                    json_resp = await resp.json()
-                    return json_resp.get("top_hit", {})
-                else:
-                    error_text = await resp.text()
-                    raise aiohttp.ClientResponseError(
-                        status=resp.status,
-                        message=f"Company House API returned {resp.status}: {error_text}",
-                        request_info=resp.request_info,
-                        history=resp.history
-                    )
-        except Exception as e:
-            print(f"Exception occurred: {e}")
+        local_hit = SNAPSHOT.search(kwargs.get("company_name_includes", ""))
+        if local_hit:
+            return local_hit
+        json_resp = await self.__get_json(session, self.__search_url, headers, "companies_house_search", kwargs)
+        top_hit = json_resp.get("top_hit")
+        if not top_hit:
+            raise NotFoundError("No search result found.", "companies_house_search")
+        return top_hit
 
     async def get_company_details(self, session: aiohttp.ClientSession, headers: dict, company_number: str):
-        try:
-            url = f"{self.__get_company_url}/{company_number}"
-            async with session.get(url, headers=headers) as resp:
-                if resp.status == 200:
-                    json_resp = await resp.json()
-                    return json_resp
-                else:
-                    error_text = await resp.text()
-                    raise aiohttp.ClientResponseError(
-                        status=resp.status,
-                        message=f"Company House API returned {resp.status}: {error_text}",
-                        request_info=resp.request_info,
-                        history=resp.history
-                    )
-        except Exception as e:
-            print(f"Exception occurred: {e}")
+        local_profile = SNAPSHOT.profile(company_number)
+        if local_profile:
+            return local_profile
+        url = f"{self.__get_company_url}/{company_number}"
+        return await self.__get_json(session, url, headers, "companies_house_company")
 
-    async def fetch_link(self, session: aiohttp.ClientSession, url_link: str, headers: dict):
+    async def fetch_link(self, session: aiohttp.ClientSession, url_link: str, headers: dict, params: Optional[dict] = None):
+        url = f"{self.__base_url}{url_link}"
+        endpoint = f"companies_house_{url_link.rstrip('/').rsplit('/', 1)[-1].replace('-', '_')}"
         try:
-            url = f"{self.__base_url}{url_link}"
-            async with session.get(url, headers=headers) as resp:
-                if resp.status == 200:
-                    json_resp = await resp.json()
-                    return json_resp
-                else:
-                    error_text = await resp.text()
-                    raise aiohttp.ClientResponseError(
-                        status=resp.status,
-                        message=f"Company House API returned {resp.status}: {error_text}",
-                        request_info=resp.request_info,
-                        history=resp.history
-                    )
-        except Exception as e:
-            print(f"Exception occurred: {e}")
+            return await self.__get_json(session, url, headers, endpoint, params)
+        except NotFoundError:
+            return None
+
+    async def fetch_all_pages(self, session: aiohttp.ClientSession, url_link: str, headers: dict, page_size: int = OFFICERS_PAGE_SIZE):
+        """
+        Reads the first page, then fetches the rest concurrently from `total_results`.
+        The first page rides on the caller's limiter token; each further page takes its own.
+        """
+        first_page = await self.fetch_link(session, url_link, headers, {"items_per_page": page_size, "start_index": 0})
+        if not first_page:
+            return first_page
+        total = first_page.get("total_results", 0)
+        # Step by what the server actually served; it may cap `items_per_page` below what we asked for.
+        fetched = len(first_page.get("items", []))
+        if not fetched or fetched >= total:
+            return first_page
+
+        async def fetch_page(start_index: int):
+            async with limited(self.limiter, endpoint="companies_house"):
+                return await self.fetch_link(session, url_link, headers, {"items_per_page": page_size, "start_index": start_index})
+
+        pages = await asyncio.gather(*(fetch_page(start) for start in range(fetched, total, fetched)))
+        for page in pages:
+            if page:
+                first_page["items"].extend(page.get("items", []))
+        return first_page
+
+    def sectors(self, sic_codes: Optional[list]) -> Optional[list]:
+        if sic_codes is None:
+            return None
+        return [entry["Sector"] for entry in map(self.get_sic_description, sic_codes) if entry]
+
+    def eligibility(self, company: dict) -> Optional[str]:
+        return ELIGIBILITY.check(
+            "companies_house",
+            status=company.get("company_status"),
+            created=company.get("date_of_creation"),
+            sectors=self.sectors(company.get("sic_codes"))
+        )
 
     async def run(self, headers: dict, params: dict) -> BusinessProfile:
-        async with aiohttp.ClientSession() as session:
-            try:
-                search_result = await self.search_company(session, headers, **params)
-                if not search_result:
-                    raise ValueError("No search result found.")
-
-                company_number = search_result.get("company_number")
-                if not company_number:
-                    raise ValueError("Company number missing in search result.")
-
-                company_details = await self.get_company_details(session, headers, company_number)
-                if not company_details:
-                    raise ValueError("Company details not found.")
-
-                company_info = CompanyInfo(
-                    company_name=company_details.get("company_name", ""),
-                    company_number=company_details.get("company_number", ""),
-                    uk_city_location=company_details.get("registered_office_address", {}).get("locality", ""),
-                    registered_address=company_details.get("registered_office_address", {}),
-                    active_since_date=company_details.get("date_of_creation", ""),
-                    currently_active="Yes" if company_details.get("company_status") == "active" else "No",
-                    is_the_company_active="Yes" if company_details.get("company_status") == "active" else "No",
-                    industry_of_the_company_from_sic=[self.get_sic_description(code) for code in company_details.get("sic_codes", [])],
-                    vat_registered="No"
-                )
-
-                filing_info = FilingInfo()
-                filing_history_link = company_details.get("links", {}).get("filing_history")
-                if filing_history_link:
-                    filing_details = await self.fetch_link(session, filing_history_link, headers)
-                    items = filing_details.get("items", [])
-                    if items:
-                        date_str = items[0].get("date")
-                        if date_str:
-                            filing_info.latest_account_filing_date = date_str
-                            filing_info.account_filing_in_past_month = "Yes" if self.is_last_month(date_str) else "No"
-                            filing_info.months_since_last_filing = self.months_diff(date_str)
-
-                director_info = DirectorInfo()
-                officers_link = company_details.get("links", {}).get("officers")
-                if officers_link:
-                    director_details = await self.fetch_link(session, officers_link, headers)
-                    if director_details:
-                        director_info.number_of_directors = director_details.get("active_count", "")
-                        director_info.names_of_other_directors = [
-                            d.get("name", "")
-                            for d in director_details.get("items", [])
-                            if d.get("officer_role") == "director" and not d.get("resigned_on")
-                        ]
-                        director_info.director_age_years = [
-                            {d.get("name", ""): self.age_str(d.get("date_of_birth", {}))}
-                            for d in director_details.get("items", [])
-                            if d.get("officer_role") == "director" and not d.get("resigned_on")
-                        ]
-
-                legal_info = None
-                charges_link = company_details.get("links", {}).get("charges")
-                if charges_link:
-                    charges_details = await self.fetch_link(session, charges_link, headers)
-                    if charges_details:
-                        legal_info = LegalInfo(
-                            has_debentures_or_charges="Yes" if charges_details.get("total_count", 0) > 0 else "No",
-                            debentures_status="Has Outstanding" if charges_details.get("part_satisfied_count", 0) > 0 else "All Satisfied",
-                            outstanding_count=charges_details.get("part_satisfied_count", 0),
-                            satisfied_count=charges_details.get("satisfied_count", 0),
-                        )
-
-                return BusinessProfile(
-                    company_info=company_info,
-                    director_info=director_info,
-                    filing_info=filing_info,
-                    legal_info=legal_info
-                )
-
-            except Exception as e:
-                print(f"Exception in CompanyHouseAPI.run(): {e}")
-
-                return BusinessProfile(
-                    company_info=CompanyInfo(),
-                    director_info=DirectorInfo(),
-                    filing_info=FilingInfo(),
-                    legal_info=None
-                )
+        async with aiohttp.ClientSession(json_serialize=dumps) as session:
+            search_result = await self.search_company(session, headers, **params)
+
+            company_number = search_result.get("company_number")
+            if not company_number:
+                raise PermanentError("Company number missing in search result.", "companies_house_search")
+
+            # Whatever the search hit already tells us can rule the company out before the profile is fetched.
+            skip_reason = self.eligibility(search_result)
+            if skip_reason:
+                return skipped_profile(search_result.get("company_name", ""), skip_reason, company_number, search_result.get("company_status"))
+
+            company_details = await self.get_company_details(session, headers, company_number)
+            if not company_details:
+                raise NotFoundError("Company details not found.", "companies_house_company")
+
+            company_info = CompanyInfo(
+                company_name=company_details.get("company_name", ""),
+                company_number=company_details.get("company_number", ""),
+                uk_city_location=company_details.get("registered_office_address", {}).get("locality", ""),
+                registered_address=company_details.get("registered_office_address", {}),
+                active_since_date=company_details.get("date_of_creation", ""),
+                currently_active="Yes" if company_details.get("company_status") == "active" else "No",
+                is_the_company_active="Yes" if company_details.get("company_status") == "active" else "No",
+                industry_of_the_company_from_sic=[self.get_sic_description(code) for code in company_details.get("sic_codes", [])],
+                vat_registered="No"
+            )
+
+            skip_reason = self.eligibility(company_details)
+            if skip_reason:
+                return BusinessProfile(company_info, DirectorInfo(), FilingInfo(), None, skip_reason)
+
+            filing_info = FilingInfo()
+            filing_history_link = company_details.get("links", {}).get("filing_history")
+            if filing_history_link:
+                # Only the latest filing is used.
+                filing_details = await self.fetch_link(session, filing_history_link, headers, {"items_per_page": 1})
+                items = filing_details.get("items", []) if filing_details else []
+                if items:
+                    date_str = items[0].get("date")
+                    if date_str:
+                        filing_info.latest_account_filing_date = date_str
+                        filing_info.account_filing_in_past_month = "Yes" if self.is_last_month(date_str) else "No"
+                        filing_info.months_since_last_filing = self.months_diff(date_str)
+
+            director_info = DirectorInfo()
+            officers_link = company_details.get("links", {}).get("officers")
+            if officers_link:
+                director_details = await self.fetch_all_pages(session, officers_link, headers)
+                if director_details:
+                    director_info.number_of_directors = director_details.get("active_count", "")
+                    director_info.names_of_other_directors = [
+                        d.get("name", "")
+                        for d in director_details.get("items", [])
+                        if d.get("officer_role") == "director" and not d.get("resigned_on")
+                    ]
+                    director_info.director_age_years = [
+                        {d.get("name", ""): self.age_str(d.get("date_of_birth", {}))}
+                        for d in director_details.get("items", [])
+                        if d.get("officer_role") == "director" and not d.get("resigned_on")
+                    ]
+
+            legal_info = None
+            charges_link = company_details.get("links", {}).get("charges")
+            if charges_link:
+                charges_details = await self.fetch_link(session, charges_link, headers)
+                if charges_details:
+                    legal_info = LegalInfo(
+                        has_debentures_or_charges="Yes" if charges_details.get("total_count", 0) > 0 else "No",
+                        debentures_status="Has Outstanding" if charges_details.get("part_satisfied_count", 0) > 0 else "All Satisfied",
+                        outstanding_count=charges_details.get("part_satisfied_count", 0),
+                        satisfied_count=charges_details.get("satisfied_count", 0),
+                    )
+
+            return BusinessProfile(
+                company_info=company_info,
+                director_info=director_info,
+                filing_info=filing_info,
+                legal_info=legal_info
+            )
+
+def empty_profile(error: Optional[str] = None) -> BusinessProfile:
+    return BusinessProfile(
+        company_info=CompanyInfo(),
+        director_info=DirectorInfo(),
+        filing_info=FilingInfo(),
+        legal_info=None,
+        error=error
+    )
+
+def skipped_profile(company_name: str, skip_reason: str, company_number: Optional[str] = None, status: Optional[str] = None) -> BusinessProfile:
+    active = "Yes" if status == "active" else "No"
+    return BusinessProfile(
+        company_info=CompanyInfo(company_name=company_name, company_number=company_number, currently_active=active, is_the_company_active=active),
+        director_info=DirectorInfo(),
+        filing_info=FilingInfo(),
+        legal_info=None,
+        skip_reason=skip_reason
+    )
 
 async def run_business_profiling(logger, data: Dict[str, Any], limiter: Optional[AsyncLimiter] = None) -> Optional[Dict[str, Any]]:
-    COMPANY_HOUSE_API_KEY = os.environ.get("COMPANY_HOUSE_API_KEY")
-    auth = base64.b64encode(f"{COMPANY_HOUSE_API_KEY}:".encode()).decode()
     headers = {
-        "Authorization": f"Basic {auth}",
-        "Accept": "application/json"
+        "Accept": "application/json",
+        "User-Agent": USER_AGENT.get()
     }
 
     retVal = []
+    fetched: Dict[str, Dict[str, Any]] = data.pop(FETCHED_PROFILES_KEY, {})
+    source_skip = ELIGIBILITY.check("companies_house", source=data.get("source"))
 
     for k, v in data.items():
         if k == "companies":
             for company in v:
-                new_company = CompanyHouseAPI()
-                if limiter:
-                    async with limiter:
+                if source_skip:
+                    retVal.append(to_dict(skipped_profile(company, source_skip)))
+                    continue
+                if NEGATIVE_CACHE.get("companies_house_search", company):
+                    retVal.append(to_dict(empty_profile()))
+                    continue
+                if company in fetched:
+                    retVal.append(fetched[company])
+                    continue
+                new_company = CompanyHouseAPI(limiter)
+                try:
+                    async with limited(limiter, endpoint="companies_house"):
                         retval = await new_company.run(headers, {"company_name_includes": company})
-                else:
-                    retval = await new_company.run(headers, {"company_name_includes": company})
-                retval = asdict(retval)
+                except UpstreamError as e:
+                    if is_retryable(e):
+                        # The pipeline retries the whole record; keep what this attempt already paid for.
+                        data[FETCHED_PROFILES_KEY] = fetched
+                        raise
+                    if isinstance(e, NotFoundError) and e.endpoint == "companies_house_search":
+                        # Only a search miss says the name has no company; a 404 on a profile or link may be a stale number.
+                        NEGATIVE_CACHE.add("companies_house_search", company, str(e))
+                        logger.info(f"No Companies House match for {company}: {e}")
+                        retval = empty_profile()
+                    else:
+                        logger.warning(f"Companies House lookup failed for {company}: {e}")
+                        retval = empty_profile(str(e))
+                if retval.skip_reason:
+                    logger.info(f"Skipping {company}: {retval.skip_reason}")
+                retval = to_dict(retval)
+                fetched[company] = retval
                 retVal.append(retval)
             break
     return retVal
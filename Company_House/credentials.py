@@ -0,0 +1,122 @@
+import base64
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Tuple
+from aiolimiter import AsyncLimiter
+from Processor.errors import PermanentError, RateLimitedError, UpstreamError
+from Processor.metrics import METRICS
+from Processor.sharding import SHARED_LIMITERS
+
+
+COMPANY_HOUSE_API_KEYS_FILE = os.environ.get("COMPANY_HOUSE_API_KEYS_FILE")
+# Companies House allows 600 requests per 5 minutes per key.
+COMPANY_HOUSE_KEY_RATE_LIMIT = os.environ.get("COMPANY_HOUSE_KEY_RATE_LIMIT", "600/300")
+AUTH_EVICTION_SECONDS = 3600.0
+RATE_LIMIT_EVICTION_SECONDS = 60.0
+
+
+def parse_rate(rate: str) -> Tuple[float, float]:
+    requests, _, seconds = rate.partition("/")
+    return float(requests), float(seconds or 1)
+
+
+class ApiKey:
+    """One Companies House key: its Basic auth header, its own limiter and the quota the API last reported for it."""
+    def __init__(self, name: str, key: str, rate: Tuple[float, float]):
+        self.name = name
+        self.authorization = f"Basic {base64.b64encode(f'{key}:'.encode()).decode()}"
+        self.rate = rate
+        self.__limiter = AsyncLimiter(*rate)
+        self.limit = int(rate[0])
+        self.remaining: Optional[int] = None
+        self.reset_at = 0.0
+        self.in_flight = 0
+        self.evicted_until = 0.0
+        self.eviction_reason: Optional[str] = None
+
+    @property
+    def limiter_name(self) -> str:
+        return f"companies_house_{self.name}"
+
+    @property
+    def limiter(self):
+        # In a shard process the key's quota is metered by the coordinator, shared with the other shards.
+        return SHARED_LIMITERS.get(self.limiter_name, self.__limiter)
+
+    def available_at(self, now: float) -> float:
+        # A key whose reported quota is spent is skipped until the reset instead of being sent into a 429.
+        if self.remaining is not None and self.reset_at > now and self.remaining - self.in_flight <= 0:
+            return max(self.evicted_until, self.reset_at)
+        return self.evicted_until
+
+    def budget(self, now: float) -> float:
+        remaining = self.remaining if self.remaining is not None and self.reset_at > now else self.limit
+        return remaining - self.in_flight
+
+    def observe(self, headers: Mapping[str, str]):
+        try:
+            if "X-Ratelimit-Remain" in headers:
+                self.remaining = int(headers["X-Ratelimit-Remain"])
+            if "X-Ratelimit-Limit" in headers:
+                self.limit = int(headers["X-Ratelimit-Limit"])
+            if "X-Ratelimit-Reset" in headers:
+                self.reset_at = float(headers["X-Ratelimit-Reset"])
+        except ValueError:
+            return
+        if self.remaining is not None:
+            METRICS.set("companies_house_key_remaining", self.remaining, key=self.name)
+
+
+class KeyPool:
+    """
+    Routes Companies House requests across several API keys. Each request goes to
+    the available key with the most remaining budget, preferring keys whose own
+    limiter has room. A key answered with 401 or 429 is evicted until its quota
+    resets (or for a fixed period) and the request moves on to the next key.
+    """
+    def __init__(self, keys: List[str], rate: Tuple[float, float]):
+        self.keys = [ApiKey(f"key-{i}", key, rate) for i, key in enumerate(keys)]
+
+    @classmethod
+    def from_environment(cls) -> "KeyPool":
+        """Keys from `COMPANY_HOUSE_API_KEYS` (comma separated), `COMPANY_HOUSE_API_KEYS_FILE` (one per line) and `COMPANY_HOUSE_API_KEY`."""
+        keys = [k.strip() for k in os.environ.get("COMPANY_HOUSE_API_KEYS", "").split(",")]
+        if COMPANY_HOUSE_API_KEYS_FILE:
+            lines = Path(COMPANY_HOUSE_API_KEYS_FILE).read_text().splitlines()
+            keys.extend(line.strip() for line in lines if not line.lstrip().startswith("#"))
+        keys.append(os.environ.get("COMPANY_HOUSE_API_KEY", "").strip())
+        return cls(list(dict.fromkeys(k for k in keys if k)), parse_rate(COMPANY_HOUSE_KEY_RATE_LIMIT))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def rates(self) -> Dict[str, Tuple[float, float]]:
+        """Per-key quotas by limiter name, for run_sharded to enforce across shard processes."""
+        return {key.limiter_name: key.rate for key in self.keys}
+
+    def choose(self, endpoint: str = "companies_house") -> ApiKey:
+        if not self.keys:
+            raise PermanentError("No Companies House API key configured", endpoint)
+        now = time.time()
+        available = [key for key in self.keys if key.available_at(now) <= now]
+        if not available:
+            if all(key.eviction_reason == "unauthorized" for key in self.keys):
+                raise PermanentError("Every Companies House API key was rejected", endpoint, 401)
+            retry_in = min(key.available_at(now) for key in self.keys) - now
+            raise RateLimitedError(f"Every Companies House API key is out of quota, retry in {retry_in:.0f}s", endpoint, 429, retry_in)
+        return max(available, key=lambda key: (key.limiter.has_capacity(), key.budget(now)))
+
+    def evict(self, key: ApiKey, error: UpstreamError):
+        now = time.time()
+        if error.status == 401:
+            key.eviction_reason = "unauthorized"
+            key.evicted_until = now + AUTH_EVICTION_SECONDS
+        else:
+            key.eviction_reason = "rate_limited"
+            until = key.reset_at if key.reset_at > now else now + (error.retry_after or RATE_LIMIT_EVICTION_SECONDS)
+            key.evicted_until = until
+        METRICS.inc("companies_house_key_evictions_total", key=key.name, reason=key.eviction_reason)
+
+
+COMPANY_HOUSE_KEYS = KeyPool.from_environment()
@@ -0,0 +1,217 @@
+import argparse
+import csv
+import io
+import logging
+import os
+import sqlite3
+import time
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+from Processor.company_matcher import normalize_company_name
+from Processor.metrics import METRICS
+
+
+COMPANIES_HOUSE_SNAPSHOT = Path(os.environ.get("COMPANIES_HOUSE_SNAPSHOT", "data/companies_house/snapshot.sqlite"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS companies (
+    company_number TEXT PRIMARY KEY,
+    company_name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    company_status TEXT,
+    company_category TEXT,
+    date_of_creation TEXT,
+    address_line_1 TEXT,
+    address_line_2 TEXT,
+    locality TEXT,
+    region TEXT,
+    country TEXT,
+    postal_code TEXT,
+    sic_codes TEXT,
+    charges_count INTEGER
+)
+"""
+
+INSERT = """
+INSERT OR REPLACE INTO companies VALUES (
+    :company_number, :company_name, :name_key, :company_status, :company_category, :date_of_creation,
+    :address_line_1, :address_line_2, :locality, :region, :country, :postal_code, :sic_codes, :charges_count
+)
+"""
+
+
+def iso_date(value: str) -> str:
+    try:
+        return datetime.strptime(value, "%d/%m/%Y").strftime("%Y-%m-%d")
+    except ValueError:
+        return value
+
+
+def read_snapshot(path: Path) -> Iterator[Dict[str, str]]:
+    """Rows of a Basic Company Data CSV, or of every CSV inside a snapshot zip."""
+    if path.suffix.lower() == ".zip":
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                if member.lower().endswith(".csv"):
+                    with archive.open(member) as raw:
+                        yield from csv.DictReader(io.TextIOWrapper(raw, encoding="utf-8-sig", newline=""))
+    else:
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            yield from csv.DictReader(f)
+
+
+def to_record(row: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    # Several headers in the published files carry a leading space, e.g. " CompanyNumber".
+    row = {k.strip(): (v or "").strip() for k, v in row.items() if k}
+    number = row.get("CompanyNumber")
+    name = row.get("CompanyName")
+    if not number or not name:
+        return None
+    sic_codes = [
+        row[f"SICCode.SicText_{i}"].split(" - ", 1)[0]
+        for i in range(1, 5)
+        if row.get(f"SICCode.SicText_{i}") and row[f"SICCode.SicText_{i}"] != "None Supplied"
+    ]
+    return {
+        "company_number": number,
+        "company_name": name,
+        "name_key": normalize_company_name(name),
+        "company_status": row.get("CompanyStatus", "").lower(),
+        "company_category": row.get("CompanyCategory", ""),
+        "date_of_creation": iso_date(row.get("IncorporationDate", "")),
+        "address_line_1": row.get("RegAddress.AddressLine1", ""),
+        "address_line_2": row.get("RegAddress.AddressLine2", ""),
+        "locality": row.get("RegAddress.PostTown", ""),
+        "region": row.get("RegAddress.County", ""),
+        "country": row.get("RegAddress.Country", ""),
+        "postal_code": row.get("RegAddress.PostCode", ""),
+        "sic_codes": ",".join(sic_codes),
+        "charges_count": int(row.get("Mortgages.NumMortCharges") or 0)
+    }
+
+
+def ingest(paths: List[Path], db_path: Path, logger, batch_size: int = 10_000) -> int:
+    """
+    Loads one or more snapshot files into a fresh SQLite database, built next to
+    `db_path` and swapped in atomically so running pipelines keep a consistent view.
+    """
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = db_path.with_suffix(".building")
+    tmp_path.unlink(missing_ok=True)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute(SCHEMA)
+
+    started = time.monotonic()
+    total = 0
+    batch = []
+    for path in paths:
+        logger.info(f"Ingesting {path}")
+        for row in read_snapshot(path):
+            record = to_record(row)
+            if record is None:
+                continue
+            batch.append(record)
+            if len(batch) >= batch_size:
+                conn.executemany(INSERT, batch)
+                total += len(batch)
+                batch.clear()
+                if total % 500_000 == 0:
+                    logger.info(f"{total} companies loaded ({total / (time.monotonic() - started):,.0f}/s)")
+    if batch:
+        conn.executemany(INSERT, batch)
+        total += len(batch)
+    conn.execute("CREATE INDEX IF NOT EXISTS companies_name_key ON companies (name_key)")
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    os.replace(tmp_path, db_path)
+    logger.info(f"Snapshot ready: {total} companies in {db_path} ({time.monotonic() - started:.1f}s)")
+    return total
+
+
+class CompanySnapshot:
+    """
+    Read-only lookups against an ingested snapshot. `search` and `profile` return
+    dicts shaped like the advanced-search `top_hit` and the company profile
+    endpoint, so CompanyHouseAPI can use them in place of the API responses.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self.__conn: Optional[sqlite3.Connection] = None
+        self.__checked = False
+
+    @property
+    def available(self) -> bool:
+        if not self.__checked:
+            self.__checked = True
+            if self.path.exists():
+                self.__conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+                self.__conn.row_factory = sqlite3.Row
+        return self.__conn is not None
+
+    def search(self, company_name: str) -> Optional[Dict[str, Any]]:
+        if not company_name or not self.available:
+            return None
+        row = self.__conn.execute(
+            "SELECT company_number, company_name, company_status FROM companies WHERE name_key = ? "
+            "ORDER BY company_status = 'active' DESC, date_of_creation DESC LIMIT 1",
+            (normalize_company_name(company_name),)
+        ).fetchone()
+        METRICS.cache("companies_house_snapshot_search", row is not None)
+        if row is None:
+            return None
+        return {
+            "company_name": row["company_name"],
+            "company_number": row["company_number"],
+            "company_status": row["company_status"],
+            "links": {"company_profile": f"/company/{row['company_number']}"}
+        }
+
+    def profile(self, company_number: str) -> Optional[Dict[str, Any]]:
+        if not self.available:
+            return None
+        row = self.__conn.execute("SELECT * FROM companies WHERE company_number = ?", (company_number,)).fetchone()
+        METRICS.cache("companies_house_snapshot_profile", row is not None)
+        if row is None:
+            return None
+        links = {
+            "self": f"/company/{company_number}",
+            "officers": f"/company/{company_number}/officers",
+            "filing_history": f"/company/{company_number}/filing-history"
+        }
+        if row["charges_count"]:
+            links["charges"] = f"/company/{company_number}/charges"
+        return {
+            "company_name": row["company_name"],
+            "company_number": row["company_number"],
+            "company_status": row["company_status"],
+            "type": row["company_category"],
+            "date_of_creation": row["date_of_creation"],
+            "registered_office_address": {
+                key: row[key]
+                for key in ("address_line_1", "address_line_2", "locality", "region", "country", "postal_code")
+                if row[key]
+            },
+            "sic_codes": row["sic_codes"].split(",") if row["sic_codes"] else [],
+            "links": links
+        }
+
+
+SNAPSHOT = CompanySnapshot(COMPANIES_HOUSE_SNAPSHOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a Companies House Basic Company Data snapshot into a local SQLite lookup")
+    parser.add_argument("paths", nargs="+", type=Path, help="BasicCompanyData CSV or zip files")
+    parser.add_argument("--db", type=Path, default=COMPANIES_HOUSE_SNAPSHOT)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    ingest(args.paths, args.db, logging.getLogger(__name__))
+
+
+if __name__ == "__main__":
+    main()
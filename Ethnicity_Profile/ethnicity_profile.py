@@ -1,11 +1,17 @@
-from fake_useragent import UserAgent
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from typing import Dict, Optional, Any
 import aiohttp
-import asyncio
 import json
 import os
+import time
 from aiolimiter import AsyncLimiter
+from Processor.metrics import METRICS, limited
+from Processor.resilience import RESILIENCE
+from Processor.errors import TransientError, UpstreamError, error_for_exception, error_for_status, is_retryable
+from Processor.user_agent import USER_AGENT
+from Processor.serialization import dumps, loads
+from Processor.eligibility import ELIGIBILITY
+from Processor.company_table import COMPANIES
 
 
 class AnswerFormat(BaseModel):
@@ -41,7 +47,7 @@ class Prompt:
 
 class GeminiChat:
     __model_name: str = "gemini-2.0-flash"
-    __base_url: str = "https://generativelanguage.googleapis.com/v1beta/models"
+    __base_url: str = f"{os.environ.get('GEMINI_API_URL', 'https://generativelanguage.googleapis.com')}/v1beta/models"
 
     def __init__(self, api_key: str, prompt: Prompt):
         self.prompt = prompt
@@ -49,12 +55,9 @@ class GeminiChat:
         self.url = f"{self.__base_url}/{self.__model_name}:generateContent"
         if not self.api_key:
             raise EnvironmentError("DANIEL_GEMINI_KEY environment variable not set")
-        try:
-            self.ua = UserAgent().random
-        except Exception:
-            self.ua = "Mozilla/5.0 (compatible; PerplexityBot/1.0)"
+        self.ua = USER_AGENT.get()
 
-    async def send_request(self, session: aiohttp.ClientSession, timeout: float = 30.0) -> tuple[str, int]:
+    async def send_request(self, session: aiohttp.ClientSession, timeout: float = 30.0, limiter: Optional[AsyncLimiter] = None) -> tuple[str, int]:
         full_prompt = self.prompt.construct_prompt()
 
         response_schema = {
@@ -91,6 +94,10 @@ class GeminiChat:
             "User-Agent": self.ua
         }
 
+        return await RESILIENCE.call("gemini_generate", lambda: self.__post(session, headers, body, timeout), limiter)
+
+    async def __post(self, session: aiohttp.ClientSession, headers: Dict[str, str], body: Dict[str, Any], timeout: float):
+        started = time.monotonic()
         try:
             async with session.post(
                 self.url,
@@ -98,70 +105,76 @@ class GeminiChat:
                 json=body,
                 timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
 
-                response_data = await resp.json()
-
-                if resp.status == 200:
-                    try:
-                        candidates = response_data.get("candidates", [])
-                        if not candidates:
-                            print("Gemini API returned 200 but no candidates.")
-                            return None, 200
-                        generated_text = candidates[0].get("content", {}).get("parts", [{}])[0].get("text", "")
-                        parsed_json = json.loads(generated_text)
-                        return AnswerFormat(**parsed_json)
-                    except json.JSONDecodeError as e:
-                        print(f"Failed to parse JSON response: {e}, Response: {generated_text}")
-                        raise ValueError("Invalid JSON response from Gemini API") from e
-                    except Exception as e:
-                        print(f"Unexpected error during response parsing: {e}")
-                        raise RuntimeError("Error processing Gemini API response") from e
-                else:
-                    print(f"Gemini API returned error {resp.status}")
-                    resp.raise_for_status()
-                    return None, resp.status
-        except aiohttp.ClientError as e:
-            print(f"HTTP Client Error during API call: {e}")
-            raise ConnectionError(f"Network error during API call: {e}") from e
-        except asyncio.TimeoutError:
-            print("Gemini API request timed out.")
-            raise TimeoutError("Gemini API request timed out")
+                METRICS.inc("http_requests_total", endpoint="gemini_generate", status=resp.status)
+                if resp.status != 200:
+                    error_text = await resp.text()
+                    raise error_for_status(resp.status, f"Gemini API returned error {resp.status}: {error_text}", "gemini_generate", resp.headers)
+
+                response_data = await resp.json(loads=loads)
+                candidates = response_data.get("candidates", [])
+                if not candidates:
+                    return None
+                generated_text = candidates[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+                try:
+                    return AnswerFormat(**loads(generated_text))
+                except (json.JSONDecodeError, ValidationError) as e:
+                    # Generation is sampled, so another attempt can produce a valid answer.
+                    raise TransientError(f"Invalid JSON response from Gemini API: {e}", "gemini_generate", resp.status) from e
+        except UpstreamError as e:
+            METRICS.inc("http_errors_total", endpoint="gemini_generate", error=type(e).__name__)
+            raise
         except Exception as e:
-            print(f"An unexpected error occurred: {e}")
-            raise RuntimeError("Unexpected error during API call to Gemini") from e
+            METRICS.inc("http_errors_total", endpoint="gemini_generate", error=type(e).__name__)
+            raise error_for_exception(e, "gemini_generate") from e
+        finally:
+            METRICS.observe("http_request_seconds", time.monotonic() - started, endpoint="gemini_generate")
 
 async def run_ethnicity_check(logger, data: Dict[str, Any], limiter: Optional[AsyncLimiter] = None) -> Optional[Dict[str, Any]]:
     gemini_api_key = os.environ.get("DANIEL_GEMINI_KEY")
     if not gemini_api_key:
         logger.error("Error: DANIEL_GEMINI_KEY environment variable not set.")
         return
-    async with aiohttp.ClientSession() as session:
+    skip_reason = ELIGIBILITY.check("ethnicity", source=data.get("source"))
+    if skip_reason:
+        data["skip_reason"] = skip_reason
+        return data
+    async with aiohttp.ClientSession(json_serialize=dumps) as session:
         try:
             names = []
-            matched_company_records = data.get("matched_company_records")
+            matched_company_records = COMPANIES.resolve(data)
             if len(matched_company_records) >= 1:
-                for k, v in data.items():
-                    if k == "matched_company_records":
-                        for j in range(len(v)):
-                            names.extend(v[j]["director_info"]["names_of_other_directors"])
+                for company in matched_company_records:
+                    # Companies ruled out in stage one have no directors worth profiling.
+                    if company.get("skip_reason"):
+                        ELIGIBILITY.skip("ethnicity", "earlier_stage")
+                        continue
+                    names.extend(company["director_info"]["names_of_other_directors"])
                 list(set(names))
             else:
                 names.append(data.get("full_name", ""))
             
             if len(names) >= 1:
                 for name in names:
+                    title = f"Ethnicity of {name}"
+                    if title in data:
+                        continue
                     prompt = Prompt(name)
                     ethnicity_chat = GeminiChat(gemini_api_key, prompt)
                     logger.info(f"Processing: {name}")
-                    if limiter:
-                        async with limiter:
-                            response = await ethnicity_chat.send_request(session)
-                    else:
-                        response = await ethnicity_chat.send_request(session)
+                    try:
+                        async with limited(limiter, endpoint="gemini_generate"):
+                            response = await ethnicity_chat.send_request(session, limiter=limiter)
+                    except UpstreamError as e:
+                        if is_retryable(e):
+                            raise
+                        logger.warning(f"Ethnicity check failed for {name}: {e}")
+                        continue
                     if response:
-                        title = f"Ethnicity of {name}"
                         data[title] = response.model_dump()
                     else:
                         logger.warning(f"No result for {name}")
+        except UpstreamError:
+            raise
         except Exception as e:
             logger.warning(f"Ethnicity check failed for data: {e}", exc_info=True)
             return None
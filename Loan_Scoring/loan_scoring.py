@@ -1,15 +1,28 @@
-from fake_useragent import UserAgent
 import aiohttp
 import asyncio
 import os
 import json
 import re
+import time
 from Models.models import *
-from typing import Dict, Optional, Any
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from typing import Dict, Optional, Any, List, Tuple, Union
 from aiolimiter import AsyncLimiter
+from Processor.metrics import METRICS, limited
+from Processor.resilience import RESILIENCE
+from Processor.errors import PermanentError, TransientError, UpstreamError, error_for_exception, error_for_status, is_retryable
+from Processor.user_agent import USER_AGENT
+from Processor.serialization import dumps, loads
+from Processor.eligibility import ELIGIBILITY
+from Processor.company_table import COMPANIES
+
+
+PERPLEXITY_API_URL = os.environ.get("PERPLEXITY_API_URL", "https://api.perplexity.ai")
 
 
 class Prompt:
+    _output_instruction = "STRICTLY return only a JSON object with the evaluation criteria. Do not include code blocks or additional explanation."
+
     def __init__(self, business_details = None):
         self.business_details = business_details
     
@@ -48,24 +61,74 @@ Evaluation Criteria:
     - Emphasize financial specifics, not general sector trends.
     - Source URLs must validate key points.
     - No assumptions without citation.
-    - STRICTLY return only a JSON object with the evaluation criteria. Do not include code blocks or additional explanation.
+    - {self._output_instruction}
 """
 
+
+class BatchPrompt(Prompt):
+    _output_instruction = (
+        "STRICTLY return only a JSON object of the form {\"results\": [...]} holding one evaluation object per company listed below, "
+        "each with the evaluation criteria and the company's \"company_number\" copied exactly as given. Do not include code blocks or additional explanation."
+    )
+
+    def __init__(self, businesses: List[Dict[str, Any]]):
+        super().__init__(business_details=businesses)
+
+    def construct_prompt(self) -> str:
+        companies = dumps(self.business_details)
+        return f"{super().construct_prompt()}\n  COMPANIES:\n{companies}\n"
+
+
+BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "schema": {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"company_number": {"type": "string"}},
+                        "required": ["company_number"]
+                    }
+                }
+            },
+            "required": ["results"]
+        }
+    }
+}
+
+
+class CompletionMessage(BaseModel):
+    content: str = ""
+
+
+class CompletionChoice(BaseModel):
+    message: CompletionMessage = Field(default_factory=CompletionMessage)
+
+
+class ChatCompletion(BaseModel):
+    choices: List[CompletionChoice] = Field(default_factory=list)
+
+
+COMPLETION_ADAPTER = TypeAdapter(ChatCompletion)
+EVALUATION_ADAPTER = TypeAdapter(EvaluationResponse)
+BATCH_EVALUATION_ADAPTER = TypeAdapter(Union[BatchEvaluationResponse, List[EvaluationResponse]])
+
  
 class PerplexityChat:
-    def __init__(self, api_key: str, prompt: Prompt):
+    def __init__(self, api_key: str, prompt: Prompt, response_format: Optional[Dict[str, Any]] = None):
         self.prompt = prompt.construct_prompt()
         self.api_key = api_key
+        self.response_format = response_format
         if not self.api_key:
             raise EnvironmentError("PERPLEXITY_API_KEY environment variable not set")
-        try:
-            self.ua = UserAgent().random
-        except Exception:
-            self.ua = "Mozilla/5.0 (compatible; PerplexityBot/1.0)"
+        self.ua = USER_AGENT.get()
 
-    async def send_request(self, session: aiohttp.ClientSession, timeout: float = 100.0) -> tuple[str, int]:
+    async def send_request(self, session: aiohttp.ClientSession, timeout: float = 100.0, limiter: Optional[AsyncLimiter] = None) -> tuple[str, int]:
         if not self.prompt:
-            return "Invalid prompt", 500
+            raise PermanentError("Invalid prompt", "perplexity_chat")
 
         body = {
             "model": "sonar-reasoning",
@@ -74,6 +137,8 @@ class PerplexityChat:
             ],
             "temperature": 0.01
         }
+        if self.response_format:
+            body["response_format"] = self.response_format
 
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -81,25 +146,30 @@ class PerplexityChat:
             "User-Agent": self.ua
         }
 
+        return await RESILIENCE.call("perplexity_chat", lambda: self.__post(session, headers, body, timeout), limiter)
+
+    async def __post(self, session: aiohttp.ClientSession, headers: Dict[str, str], body: Dict[str, Any], timeout: float) -> tuple[str, int]:
+        started = time.monotonic()
         try:
-            async with session.post("https://api.perplexity.ai/chat/completions", headers=headers, json=body, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
-                if resp.status == 200:
-                    try:
-                        result = await resp.json()
-                        content = result.get("choices", [{}])[0].get("message", {}).get("content", {})
-                        return content, 200
-                    except Exception as parse_err:
-                        return "Malformed response", 502
-                else:
+            async with session.post(f"{PERPLEXITY_API_URL}/chat/completions", headers=headers, json=body, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                METRICS.inc("http_requests_total", endpoint="perplexity_chat", status=resp.status)
+                if resp.status != 200:
                     error_text = await resp.text()
-                    return f"Error {resp.status}: {error_text}", resp.status
-
-        except aiohttp.ClientError as e:
-            return f"HTTP Client Error: {str(e)}", 503
-        except asyncio.TimeoutError:
-            return "Request timed out", 504
+                    raise error_for_status(resp.status, f"Error {resp.status}: {error_text}", "perplexity_chat", resp.headers)
+                try:
+                    completion = COMPLETION_ADAPTER.validate_json(await resp.read())
+                except ValidationError as e:
+                    raise TransientError(f"Malformed response: {e}", "perplexity_chat", resp.status) from e
+                content = completion.choices[0].message.content if completion.choices else ""
+                return content, 200
+        except UpstreamError as e:
+            METRICS.inc("http_errors_total", endpoint="perplexity_chat", error=type(e).__name__)
+            raise
         except Exception as e:
-            return f"Unexpected Error: {str(e)}", 500
+            METRICS.inc("http_errors_total", endpoint="perplexity_chat", error=type(e).__name__)
+            raise error_for_exception(e, "perplexity_chat") from e
+        finally:
+            METRICS.observe("http_request_seconds", time.monotonic() - started, endpoint="perplexity_chat")
 
 
 def extract_json_from_markdown_reasoning(response: str) -> Dict[str, Any]:
@@ -108,7 +178,7 @@ def extract_json_from_markdown_reasoning(response: str) -> Dict[str, Any]:
     
     if idx == -1:
         try:
-            return json.loads(response)
+            return loads(response)
         except json.JSONDecodeError as e:
             raise ValueError("No </think> marker found and content is not valid JSON") from e
 
@@ -122,7 +192,7 @@ def extract_json_from_markdown_reasoning(response: str) -> Dict[str, Any]:
         json_str = json_str[:-3].strip()
     
     try:
-        parsed_json = json.loads(json_str)
+        parsed_json = loads(json_str)
         return parsed_json
     except json.JSONDecodeError as e:
         raise ValueError("Failed to parse valid JSON from response content") from e
@@ -132,7 +202,7 @@ def extract_json_from_markdown(text):
     if match:
         json_str = match.group(1)
         try:
-            return json.loads(json_str)
+            return loads(json_str)
         except json.JSONDecodeError as e:
             print("JSON decoding failed:", e)
             return None
@@ -160,19 +230,19 @@ def extract_and_inject_json(completion: Dict[str, Any]) -> Dict[str, Any]:
         
         if json_candidate:
             try:
-                parsed_json = json.loads(json_candidate)
+                parsed_json = loads(json_candidate)
             except json.JSONDecodeError:
                 match = re.search(r"({.*})", raw_content, re.DOTALL)
                 if match:
                     json_candidate = match.group(1).strip()
-                    parsed_json = json.loads(json_candidate)
+                    parsed_json = loads(json_candidate)
                 else:
                     raise ValueError("No valid JSON object found via regex.")
         else:
             match = re.search(r"({.*})", raw_content, re.DOTALL)
             if match:
                 json_candidate = match.group(1).strip()
-                parsed_json = json.loads(json_candidate)
+                parsed_json = loads(json_candidate)
             else:
                 raise ValueError("No JSON object found in content.")
         return parsed_json
@@ -180,60 +250,183 @@ def extract_and_inject_json(completion: Dict[str, Any]) -> Dict[str, Any]:
         raise ValueError(f"Error extracting valid JSON from content: {e}")
 
 
-async def run_loan_scoring(logger, data: Dict[str, Any], limiter: Optional[AsyncLimiter] = None):
+def extract_json_payload(content: str) -> str:
+    marker = "</think>"
+    idx = content.rfind(marker)
+    if idx != -1:
+        content = content[idx + len(marker):]
+
+    starts = [i for i in (content.find("{"), content.find("[")) if i != -1]
+    if not starts:
+        raise ValueError("No JSON found in content.")
+    start = min(starts)
+    end = content.rfind("}" if content[start] == "{" else "]")
+    if end < start:
+        raise ValueError("Unterminated JSON in content.")
+    return content[start:end + 1]
+
+
+def parse_loan_score(logger, content: str) -> Dict[str, Any]:
+    if not content:
+        logger.error("Received empty loan score response")
+        return {}
+    try:
+        return EVALUATION_ADAPTER.validate_json(extract_json_payload(content)).model_dump()
+    except ValidationError as e:
+        # Out-of-range scores land here too; another completion usually gets them right.
+        METRICS.inc("loan_score_invalid_total")
+        raise TransientError(f"Invalid loan score response: {e}", "perplexity_chat") from e
+    except ValueError as e:
+        logger.error(f"Received invalid loan score response: {e}")
+        return {}
+
+
+def company_key(company: Dict[str, Any]) -> str:
+    return str(company.get("company_number") or company.get("company_name") or "")
+
+
+async def score_company(logger, api_key: str, business_details, limiter: Optional[AsyncLimiter] = None) -> Dict[str, Any]:
+    perplexity_chat = PerplexityChat(api_key=api_key, prompt=Prompt(business_details=business_details))
+    async with aiohttp.ClientSession(json_serialize=dumps) as session:
+        async with limited(limiter, endpoint="perplexity_chat"):
+            content, status = await perplexity_chat.send_request(session, limiter=limiter)
+    return parse_loan_score(logger, content)
+
+
+class LoanScoringBatcher:
+    """
+    Collects companies from concurrent `run_loan_scoring` calls and scores them
+    `batch_size` at a time in a single Perplexity request. Replies are matched back
+    by company number; whatever a batch fails to return is split in half and retried,
+    down to one company per request.
+    """
+    def __init__(self, api_key: str, logger, batch_size: int = 5, linger: float = 0.5):
+        self.api_key = api_key
+        self.logger = logger
+        self.batch_size = batch_size
+        self.linger = linger
+        self.__pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self.__timer: Optional[asyncio.TimerHandle] = None
+        self.__limiter: Optional[AsyncLimiter] = None
+        self.__tasks = set()
+
+    def __getstate__(self):
+        return {"api_key": self.api_key, "logger": self.logger, "batch_size": self.batch_size, "linger": self.linger}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    async def score(self, company: Dict[str, Any], limiter: Optional[AsyncLimiter] = None) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.__limiter = limiter or self.__limiter
+        self.__pending.append((company, future))
+        if len(self.__pending) >= self.batch_size:
+            self.__flush()
+        elif self.__timer is None:
+            self.__timer = loop.call_later(self.linger, self.__flush)
+        return await future
+
+    def __flush(self):
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+        batch, self.__pending = self.__pending, []
+        if batch:
+            task = asyncio.create_task(self.__run_batch(batch))
+            self.__tasks.add(task)
+            task.add_done_callback(self.__tasks.discard)
+
+    async def __run_batch(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        if len(batch) == 1:
+            company, future = batch[0]
+            try:
+                result = await score_company(self.logger, self.api_key, company, self.__limiter)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            return
+
+        try:
+            scores = await self.__request_batch([company for company, _ in batch])
+        except Exception as e:
+            if is_retryable(e):
+                # The upstream is struggling; splitting would only multiply requests. Let the pipeline retry.
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            self.logger.warning(f"Loan scoring batch of {len(batch)} failed: {e}")
+            scores = {}
+
+        unresolved = []
+        for company, future in batch:
+            score = scores.get(company_key(company))
+            if score is None:
+                unresolved.append((company, future))
+            elif not future.done():
+                future.set_result(score)
+
+        if len(unresolved) == 1:
+            await self.__run_batch(unresolved)
+        elif unresolved:
+            if scores:
+                self.logger.warning(f"Loan scoring batch returned {len(batch) - len(unresolved)}/{len(batch)} companies, splitting the rest")
+            mid = len(unresolved) // 2
+            await asyncio.gather(self.__run_batch(unresolved[:mid]), self.__run_batch(unresolved[mid:]))
+
+    async def __request_batch(self, companies: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        businesses = [{**company, "company_number": company_key(company)} for company in companies]
+        perplexity_chat = PerplexityChat(api_key=self.api_key, prompt=BatchPrompt(businesses), response_format=BATCH_RESPONSE_FORMAT)
+        async with aiohttp.ClientSession(json_serialize=dumps) as session:
+            async with limited(self.__limiter, endpoint="perplexity_chat"):
+                content, status = await perplexity_chat.send_request(session, limiter=self.__limiter)
+
+        parsed = BATCH_EVALUATION_ADAPTER.validate_json(extract_json_payload(content))
+        entries = parsed.results if isinstance(parsed, BatchEvaluationResponse) else parsed
+        return {entry.company_number: entry.model_dump() for entry in entries if entry.company_number}
+
+
+async def run_loan_scoring(logger, data: Dict[str, Any], limiter: Optional[AsyncLimiter] = None, batcher: Optional[LoanScoringBatcher] = None):
     perplexity_api_key = os.environ.get("PERPLEXITY_API_KEY")
     if not perplexity_api_key:
         logger.error("Error: PERPLEXITY_API_KEY environment variable not set.")
         return
+    skip_reason = ELIGIBILITY.check("loan_scoring", source=data.get("source"))
+    if skip_reason:
+        data["skip_reason"] = skip_reason
+        return data
 
-    matched_company_records = data.get("matched_company_records")
+    matched_company_records = COMPANIES.resolve(data)
     all_companies = data.get("all_companies")
     if len(matched_company_records) >= 1:
+        companies = []
         for company in matched_company_records:
-                prompt_obj = Prompt(business_details=company["company_info"])
-                perplexity_chat = PerplexityChat(api_key=perplexity_api_key, prompt=prompt_obj)
-                async with aiohttp.ClientSession() as session:
-                    if limiter:
-                        async with limiter:
-                            content, status = await perplexity_chat.send_request(session)
-                    else:
-                            content, status = await perplexity_chat.send_request(session)
-
-                    title = f"Loan Score for {company["company_info"]["company_name"]}"
-                    if content and content.strip().startswith("{"):
-                        try:
-                            data[title] = json.loads(content)
-                        except json.JSONDecodeError as e:
-                            logger.error("JSON decoding failed:", e)
-                            data[title] = {}
-                    else:
-                        try:
-                            data[title] = extract_json_from_markdown(content)
-                        except Exception as e:
-                            logger.error("Received empty or invalid response:", repr(content))
-                            data[title] = {}
+            # Companies ruled out in stage one are not worth a scoring call.
+            if company.get("skip_reason"):
+                ELIGIBILITY.skip("loan_scoring", "earlier_stage")
+                continue
+            companies.append((company["company_info"]["company_name"], company["company_info"]))
+    else:
+        companies = [(company, company) for company in all_companies]
+    # On a retry, companies scored by an earlier attempt are already in `data`.
+    companies = [(name, details) for name, details in companies if f"Loan Score for {name}" not in data]
+
+    if batcher:
+        scores = await asyncio.gather(*(
+            batcher.score(details if isinstance(details, dict) else {"company_name": details}, limiter)
+            for _, details in companies
+        ), return_exceptions=True)
+        errors = [score for score in scores if isinstance(score, BaseException)]
+        for (name, _), score in zip(companies, scores):
+            if not isinstance(score, BaseException):
+                data[f"Loan Score for {name}"] = score
+        if errors:
+            raise errors[0]
     else:
-        for company in all_companies:
-                prompt_obj = Prompt(business_details=company)
-                perplexity_chat = PerplexityChat(api_key=perplexity_api_key, prompt=prompt_obj)
-                async with aiohttp.ClientSession() as session:
-                    if limiter:
-                        async with limiter:
-                            content, status = await perplexity_chat.send_request(session)
-                    else:
-                            content, status = await perplexity_chat.send_request(session)
-
-                    title = f"Loan Score for {company}"
-                    if content and content.strip().startswith("{"):
-                            try:
-                                data[title] = json.loads(content)
-                            except json.JSONDecodeError as e:
-                                logger.error("JSON decoding failed:", e)
-                                data[title] = {}
-                    else:
-                        try:
-                            data[title] = extract_json_from_markdown(content)
-                        except Exception as e:
-                            logger.error("Received empty or invalid response:", repr(content))
-                            data[title] = {}
+        for name, details in companies:
+            data[f"Loan Score for {name}"] = await score_company(logger, perplexity_api_key, details, limiter)
     return data
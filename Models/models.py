@@ -1,10 +1,9 @@
-from dataclasses import dataclass
-from pydantic import BaseModel, Field, HttpUrl, conlist
-from typing import Optional, Literal, List, Annotated 
-from annotated_types import Len 
+from dataclasses import dataclass, fields
+from pydantic import BaseModel, ConfigDict, Field, AliasChoices, AliasPath, conlist, field_validator
+from typing import Any, Dict, Optional, Literal, List, Tuple
 
 
-@dataclass
+@dataclass(slots=True)
 class CompanyInfo:
     company_name: Optional[str] = None
     company_number: Optional[str] = None
@@ -17,7 +16,7 @@ class CompanyInfo:
     vat_registered: Optional[Literal["Yes", "No"]] = "No"
 
 
-@dataclass
+@dataclass(slots=True)
 class DirectorInfo:
     number_of_directors: Optional[int] = None
     names_of_other_directors: Optional[str] = None
@@ -28,7 +27,7 @@ class DirectorInfo:
     date_of_last_change_of_directors: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class FilingInfo:
     latest_account_filing_date: Optional[str] = None
     account_filing_in_past_month: Optional[Literal["Yes", "No", "Unavailable"]] = "Unavailable"
@@ -37,7 +36,7 @@ class FilingInfo:
     accounts_filed_early: Optional[Literal["Yes", "No", "Unavailable"]] = "Unavailable"
 
 
-@dataclass
+@dataclass(slots=True)
 class FinancialInfo:
     revenue_estimate: Optional[float] = None
     months_of_trading: Optional[int] = None
@@ -49,7 +48,7 @@ class FinancialInfo:
     staff_count: Optional[int] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class LegalInfo:
     outstanding_count: Optional[str]
     satisfied_count: Optional[str]
@@ -59,19 +58,42 @@ class LegalInfo:
     ccjs_status: Optional[Literal["Outstanding", "Satisfied", "Unavailable"]] = "Unavailable"
 
 
-@dataclass
+@dataclass(slots=True)
 class DirectorLoanInfo:
     director_loan_using_company_filings_pdf: Optional[Literal["Yes", "No", "Unavailable"]] = "Unavailable"
     director_loan_amount: Optional[float] = None
     director_loan_date: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class BusinessProfile:
     company_info: CompanyInfo
     director_info: DirectorInfo
     filing_info: FilingInfo
     legal_info: LegalInfo
+    skip_reason: Optional[str] = None
+    error: Optional[str] = None
+
+
+_FIELD_NAMES: Dict[type, Tuple[str, ...]] = {}
+
+
+def to_dict(obj) -> Dict[str, Any]:
+    """
+    Cheap replacement for `dataclasses.asdict`: nested dataclasses are converted,
+    but lists and dicts are shared by reference instead of being deep-copied.
+    """
+    cls = type(obj)
+    names = _FIELD_NAMES.get(cls)
+    if names is None:
+        names = _FIELD_NAMES[cls] = tuple(f.name for f in fields(cls))
+    result = {}
+    for name in names:
+        value = getattr(obj, name)
+        if hasattr(type(value), "__dataclass_fields__"):
+            value = to_dict(value)
+        result[name] = value
+    return result
 
 
 @dataclass
@@ -112,71 +134,141 @@ class CreditHealthOutput(BaseModel):
     legal_cases: List[LegalCase]
 
 
+def _score(value):
+    if isinstance(value, dict):
+        value = value.get("score")
+    if isinstance(value, str):
+        value = value.strip().rstrip("%")
+    try:
+        value = int(float(value))
+    except (TypeError, ValueError):
+        return None
+    if not 0 <= value <= 100:
+        raise ValueError(f"score {value} is outside 0-100")
+    return value
+
+
+def _string_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (str, dict)):
+        value = [value]
+    return [item if isinstance(item, str) else str(item) for item in value]
+
+
 class EvaluationResponse(BaseModel):
     """
-    Pydantic model for the comprehensive evaluation response.
+    Canonical, flat loan-score record. Accepts either these field names or the
+    labels the scoring prompt asks for ("FDS", "Loan Capacity", ...), whose values
+    may be bare scores or objects holding a score and summary.
     """
-    fds_score: int = Field(
-        ...,
+    model_config = ConfigDict(populate_by_name=True, extra="ignore")
+
+    company_number: Optional[str] = Field(
+        None,
+        description="Company the evaluation belongs to, echoed back in batched responses."
+    )
+    fds_score: Optional[int] = Field(
+        None,
         ge=0,
         le=100,
+        validation_alias=AliasChoices("fds_score", "FDS"),
         description="FDS (Financial Distress Score): Score based on signs of financial distress."
     )
-    fds_summary: str = Field(
-        ...,
-        max_length=150,
+    fds_summary: Optional[str] = Field(
+        None,
+        validation_alias=AliasChoices("fds_summary", AliasPath("FDS", "summary")),
         description="150-character summary with evidence for FDS."
     )
-    lui_score: int = Field(
-        ...,
+    lui_score: Optional[int] = Field(
+        None,
         ge=0,
         le=100,
+        validation_alias=AliasChoices("lui_score", "LUI"),
         description="LUI (Liquidity Urgency Index): Score for urgency of liquidity needs."
     )
-    lui_summary: str = Field(
-        ...,
-        max_length=150,
+    lui_summary: Optional[str] = Field(
+        None,
+        validation_alias=AliasChoices("lui_summary", AliasPath("LUI", "summary")),
         description="150-character summary with urgency/timeline for LUI."
     )
-    loan_capacity_score: int = Field(
-        ...,
+    loan_capacity_score: Optional[int] = Field(
+        None,
         ge=0,
         le=100,
+        validation_alias=AliasChoices("loan_capacity_score", "Loan Capacity"),
         description="Loan Capacity: Estimated funding amount, repayment capability, and top 3 ranked loan purposes score."
     )
-    market_signals_score: int = Field(
-        ...,
+    loan_capacity_range: Optional[str] = Field(
+        None,
+        validation_alias=AliasChoices(
+            "loan_capacity_range",
+            AliasPath("Loan Capacity", "funding_range"),
+            AliasPath("Loan Capacity", "range")
+        ),
+        description="Estimated funding amount (GBP range)."
+    )
+    market_signals_score: Optional[int] = Field(
+        None,
         ge=0,
         le=100,
+        validation_alias=AliasChoices("market_signals_score", "Market Signals"),
         description="Market Signals: Score based on external indicators like staff changes, legal disputes, or business expansion."
     )
-    would_work_with_new_loan_broker_score: int = Field(
-        ...,
+    would_work_with_new_loan_broker_score: Optional[int] = Field(
+        None,
         ge=0,
         le=100,
+        validation_alias=AliasChoices("would_work_with_new_loan_broker_score", "Would work with a new loan broker"),
         description="Score indicating willingness to work with a new loan broker (0-50=Unlikely, 51-70=Possible, 71-90=Likely, 91-100=Only possible options)."
     )
-    needs_a_loan_today_score: int = Field(
-        ...,
+    needs_a_loan_today_score: Optional[int] = Field(
+        None,
         ge=0,
         le=100,
+        validation_alias=AliasChoices("needs_a_loan_today_score", "Needs a loan today score"),
         description="Score indicating the urgency of needing a loan today (0-50=Unjustified, 51-70=Some specific, 71-90=Strong specific, 91-100=Critical specific)."
     )
-    recommended_timing: Literal["1-3 months", "3-6 months", "6-12 months", "12-18 months"] = Field(
-        ...,
-        description="Recommended timing for the loan."
+    recommended_timing: Optional[str] = Field(
+        None,
+        validation_alias=AliasChoices("recommended_timing", "Recommended Timing"),
+        description="Recommended timing for the loan (1-3, 3-6, 6-12 or 12-18 months)."
+    )
+    top_3_risks_for_lender: List[str] = Field(
+        default_factory=list,
+        validation_alias=AliasChoices("top_3_risks_for_lender", "Top 3 Risks for Lender"),
+        description="Three major concerns for getting lender approval."
+    )
+    top_3_loan_purposes: List[str] = Field(
+        default_factory=list,
+        validation_alias=AliasChoices("top_3_loan_purposes", "Top 3 Loan Purposes"),
+        description="Three main business context-specific use cases for the loan."
     )
-    top_3_risks_for_lender: Annotated[
-        List[str],
-        Len(min_length=3, max_length=3),
-        Field(description="Three major concerns for getting lender approval.")
-    ]
-    top_3_loan_purposes: Annotated[
-        List[str],
-        Len(min_length=3, max_length=3),
-        Field(description="Three main business context-specific use cases for the loan.")
-    ]
-    sources: List[HttpUrl] = Field(
-        ...,
+    sources: List[str] = Field(
+        default_factory=list,
+        validation_alias=AliasChoices("sources", "Sources"),
         description="List of URLs for all justifications and evidence."
-    )
\ No newline at end of file
+    )
+
+    @field_validator(
+        "fds_score", "lui_score", "loan_capacity_score", "market_signals_score",
+        "would_work_with_new_loan_broker_score", "needs_a_loan_today_score",
+        mode="before"
+    )
+    @classmethod
+    def _flatten_score(cls, value):
+        return _score(value)
+
+    @field_validator("company_number", "loan_capacity_range", "recommended_timing", mode="before")
+    @classmethod
+    def _stringify(cls, value):
+        return value if value is None or isinstance(value, str) else str(value)
+
+    @field_validator("top_3_risks_for_lender", "top_3_loan_purposes", "sources", mode="before")
+    @classmethod
+    def _flatten_list(cls, value):
+        return _string_list(value)
+
+
+class BatchEvaluationResponse(BaseModel):
+    results: List[EvaluationResponse]
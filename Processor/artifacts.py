@@ -0,0 +1,63 @@
+import bz2
+import gzip
+import lzma
+import os
+from pathlib import Path
+from typing import IO, Any, Optional, Union
+from Processor.serialization import dumps_bytes, loads
+
+
+ARTIFACT_GZIP_LEVEL = int(os.environ.get("ARTIFACT_GZIP_LEVEL", "6"))
+ARTIFACT_ZSTD_LEVEL = int(os.environ.get("ARTIFACT_ZSTD_LEVEL", "3"))
+CODECS = {".gz": "gzip", ".zst": "zstd", ".bz2": "bz2", ".xz": "xz"}
+JSON_SUFFIXES = tuple(".json" + suffix for suffix in ("", *CODECS))
+
+
+def codec_of(path: Union[str, Path]) -> Optional[str]:
+    return CODECS.get(Path(path).suffix.lower())
+
+
+def is_json_artifact(name: str) -> bool:
+    return name.lower().endswith(JSON_SUFFIXES)
+
+
+def open_artifact(path: Union[str, Path], mode: str = "r", codec: Optional[str] = None) -> IO:
+    """
+    Stream over an artifact, compressed on write and decompressed on read as it is
+    consumed, with the codec picked from the extension: .gz, .zst, .bz2, .xz or
+    none. Text unless `mode` has "b". zstd needs the `zstandard` package.
+    """
+    codec = codec or codec_of(path)
+    binary = "b" in mode
+    mode = mode if binary else mode + "t"
+    encoding = None if binary else "utf-8"
+    if codec == "gzip":
+        return gzip.open(path, mode, compresslevel=ARTIFACT_GZIP_LEVEL, encoding=encoding)
+    if codec == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError(f"{path}: .zst artifacts need the zstandard package (pip install zstandard)") from None
+        return zstandard.open(path, mode, cctx=zstandard.ZstdCompressor(level=ARTIFACT_ZSTD_LEVEL), encoding=encoding)
+    if codec == "bz2":
+        return bz2.open(path, mode, encoding=encoding)
+    if codec == "xz":
+        return lzma.open(path, mode, encoding=encoding)
+    return open(path, mode.replace("t", ""), encoding=encoding)
+
+
+def read_json(path: Union[str, Path]) -> Any:
+    # Bytes go straight to the JSON backend, skipping a separate UTF-8 decode.
+    with open_artifact(path, "rb") as f:
+        return loads(f.read())
+
+
+def write_json(path: Union[str, Path], data: Any, indent: Optional[int] = None):
+    """Writes `data` compactly (unless `indent` is given) through a temporary file, so readers never see a partial artifact."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    # One encoded buffer beats json.dump's pure-Python chunked encoder by several times.
+    with open_artifact(tmp_file, "wb", codec_of(path)) as f:
+        f.write(dumps_bytes(data, indent))
+    os.replace(tmp_file, path)
@@ -1,35 +1,148 @@
+from array import array
+from bisect import bisect_left
+from contextlib import suppress
+from itertools import chain
 from dataclasses import dataclass, field
-from typing import Dict, Optional, Set
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+import asyncio
+import base64
+import sys
 import time
 import datetime
-import json
 import os
+from Processor.serialization import dumps_bytes, loads
+
+
+class ProcessedIds:
+    """
+    Set of processed item ids for one input file. Ids are the 128-bit content hashes
+    from `item_key`, packed into two sorted arrays of unsigned 64-bit halves (16
+    bytes per id, against ~90 for a hex string in a list), with recent additions
+    buffered in a set until the next merge. Checkpoints store the arrays base64-encoded.
+    """
+    __slots__ = ("_high", "_low", "_recent")
+    _MERGE_THRESHOLD = 4096
+    _MASK = (1 << 64) - 1
+
+    def __init__(self, ids: Iterable[str] = ()):
+        self._high = array("Q")
+        self._low = array("Q")
+        self._recent: Set[int] = set()
+        for item_id in ids:
+            self.add(item_id)
+
+    @staticmethod
+    def _value(item_id: str) -> int:
+        digest = bytes.fromhex(item_id)
+        if len(digest) != 16:
+            raise ValueError(f"Item id must be a 16-byte hex digest, got {item_id!r}")
+        return int.from_bytes(digest, "big")
+
+    def add(self, item_id: str):
+        value = self._value(item_id)
+        if value not in self._recent and not self._find(value):
+            self._recent.add(value)
+            # A merge rewrites the arrays, so the buffer grows with them to keep adds amortized O(1).
+            if len(self._recent) >= max(self._MERGE_THRESHOLD, len(self._high) // 8):
+                self._merge()
+
+    def update(self, other: "ProcessedIds"):
+        self._merge()
+        other._merge()
+        self._store(sorted(set(self._values()).union(other._values())))
+
+    def __contains__(self, item_id: str) -> bool:
+        try:
+            value = self._value(item_id)
+        except (TypeError, ValueError):
+            return False
+        return value in self._recent or self._find(value)
+
+    def __len__(self) -> int:
+        return len(self._high) + len(self._recent)
+
+    def __iter__(self) -> Iterator[str]:
+        self._merge()
+        for value in self._values():
+            yield f"{value:032x}"
+
+    def _values(self) -> Iterator[int]:
+        return (high << 64 | low for high, low in zip(self._high, self._low))
+
+    def _find(self, value: int) -> bool:
+        high, low = value >> 64, value & self._MASK
+        idx = bisect_left(self._high, high)
+        while idx < len(self._high) and self._high[idx] == high:
+            if self._low[idx] == low:
+                return True
+            idx += 1
+        return False
+
+    def _store(self, values: List[int]):
+        self._high = array("Q", (value >> 64 for value in values))
+        self._low = array("Q", (value & self._MASK for value in values))
+
+    def _merge(self):
+        if self._recent:
+            # Already sorted plus a sorted tail: timsort merges the two runs in linear time.
+            self._store(sorted(chain(self._values(), sorted(self._recent))))
+            self._recent.clear()
+
+    def to_json(self) -> Dict[str, Any]:
+        # Unmerged ids are appended as they are and sorted by from_json, so a checkpoint never waits on a merge.
+        if not self:
+            return {}
+        high, low = array("Q", self._high), array("Q", self._low)
+        high.extend(value >> 64 for value in self._recent)
+        low.extend(value & self._MASK for value in self._recent)
+        if sys.byteorder == "big":
+            high.byteswap()
+            low.byteswap()
+        return {"high": base64.b64encode(high.tobytes()).decode(), "low": base64.b64encode(low.tobytes()).decode()}
+
+    @classmethod
+    def from_json(cls, data: Union[Dict[str, Any], List]) -> "ProcessedIds":
+        ids = cls()
+        if isinstance(data, dict) and "high" in data:
+            high, low = array("Q"), array("Q")
+            high.frombytes(base64.b64decode(data["high"]))
+            low.frombytes(base64.b64decode(data["low"]))
+            if len(high) != len(low):
+                raise ValueError("Processed id halves differ in length")
+            if sys.byteorder == "big":
+                high.byteswap()
+                low.byteswap()
+            ids._high, ids._low = high, low
+            ids._store(sorted(set(ids._values())))
+        # Older checkpoints list ids as strings; positional indices and "ranges" name no hashed item and are dropped.
+        for item_id in data if isinstance(data, list) else data.get("keys", []):
+            with suppress(TypeError, ValueError):
+                ids.add(item_id)
+        return ids
 
 
 @dataclass
 class ProcessingState:
     processed_files: Set[str] = field(default_factory=set)
-    processed_items: Dict[str, Set[str]] = field(default_factory=dict)
+    processed_items: Dict[str, ProcessedIds] = field(default_factory=dict)
     current_file: Optional[str] = None
     total_processed: int = 0
     total_items: int = 0
     started_at: float = field(default_factory=time.monotonic)
 
-    def save_checkpoint(self, logger, CONFIG: Dict):
-        CONFIG["CHECKPOINT_DIR"].mkdir(parents=True, exist_ok=True)
-        tmp_file = CONFIG["CHECKPOINT_DIR"] / "processing_state.tmp"
-        final_file = CONFIG["CHECKPOINT_DIR"] / "processing_state.json"
-        data = {
+    def snapshot(self) -> Dict[str, Any]:
+        return {
             "processed_files": list(self.processed_files),
-            "processed_items": {k: list(v) for k, v in self.processed_items.items()},
+            "processed_items": {k: v.to_json() for k, v in self.processed_items.items()},
             "current_file": self.current_file,
             "total_processed": self.total_processed,
             "total_items": self.total_items,
             "timestamp": datetime.datetime.now().isoformat()
         }
-        with open(tmp_file, "w") as f:
-            json.dump(data, f, indent=2)
-        os.replace(tmp_file, final_file)
+
+    def save_checkpoint(self, logger, CONFIG: Dict, fsync: bool = False):
+        write_checkpoint(self.snapshot(), CONFIG["CHECKPOINT_DIR"], fsync)
         logger.info(f"Checkpoint saved: {self.total_processed}/{self.total_items} items processed")
 
     @classmethod
@@ -39,11 +152,11 @@ class ProcessingState:
             logger.info("No checkpoint found, starting fresh")
             return cls()
         try:
-            with open(file, "r") as f:
-                data = json.load(f)
+            with open(file, "rb") as f:
+                data = loads(f.read())
             state = cls()
             state.processed_files = set(data.get("processed_files", []))
-            state.processed_items = {k: set(v) for k, v in data.get("processed_items", {}).items()}
+            state.processed_items = {k: ProcessedIds.from_json(v) for k, v in data.get("processed_items", {}).items()}
             state.current_file = data.get("current_file")
             state.total_processed = data.get("total_processed", 0)
             state.total_items = data.get("total_items", 0)
@@ -52,3 +165,114 @@ class ProcessingState:
         except Exception as e:
             logger.error(f"Failed to load checkpoint: {e}", exc_info=True)
             return cls()
+
+
+def write_checkpoint(data: Dict[str, Any], checkpoint_dir: Path, fsync: bool = False):
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    tmp_file = checkpoint_dir / "processing_state.tmp"
+    final_file = checkpoint_dir / "processing_state.json"
+    with open(tmp_file, "wb") as f:
+        f.write(dumps_bytes(data))
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_file, final_file)
+    if fsync:
+        # Make the rename itself durable.
+        fd = os.open(checkpoint_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class CheckpointWriter:
+    """
+    Saves a ProcessingState from a background task so consumers never wait on JSON
+    encoding or disk. `request` only marks the state dirty; the writer snapshots it
+    on the event loop and writes the snapshot in a thread, and requests made while
+    a write is running are coalesced into one follow-up write of the latest state.
+
+    `CHECKPOINT_FSYNC` is "never", "always" or "on_flush" (default), where only the
+    final `flush` is fsynced.
+    """
+    FSYNC_POLICIES = ("never", "always", "on_flush")
+
+    def __init__(self, state: ProcessingState, logger, CONFIG: Dict, on_saved: Optional[Callable[[], None]] = None):
+        self.state = state
+        self.logger = logger
+        self.checkpoint_dir = CONFIG["CHECKPOINT_DIR"]
+        self.fsync = CONFIG.get("CHECKPOINT_FSYNC", "on_flush")
+        if self.fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f"CHECKPOINT_FSYNC must be one of {self.FSYNC_POLICIES}, got {self.fsync!r}")
+        self.on_saved = on_saved
+        self.writes = 0
+        self.__savers: List[Tuple[Callable[[], Any], Callable[[Any], None]]] = []
+        self.__requested = 0
+        self.__written = 0
+        self.__fsync_requested = False
+        self.__wakeup = asyncio.Event()
+        self.__written_changed = asyncio.Condition()
+        self.__task: Optional[asyncio.Task] = None
+
+    def attach(self, snapshot: Callable[[], Any], write: Callable[[Any], None]):
+        """Saves another piece of state with every checkpoint: `snapshot` runs on the loop, `write` in the writer thread, before the checkpoint itself."""
+        self.__savers.append((snapshot, write))
+
+    def start(self):
+        if self.__task is None:
+            self.__task = asyncio.create_task(self.__run())
+
+    def request(self):
+        self.__requested += 1
+        self.__wakeup.set()
+
+    async def flush(self, fsync: Optional[bool] = None):
+        """Waits until the state as of this call is on disk."""
+        if fsync if fsync is not None else self.fsync != "never":
+            self.__fsync_requested = True
+        self.request()
+        target = self.__requested
+        if self.__task is None or self.__task.done():
+            await self.__write()
+            return
+        async with self.__written_changed:
+            await self.__written_changed.wait_for(lambda: self.__written >= target)
+
+    async def close(self):
+        await self.flush()
+        if self.__task is not None:
+            self.__task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.__task
+            self.__task = None
+
+    def __write_all(self, extra: List[Tuple[Callable[[Any], None], Any]], data: Dict[str, Any], fsync: bool):
+        for write, snapshot in extra:
+            write(snapshot)
+        write_checkpoint(data, self.checkpoint_dir, fsync)
+
+    async def __run(self):
+        while True:
+            await self.__wakeup.wait()
+            self.__wakeup.clear()
+            await self.__write()
+
+    async def __write(self):
+        target = self.__requested
+        fsync = self.fsync == "always" or self.__fsync_requested
+        self.__fsync_requested = False
+        data = self.state.snapshot()
+        extra = [(write, snapshot()) for snapshot, write in self.__savers]
+        try:
+            await asyncio.to_thread(self.__write_all, extra, data, fsync)
+            self.writes += 1
+            self.logger.info(f"Checkpoint saved: {data['total_processed']}/{data['total_items']} items processed")
+            if self.on_saved:
+                self.on_saved()
+        except Exception as e:
+            self.logger.error(f"Failed to save checkpoint: {e}", exc_info=True)
+        finally:
+            async with self.__written_changed:
+                self.__written = max(self.__written, target)
+                self.__written_changed.notify_all()
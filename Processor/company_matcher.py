@@ -1,7 +1,8 @@
 import re
 import json
-from typing import List, Dict
+from typing import List, Dict, Tuple
 from pathlib import Path
+from Processor.company_table import company_ref, companies_digest
 
 
 SUFFIXES = ['ltd', 'limited', 'plc', 'llp', 'inc', 'corp', 'co', 'services']
@@ -13,7 +14,12 @@ def normalize_company_name(name: str) -> str:
     name = re.sub(r'\s+', ' ', name).strip()  # Normalize whitespace
     return name
 
-def match_companies(dataset1: List[List[Dict]], dataset2: List[Dict]) -> List[Dict]:
+def match_companies(dataset1: List[List[Dict]], dataset2: List[Dict]) -> Tuple[List[Dict], Dict[str, Dict]]:
+    """
+    Matches people to resolved companies. Returns the person records, which
+    reference companies through `matched_company_refs`, and the company table
+    those refs point into, so a company shared by many people is stored once.
+    """
     normalized_map = {}
     for company_group in dataset1:
         for company_record in company_group:
@@ -23,34 +29,35 @@ def match_companies(dataset1: List[List[Dict]], dataset2: List[Dict]) -> List[Di
                 normalized_map[normalized_name] = company_record
 
     matched_data = []
+    companies = {}
 
     for person in dataset2:
         source = person.get("source")
         all_companies = person.get("companies", [])
         matched_names = []
+        matched_refs = []
         matched_records = []
 
         for company_name in all_companies:
             normalized = normalize_company_name(company_name)
             if normalized in normalized_map:
+                record = normalized_map[normalized]
+                ref = company_ref(record)
                 matched_names.append(company_name)
-                matched_records.append(normalized_map[normalized])
-
+                matched_refs.append(ref)
+                matched_records.append(record)
+                companies[ref] = record
+
+        matched = {
+            "all_companies": all_companies,
+            "matched_company_names": matched_names,
+            "matched_company_refs": matched_refs,
+            "matched_company_digest": companies_digest(matched_records),
+            "source": source
+        }
         fn = person.get("full_name", None)
         if fn:
-            matched_data.append({
-                "full_name": fn,
-                "all_companies": all_companies,
-                "matched_company_names": matched_names,
-                "matched_company_records": matched_records,
-                "source": source
-            })
-        else:
-            matched_data.append({
-                "all_companies": all_companies,
-                "matched_company_names": matched_names,
-                "matched_company_records": matched_records,
-                "source": source
-            })
-
-    return matched_data
+            matched = {"full_name": fn, **matched}
+        matched_data.append(matched)
+
+    return matched_data, companies
@@ -0,0 +1,68 @@
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from Processor.lookup_table import LookupTable, build_lookup_table
+from Processor.serialization import canonical
+
+
+def company_ref(profile: Dict[str, Any]) -> Optional[str]:
+    """Key of a company profile in the company table: its number, or its name for companies never resolved to one."""
+    info = profile.get("company_info") or {}
+    if info.get("company_number"):
+        return info["company_number"]
+    if info.get("company_name"):
+        return f"name:{info['company_name']}"
+    return None
+
+
+def companies_digest(profiles: List[Dict[str, Any]]) -> str:
+    """
+    Fingerprint of the referenced profiles. Person records carry it so that their
+    content hash, and with it delta runs, still changes when a referenced company does.
+    """
+    return hashlib.blake2b(canonical(profiles), digest_size=16).hexdigest()
+
+
+def write_company_table(path: Path, companies: Dict[str, Dict[str, Any]]) -> int:
+    return build_lookup_table(path, companies.items())
+
+
+class CompanyResolver:
+    """
+    Lazy view of the company table written after stage one. Person records hold
+    `matched_company_refs`; `resolve` turns them into profiles one record at a
+    time, decoding only the companies that record references. Records in the
+    older layout, with embedded `matched_company_records`, are returned as is.
+    """
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        self.__table: Optional[LookupTable] = None
+
+    def configure(self, CONFIG: Dict):
+        self.close()
+        self.path = CONFIG.get("COMPANIES_PATH")
+
+    def get(self, ref: str) -> Optional[Dict[str, Any]]:
+        if self.__table is None:
+            if not self.path or not Path(self.path).exists():
+                return None
+            self.__table = LookupTable(Path(self.path))
+        return self.__table.get(ref)
+
+    def resolve(self, record: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if "matched_company_records" in record:
+            return record["matched_company_records"] or []
+        companies = []
+        for ref in record.get("matched_company_refs") or []:
+            company = self.get(ref)
+            if company is not None:
+                companies.append(company)
+        return companies
+
+    def close(self):
+        if self.__table is not None:
+            self.__table.close()
+            self.__table = None
+
+
+COMPANIES = CompanyResolver()
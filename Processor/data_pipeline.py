@@ -1,26 +1,97 @@
 import asyncio
-import json
+import hashlib
+import math
 import os
 import random
+import time
+from contextlib import suppress
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Optional, Any, List
+from typing import Dict, Optional, Any, List, Set, Tuple
 from aiolimiter import AsyncLimiter
+from Processor.artifacts import is_json_artifact, read_json
+from Processor.checkpoint_processor import CheckpointWriter, ProcessedIds
+from Processor.delta import OutputManifest
+from Processor.results_store import RESULTS
+from Processor.serialization import canonical
+from Processor.scheduler import create_queue
+from Processor.metrics import METRICS, limited
+from Processor.errors import UpstreamError, is_retryable
+
+
+@dataclass(slots=True)
+class PipelineItem:
+    dataset: str
+    file: str
+    id: Any
+    data: Any
+
+
+def shard_of(key: str, num_shards: int) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") % num_shards
+
+
+def item_key(record: Any) -> str:
+    """Stable identity of an input record: a hash of its canonical JSON, independent of position and key order."""
+    return hashlib.blake2b(canonical(record), digest_size=16).hexdigest()
 
 
 class DataPipeline:
-    def __init__(self, ProcessingState, logger, dataset_paths: List[Path], CONFIG: Dict, resume: bool = True):
+    def __init__(self, ProcessingState, logger, dataset_paths: List[Path], CONFIG: Dict, resume: bool = True, shard: Optional[Tuple[int, int]] = None, profiler=None):
         self.logger = logger
+        self.shard = shard
+        self.profiler = profiler
         self.CONFIG = CONFIG
-        self.queue = asyncio.Queue(maxsize=self.CONFIG["QUEUE_SIZE"])
+        self.queue = create_queue(self.CONFIG)
         self.dataset_paths = dataset_paths
         self.state = ProcessingState.load_checkpoint(self.logger, self.CONFIG) if resume else ProcessingState
+        self.checkpoints = CheckpointWriter(self.state, self.logger, self.CONFIG, on_saved=profiler.checkpoint if profiler else None)
+        self.manifest: Optional[OutputManifest] = None
         self.processing_complete = asyncio.Event()
         self.results = []
+        # Every input item id this pipeline read, processed or not; None once a file could not be read.
+        self.input_ids: Optional[Set[str]] = set()
+        self.workers: Dict[int, asyncio.Task] = {}
+        self.min_workers = 1
+        self.max_workers = 1
+        self.in_flight = 0
+        self.live_workers = 0
+        self.latency: Optional[float] = None
+        self.__next_worker_id = 0
+        self.__consumer_args = None
+        self.__autoscaler: Optional[asyncio.Task] = None
+        self.__stopping = False
+
+    def owns(self, key: str, item_id) -> bool:
+        return self.shard is None or shard_of(f"{key}:{item_id}", self.shard[1]) == self.shard[0]
+
+    async def run(self, dataset_label: str, file_path: Path, process, limiter=None, semaphore=None, max_workers: Optional[int] = None):
+        if self.CONFIG.get("DELTA_MODE"):
+            self.manifest = OutputManifest(self.CONFIG["CHECKPOINT_DIR"] / "manifests", dataset_label, self.CONFIG.get("DELTA_MAX_AGE"))
+            await asyncio.to_thread(self.manifest.load, self.logger)
+            self.checkpoints.attach(self.manifest.snapshot, self.manifest.write)
+        if RESULTS.enabled:
+            self.checkpoints.attach(RESULTS.snapshot, RESULTS.write)
+        self.checkpoints.start()
+        self.start_consumers(
+            process, limiter, semaphore,
+            min_workers=self.CONFIG.get("MIN_CONCURRENT_REQUESTS", 1),
+            max_workers=max_workers or self.CONFIG["MAX_CONCURRENT_REQUESTS"]
+        )
+        await self.producer(dataset_label, file_path)
+        # The producer returns once everything is enqueued; the pool keeps scaling until the backlog is worked off.
+        await self.queue.join()
+        await self.stop_consumers()
+        await self.checkpoints.close()
+        if self.manifest:
+            await asyncio.to_thread(self.manifest.commit, self.logger)
+            self.manifest.close()
 
     async def scan_files(self, file_location: Path) -> List[str]:
+        # In delta mode a file is re-read every run and its records checked against the manifest instead.
         files = [
             f for f in os.listdir(file_location)
-            if f.endswith(".json") and f not in self.state.processed_files
+            if is_json_artifact(f) and (self.manifest or f not in self.state.processed_files)
         ]
         if self.state.current_file and self.state.current_file in files:
             files.remove(self.state.current_file)
@@ -41,82 +112,188 @@ class DataPipeline:
                 self.state.current_file = f
                 path = file_path / f
                 try:
-                    data = await asyncio.to_thread(lambda: json.load(path.open("r", encoding="utf-8")))
+                    data = await asyncio.to_thread(read_json, path)
                     if not isinstance(data, dict) and not isinstance(data, list):
+                        self.input_ids = None
                         self.logger.warning(f"{dataset_label}: Skipping {f} - invalid format")
                         continue
 
                     key = f"{dataset_label}:{f}"
-                    self.state.processed_items.setdefault(key, set())
-
-                    if isinstance(data, dict):
-                        for item_id, item_data in data.items():
-                            if item_id not in self.state.processed_items[key]:
-                                await self.queue.put({
-                                    "dataset": dataset_label,
-                                    "file": f,
-                                    "id": item_id,
-                                    "data": item_data
-                                })
-                            else:
-                                continue
-                    else:
-                        for id in range(len(data)):
-                            if id not in self.state.processed_items[key]:
-                                await self.queue.put({
-                                    "dataset": dataset_label,
-                                    "file": f,
-                                    "id": id,
-                                    "data": data[id]
-                                })
-                    
+                    processed = self.state.processed_items.setdefault(key, ProcessedIds())
+                    items = await asyncio.to_thread(self.identify, key, data)
+                    if self.input_ids is not None:
+                        self.input_ids.update(item_id for item_id, _ in items)
+                    reused = await asyncio.to_thread(self.manifest.get_many, (item_id for item_id, _ in items)) if self.manifest else {}
+                    if reused:
+                        self.logger.info(f"{dataset_label}: Reusing {len(reused)} unchanged records from {f}")
+
+                    for item_id, item_data in items:
+                        if item_id in reused:
+                            self.results.append(reused[item_id])
+                            if RESULTS.enabled:
+                                RESULTS.add(dataset_label, item_id, reused[item_id], item_data)
+                            METRICS.inc("pipeline_items_total", stage=dataset_label, status="reused")
+                        elif self.manifest or item_id not in processed:
+                            await self.queue.put(PipelineItem(dataset_label, f, item_id, item_data))
+
                     self.state.processed_files.add(f)
                     self.logger.info(f"File {f} is completely processed")
 
                 except Exception as e:
+                    self.input_ids = None
                     self.logger.error(f"Failed reading {f}: {e}", exc_info=True)
 
         except Exception as e:
+            self.input_ids = None
             self.logger.error(f"Producer error: {e}", exc_info=True)
 
-    async def consumer(self, process, worker_id: int, limiter=None, semaphore=None):
+    def identify(self, key: str, data: Any) -> List[Tuple[str, Any]]:
+        entries = data.items() if isinstance(data, dict) else ((None, record) for record in data)
+        items = []
+        for name, record in entries:
+            item_id = item_key(record if name is None else [name, record])
+            if self.owns(key, item_id):
+                items.append((item_id, record))
+        return items
+
+    def start_consumers(self, process, limiter=None, semaphore=None, min_workers: int = 1, max_workers: int = 1):
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.__consumer_args = (process, limiter, semaphore)
+        for _ in range(self.min_workers):
+            self.spawn_consumer()
+        if self.max_workers > self.min_workers:
+            self.__autoscaler = asyncio.create_task(self.autoscale(limiter))
+
+    def spawn_consumer(self):
+        worker_id = self.__next_worker_id
+        self.__next_worker_id += 1
+        process, limiter, semaphore = self.__consumer_args
+        idle_timeout = self.CONFIG.get("WORKER_IDLE_TIMEOUT") if self.max_workers > self.min_workers else None
+        task = asyncio.create_task(self.consumer(process, worker_id, limiter, semaphore, idle_timeout))
+        self.workers[worker_id] = task
+        self.live_workers += 1
+        METRICS.set("pipeline_workers", len(self.workers))
+        task.add_done_callback(lambda _: self.__forget_worker(worker_id))
+
+    def __forget_worker(self, worker_id: int):
+        self.workers.pop(worker_id, None)
+        METRICS.set("pipeline_workers", len(self.workers))
+
+    async def stop_consumers(self):
+        self.__stopping = True
+        if self.__autoscaler:
+            self.__autoscaler.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.__autoscaler
+        workers = list(self.workers.values())
+        # One sentinel per worker still reading the queue; retired workers may linger in `workers` until their callback runs.
+        for _ in range(self.live_workers):
+            await self.queue.put(None)
+        await asyncio.gather(*workers)
+
+    async def autoscale(self, limiter: Optional[AsyncLimiter] = None):
+        # Little's law: the number of workers needed to sustain the limiter's rate is rate * per-item latency.
+        # Without a limiter there is no target rate, so the pool grows to clear the queue within one interval.
+        target_rate = limiter.max_rate / limiter.time_period if limiter else None
+        interval = self.CONFIG.get("AUTOSCALE_INTERVAL", 1.0)
+        while True:
+            await asyncio.sleep(interval)
+            workers = self.live_workers
+            depth = self.queue.qsize()
+            if depth == 0 or workers >= self.max_workers:
+                continue
+            # Time the current pool needs for the queued items at the observed latency (one interval each until measured).
+            latency = self.latency or interval
+            if depth * latency / max(workers, 1) <= interval:
+                continue
+            if target_rate and self.latency:
+                desired = math.ceil(target_rate * self.latency)
+            else:
+                desired = max(workers * 2, math.ceil(depth * latency / interval))
+            desired = min(self.max_workers, max(1, desired))
+            if desired <= workers:
+                continue
+            for _ in range(desired - workers):
+                self.spawn_consumer()
+            latency = f"{self.latency:.2f}s" if self.latency else "n/a"
+            self.logger.info(f"Scaled consumers {workers} -> {desired} (queue={depth}, in_flight={self.in_flight}, latency={latency})")
+
+    def record_latency(self, seconds: float, alpha: float = 0.2):
+        self.latency = seconds if self.latency is None else alpha * seconds + (1 - alpha) * self.latency
+
+    async def consumer(self, process, worker_id: int, limiter=None, semaphore=None, idle_timeout: Optional[float] = None):
+        retired = False
         try:
             while True:
-                item = await self.queue.get()
+                if idle_timeout:
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), idle_timeout)
+                    except asyncio.TimeoutError:
+                        # The count drops here, before yielding, so workers timing out in the same tick can't all retire.
+                        if not self.__stopping and self.live_workers > self.min_workers:
+                            self.live_workers -= 1
+                            retired = True
+                            self.logger.info(f"Worker-{worker_id} idle for {idle_timeout}s, retiring")
+                            break
+                        continue
+                else:
+                    item = await self.queue.get()
                 if item is None:
                     self.logger.info(f"Worker-{worker_id} received shutdown signal")
                     break
 
+                METRICS.set("pipeline_queue_depth", self.queue.qsize(), stage=item.dataset)
+
                 try:
-                    dataset = item["dataset"]
-                    _file = item["file"]
-                    item_id = item["id"]
-                    data = item["data"]
+                    dataset = item.dataset
+                    _file = item.file
+                    item_id = item.id
+                    data = item.data
 
-                    if semaphore:
-                        async with semaphore:
+                    self.in_flight += 1
+                    METRICS.set("pipeline_in_flight", self.in_flight, stage=dataset)
+                    try:
+                        if semaphore:
+                            async with semaphore:
+                                result = await self.process_with_limiter(process, dataset, _file, item_id, data, limiter)
+                        else:
                             result = await self.process_with_limiter(process, dataset, _file, item_id, data, limiter)
-                    else:
-                        result = await self.process_with_limiter(process, dataset, _file, item_id, data, limiter)
+                    finally:
+                        self.in_flight -= 1
+                        METRICS.set("pipeline_in_flight", self.in_flight, stage=dataset)
 
+                    METRICS.inc("pipeline_items_total", stage=dataset, status="ok" if result else "empty")
                     if result:
                         key = f"{dataset}:{_file}"
-                        self.state.processed_items.setdefault(key, set()).add(item_id)
+                        self.state.processed_items.setdefault(key, ProcessedIds()).add(item_id)
                         self.state.total_processed += 1
                         self.results.append(result)
+                        if self.manifest:
+                            self.manifest.add(item_id, result)
+                        if RESULTS.enabled:
+                            RESULTS.add(dataset, item_id, result, data)
 
-                    if self.state.total_processed % self.CONFIG["CHECKPOINT_INTERVAL"] == 0:
-                        self.state.save_checkpoint(self.logger, self.CONFIG)
+                        # Only the worker whose item moved the count onto the interval asks for a checkpoint.
+                        if self.state.total_processed % self.CONFIG["CHECKPOINT_INTERVAL"] == 0:
+                            self.checkpoints.request()
 
-                    if self.state.total_processed % 100 == 0:
-                        self.logger.info(f"[Worker-{worker_id}] Total processed so far: {self.state.total_processed}")
+                        if self.state.total_processed % 100 == 0:
+                            self.logger.info(f"[Worker-{worker_id}] Total processed so far: {self.state.total_processed}")
 
+                except UpstreamError as e:
+                    METRICS.inc("pipeline_items_total", stage=item.dataset, status=type(e).__name__)
+                    self.logger.error(f"Consumer error on item {item.id}: {e}")
                 except Exception as e:
-                    self.logger.error(f"Consumer error on item {item.get('id')}: {e}", exc_info=True)
+                    METRICS.inc("pipeline_items_total", stage=item.dataset, status="error")
+                    self.logger.error(f"Consumer error on item {item.id}: {e}", exc_info=True)
                 finally:
                     self.queue.task_done()
         except Exception as e:
-            self.logger.error(f"Consumer error on item {item.get('id')}: {e}", exc_info=True)
+            self.logger.error(f"Worker-{worker_id} stopped: {e}", exc_info=True)
+        finally:
+            if not retired:
+                self.live_workers -= 1
 
     async def process_item(self, process, dataset: str, f: str, item_id: str, data: Dict[str, Any], limiter: Optional[AsyncLimiter] = None) -> Optional[Dict[str, Any]]:
         self.logger.debug(f"[{dataset}] Processed item {item_id} from {f}")
@@ -128,18 +305,29 @@ class DataPipeline:
             return await self.process_item(process, dataset, _file, item_id, data, rate_limiter)
 
         async def throttled_retry():
-            async with rate_limiter:
-                return await self.retry_with_backoff(wrapped)
+            async with limited(rate_limiter, stage=dataset):
+                started = time.monotonic()
+                try:
+                    return await self.retry_with_backoff(wrapped, stage=dataset)
+                finally:
+                    elapsed = time.monotonic() - started
+                    self.record_latency(elapsed)
+                    METRICS.observe("pipeline_item_seconds", elapsed, stage=dataset)
 
         return await throttled_retry()
 
-    async def retry_with_backoff(self, coro, retries=3, base_delay=0.5):
+    async def retry_with_backoff(self, coro, retries=3, base_delay=0.5, **labels):
         for attempt in range(retries):
             try:
                 return await coro()
             except Exception as e:
-                if attempt == retries - 1:
+                # Not-found and permanent errors give the same answer every time; only transient ones are worth retrying.
+                if attempt == retries - 1 or not is_retryable(e):
                     raise
                 delay = base_delay * (2 ** attempt) + random.uniform(0, 0.1)
-                self.logger.warning(f"[Retry] Attempt {attempt + 1} failed. Retrying in {delay:.2f}s...")
+                retry_after = getattr(e, "retry_after", None)
+                if retry_after:
+                    delay = max(delay, retry_after)
+                METRICS.inc("pipeline_retries_total", error=type(e).__name__, **labels)
+                self.logger.warning(f"[Retry] Attempt {attempt + 1} failed ({e}). Retrying in {delay:.2f}s...")
                 await asyncio.sleep(delay)
\ No newline at end of file
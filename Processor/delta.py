@@ -0,0 +1,92 @@
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from Processor.lookup_table import LookupTable, build_lookup_table
+from Processor.serialization import dumps, loads
+
+
+class OutputManifest:
+    """
+    Outputs of one stage keyed by the content hash of their input record, so a
+    delta run can reuse them for records that have not changed. Committed entries
+    live in a lookup table; outputs produced since the last commit are appended to
+    a JSON-lines journal alongside each checkpoint, so an interrupted run keeps
+    what it already paid for. `commit` rewrites the table with only the records
+    seen in the current input and drops the journal.
+    """
+    def __init__(self, directory: Path, stage: str, max_age: Optional[float] = None):
+        self.table_path = directory / f"{stage}.lkt"
+        self.journal_path = directory / f"{stage}.jsonl"
+        self.max_age = max_age
+        self.__table: Optional[LookupTable] = None
+        self.__journal: Dict[str, Tuple[float, Any]] = {}
+        self.__pending: List[Tuple[str, float, Any]] = []
+        self.__seen: Set[str] = set()
+
+    def load(self, logger):
+        if self.table_path.exists():
+            try:
+                self.__table = LookupTable(self.table_path)
+            except Exception as e:
+                logger.error(f"Failed to open output manifest {self.table_path}: {e}", exc_info=True)
+        if self.journal_path.exists():
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        item_id, at, output = loads(line)
+                    except ValueError:
+                        # A torn last line from an interrupted write.
+                        continue
+                    self.__journal[item_id] = (at, output)
+        logger.info(f"Output manifest {self.table_path.stem}: {len(self.__table) if self.__table else 0} committed, {len(self.__journal)} journaled")
+
+    def __fresh(self, at: float) -> bool:
+        return self.max_age is None or time.time() - at <= self.max_age
+
+    def get_many(self, item_ids: Iterable[str]) -> Dict[str, Any]:
+        item_ids = list(item_ids)
+        self.__seen.update(item_ids)
+        found = {}
+        if self.__table is not None:
+            for item_id, (at, output) in self.__table.get_many(item_ids).items():
+                if self.__fresh(at):
+                    found[item_id] = output
+        for item_id in item_ids:
+            entry = self.__journal.get(item_id)
+            if entry is not None and self.__fresh(entry[0]):
+                found[item_id] = entry[1]
+        return found
+
+    def add(self, item_id: str, output: Any):
+        at = time.time()
+        self.__journal[item_id] = (at, output)
+        self.__pending.append((item_id, at, output))
+
+    def snapshot(self) -> List[Tuple[str, float, Any]]:
+        pending, self.__pending = self.__pending, []
+        return pending
+
+    def write(self, pending: List[Tuple[str, float, Any]]):
+        if not pending:
+            return
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.writelines(dumps(entry) + "\n" for entry in pending)
+
+    def commit(self, logger) -> int:
+        """Compacts committed and journaled outputs for the records seen this run into a new table."""
+        entries = dict(self.__table.get_many(self.__seen)) if self.__table is not None else {}
+        entries.update((item_id, list(entry)) for item_id, entry in self.__journal.items() if item_id in self.__seen)
+        count = build_lookup_table(self.table_path, ((k, v) for k, v in entries.items() if self.__fresh(v[0])))
+        if self.__table is not None:
+            self.__table.close()
+        self.__table = LookupTable(self.table_path)
+        self.journal_path.unlink(missing_ok=True)
+        self.__journal.clear()
+        logger.info(f"Output manifest {self.table_path.stem} committed: {count} records")
+        return count
+
+    def close(self):
+        if self.__table is not None:
+            self.__table.close()
+            self.__table = None
@@ -0,0 +1,89 @@
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+from dateutil.relativedelta import relativedelta
+from Processor.metrics import METRICS
+
+
+class Eligibility:
+    """
+    Declarative filter for companies worth enriching, from `CONFIG["ELIGIBILITY"]`:
+
+        statuses          allowed Companies House statuses, e.g. ["active"]
+        min_age_years     minimum years since `date_of_creation`
+        max_age_years     maximum years since `date_of_creation`
+        sectors           allowed SIC sectors
+        excluded_sectors  SIC sectors to drop
+        sources           allowed input sources, e.g. ["Trust Pilot", "BidStats"]
+
+    Rules left unset allow everything, and a rule whose input is not known yet is
+    not applied, so the same check can run on a search hit and again on the full
+    profile. `check` returns the reason a company is ineligible, or None.
+    """
+    def __init__(self):
+        self.rules: Dict[str, Any] = {}
+        self.skips = Counter()
+
+    def configure(self, CONFIG: Dict):
+        self.rules = dict(CONFIG.get("ELIGIBILITY") or {})
+
+    def check(self, stage: str, status: Optional[str] = None, created: Optional[str] = None,
+              sectors: Optional[Iterable[str]] = None, source: Optional[str] = None) -> Optional[str]:
+        for rule, reason in (
+            ("source", self.__source(source)),
+            ("status", self.__status(status)),
+            ("age", self.__age(created)),
+            ("sector", self.__sector(sectors))
+        ):
+            if reason:
+                self.skip(stage, rule)
+                return reason
+        return None
+
+    def skip(self, stage: str, rule: str):
+        self.skips[(stage, rule)] += 1
+        METRICS.inc("eligibility_skips_total", stage=stage, rule=rule)
+
+    def report(self, logger):
+        for (stage, rule), count in sorted(self.skips.items()):
+            logger.info(f"Eligibility: {stage} skipped {count} by {rule}")
+
+    def __source(self, source: Optional[str]) -> Optional[str]:
+        allowed = self.rules.get("sources")
+        if allowed is None or source is None or source in allowed:
+            return None
+        return f"source {source} is not eligible"
+
+    def __status(self, status: Optional[str]) -> Optional[str]:
+        allowed = self.rules.get("statuses")
+        if allowed is None or status is None or status in allowed:
+            return None
+        return f"company status is {status}"
+
+    def __age(self, created: Optional[str]) -> Optional[str]:
+        min_age, max_age = self.rules.get("min_age_years"), self.rules.get("max_age_years")
+        if (min_age is None and max_age is None) or not created:
+            return None
+        try:
+            age = relativedelta(datetime.today(), datetime.strptime(created, "%Y-%m-%d")).years
+        except ValueError:
+            return None
+        if min_age is not None and age < min_age:
+            return f"incorporated {age} years ago, under {min_age}"
+        if max_age is not None and age > max_age:
+            return f"incorporated {age} years ago, over {max_age}"
+        return None
+
+    def __sector(self, sectors: Optional[Iterable[str]]) -> Optional[str]:
+        allowed, excluded = self.rules.get("sectors"), self.rules.get("excluded_sectors")
+        if sectors is None or (not allowed and not excluded):
+            return None
+        sectors = set(sectors)
+        if excluded and sectors & set(excluded):
+            return f"sector {', '.join(sorted(sectors & set(excluded)))} is excluded"
+        if allowed and not sectors & set(allowed):
+            return f"no SIC sector in {', '.join(allowed)}"
+        return None
+
+
+ELIGIBILITY = Eligibility()
@@ -0,0 +1,71 @@
+import asyncio
+import email.utils
+import time
+from typing import Mapping, Optional
+import aiohttp
+
+
+class UpstreamError(Exception):
+    def __init__(self, message: str, endpoint: str = "", status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.endpoint = endpoint
+        self.status = status
+        self.retry_after = retry_after
+
+
+class NotFoundError(UpstreamError):
+    """The upstream has nothing for this request; asking again will not change that."""
+
+
+class PermanentError(UpstreamError):
+    """The request itself is wrong (bad input, auth, malformed reply); do not retry."""
+
+
+class RateLimitedError(UpstreamError):
+    """The upstream asked us to slow down; retry after `retry_after` seconds."""
+
+
+class TransientError(UpstreamError):
+    """Timeouts, connection failures and 5xx responses; safe to retry with backoff."""
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    value = headers.get("Retry-After") if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def error_for_status(status: int, message: str, endpoint: str = "", headers: Optional[Mapping[str, str]] = None) -> UpstreamError:
+    if status == 404:
+        return NotFoundError(message, endpoint, status)
+    if status == 429:
+        return RateLimitedError(message, endpoint, status, parse_retry_after(headers))
+    if status >= 500 or status == 408:
+        return TransientError(message, endpoint, status, parse_retry_after(headers))
+    return PermanentError(message, endpoint, status)
+
+
+def error_for_exception(exc: BaseException, endpoint: str = "") -> UpstreamError:
+    if isinstance(exc, UpstreamError):
+        return exc
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return error_for_status(exc.status, str(exc), endpoint, exc.headers)
+    if isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError, TimeoutError)):
+        return TransientError(f"{type(exc).__name__}: {exc}", endpoint)
+    return PermanentError(f"{type(exc).__name__}: {exc}", endpoint)
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if not isinstance(exc, UpstreamError):
+        if not isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError, TimeoutError)):
+            return False
+        exc = error_for_exception(exc)
+    return isinstance(exc, (TransientError, RateLimitedError))
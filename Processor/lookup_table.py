@@ -0,0 +1,127 @@
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+from Processor.serialization import dumps_bytes, loads
+
+
+MAGIC = b"LKT1"
+HEADER = struct.Struct("<4sIQQQ")
+ENTRY = struct.Struct("<QIQI")
+
+
+def build_lookup_table(path: Path, items: Iterable[Tuple[str, Any]]) -> int:
+    """
+    Compiles (key, record) pairs into a lookup file: a header, a fixed-width index
+    sorted by key, the key bytes and a blob of compact JSON records. Records shared
+    by several keys are stored once. Later duplicates of a key win, like a dict.
+    Returns the number of keys.
+    """
+    by_key: Dict[bytes, Tuple[int, int]] = {}
+    blob = bytearray()
+    record_spans: Dict[int, Tuple[int, int]] = {}
+    keep_alive = []
+    for key, record in items:
+        if not key:
+            continue
+        span = record_spans.get(id(record))
+        if span is None:
+            data = dumps_bytes(record)
+            span = record_spans[id(record)] = (len(blob), len(data))
+            blob += data
+            # Keep the record alive so its id() cannot be reused by another object while building.
+            keep_alive.append(record)
+        by_key[key.encode()] = span
+
+    keys = sorted(by_key)
+    key_bytes = bytearray()
+    index = bytearray()
+    for key in keys:
+        rec_off, rec_len = by_key[key]
+        index += ENTRY.pack(len(key_bytes), len(key), rec_off, rec_len)
+        key_bytes += key
+
+    index_off = HEADER.size
+    keys_off = index_off + len(index)
+    blob_off = keys_off + len(key_bytes)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_suffix(".tmp")
+    with open(tmp_file, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(keys), index_off, keys_off, blob_off))
+        f.write(index)
+        f.write(key_bytes)
+        f.write(blob)
+    os.replace(tmp_file, path)
+    return len(keys)
+
+
+class LookupTable:
+    """
+    Read-only, memory-mapped view of a file written by `build_lookup_table`. Opening
+    is O(1) and pages are shared between processes mapping the same file; keys are
+    found by binary search over the index and records decoded on demand.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.__mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.__count, self.__index_off, self.__keys_off, self.__blob_off = HEADER.unpack_from(self.__mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a lookup table")
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def __contains__(self, key: str) -> bool:
+        return self.__find(key.encode(), 0) is not None
+
+    def __key_at(self, i: int) -> bytes:
+        key_off, key_len, _, _ = ENTRY.unpack_from(self.__mm, self.__index_off + i * ENTRY.size)
+        start = self.__keys_off + key_off
+        return self.__mm[start:start + key_len]
+
+    def __record_at(self, i: int) -> Any:
+        _, _, rec_off, rec_len = ENTRY.unpack_from(self.__mm, self.__index_off + i * ENTRY.size)
+        start = self.__blob_off + rec_off
+        return loads(self.__mm[start:start + rec_len])
+
+    def __lower_bound(self, key: bytes, lo: int) -> int:
+        hi = self.__count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.__key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def __find(self, key: bytes, lo: int) -> Optional[int]:
+        i = self.__lower_bound(key, lo)
+        return i if i < self.__count and self.__key_at(i) == key else None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        i = self.__find(key.encode(), 0)
+        return default if i is None else self.__record_at(i)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Probes a batch of keys in sorted order, each search starting where the last one ended."""
+        found = {}
+        lo = 0
+        for key in sorted({k.encode() for k in keys if k}):
+            lo = self.__lower_bound(key, lo)
+            if lo >= self.__count:
+                break
+            if self.__key_at(lo) == key:
+                found[key.decode()] = self.__record_at(lo)
+        return found
+
+    def close(self):
+        self.__mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return None
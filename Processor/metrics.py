@@ -0,0 +1,249 @@
+import asyncio
+import datetime
+import time
+from bisect import bisect_left
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from Processor.artifacts import write_json
+from Processor.serialization import dumps
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for idx, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[idx - 1] if idx > 0 else 0.0
+                if idx == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[idx] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """
+    In-process counters, gauges and latency histograms, exported as Prometheus text
+    on a local port and/or as a periodic JSON snapshot.
+    """
+    def __init__(self):
+        self.counters: Dict[str, Dict[LabelSet, float]] = {}
+        self.gauges: Dict[str, Dict[LabelSet, float]] = {}
+        self.histograms: Dict[str, Dict[LabelSet, Histogram]] = {}
+        self.__server: Optional[asyncio.AbstractServer] = None
+        self.__snapshot_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _labels(labels: Dict[str, Any]) -> LabelSet:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = self._labels(labels)
+        series[key] = series.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        self.gauges.setdefault(name, {})[self._labels(labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        series = self.histograms.setdefault(name, {})
+        key = self._labels(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    def cache(self, cache: str, hit: bool):
+        self.inc("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def reset(self):
+        self.counters.clear()
+        self.gauges.clear()
+        self.histograms.clear()
+
+    def to_prometheus(self) -> str:
+        def fmt(labels: LabelSet, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+            pairs = labels + extra
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines = []
+        for kind, families in (("counter", self.counters), ("gauge", self.gauges)):
+            for name, series in sorted(families.items()):
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in series.items():
+                    lines.append(f"{name}{fmt(labels)} {value}")
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{fmt(labels, (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{fmt(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{fmt(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        def series(families: Dict[str, Dict[LabelSet, float]]) -> List[Dict[str, Any]]:
+            return [
+                {"name": name, "labels": dict(labels), "value": value}
+                for name, entries in sorted(families.items())
+                for labels, value in entries.items()
+            ]
+
+        return {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "counters": series(self.counters),
+            "gauges": series(self.gauges),
+            "histograms": [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "p50": histogram.quantile(0.5),
+                    "p90": histogram.quantile(0.9),
+                    "p99": histogram.quantile(0.99)
+                }
+                for name, entries in sorted(self.histograms.items())
+                for labels, histogram in entries.items()
+            ]
+        }
+
+    def write_snapshot(self, path: Path):
+        write_json(path, self.snapshot(), indent=2)
+
+    def dump(self) -> Dict[str, Any]:
+        """Raw series, bucket counts included, for merge() in another process."""
+        def series(families: Dict[str, Dict[LabelSet, Any]], value) -> List[Dict[str, Any]]:
+            return [
+                {"name": name, "labels": dict(labels), **value(entry)}
+                for name, entries in sorted(families.items())
+                for labels, entry in entries.items()
+            ]
+
+        return {
+            "timestamp": time.time(),
+            "counters": series(self.counters, lambda value: {"value": value}),
+            "gauges": series(self.gauges, lambda value: {"value": value}),
+            "histograms": series(self.histograms, lambda histogram: {
+                "buckets": list(histogram.buckets),
+                "counts": histogram.counts,
+                "sum": histogram.sum,
+                "count": histogram.count
+            })
+        }
+
+    def merge(self, dumps: List[Dict[str, Any]]):
+        """
+        Folds dump()s from other processes into these metrics: counters and
+        histograms are summed, and gauges keep the value from the latest dump.
+        """
+        for data in sorted(dumps, key=lambda data: data["timestamp"]):
+            for entry in data["counters"]:
+                self.inc(entry["name"], entry["value"], **entry["labels"])
+            for entry in data["gauges"]:
+                self.set(entry["name"], entry["value"], **entry["labels"])
+            for entry in data["histograms"]:
+                series = self.histograms.setdefault(entry["name"], {})
+                key = self._labels(entry["labels"])
+                histogram = series.get(key)
+                if histogram is None:
+                    histogram = series[key] = Histogram(tuple(entry["buckets"]))
+                histogram.counts = [a + b for a, b in zip(histogram.counts, entry["counts"])]
+                histogram.sum += entry["sum"]
+                histogram.count += entry["count"]
+
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.split()
+            path = parts[1].decode() if len(parts) > 1 else "/"
+            if path == "/metrics":
+                status, content_type, body = "200 OK", "text/plain; version=0.0.4", self.to_prometheus()
+            elif path == "/metrics.json":
+                status, content_type, body = "200 OK", "application/json", dumps(self.snapshot())
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", "Not Found\n"
+            payload = body.encode()
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode()
+                + payload
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, logger, CONFIG: Dict):
+        port = CONFIG.get("METRICS_PORT")
+        if port:
+            self.__server = await asyncio.start_server(self.__handle, CONFIG.get("METRICS_HOST", "127.0.0.1"), port)
+            logger.info(f"Serving Prometheus metrics on :{port}/metrics")
+        snapshot_path = CONFIG.get("METRICS_SNAPSHOT_PATH")
+        if snapshot_path:
+            self.__snapshot_task = asyncio.create_task(self.__write_snapshots(Path(snapshot_path), CONFIG.get("METRICS_SNAPSHOT_INTERVAL", 30)))
+
+    async def __write_snapshots(self, path: Path, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(write_json, path, self.snapshot(), indent=2)
+
+    async def stop(self, CONFIG: Dict):
+        if self.__snapshot_task:
+            self.__snapshot_task.cancel()
+            self.__snapshot_task = None
+        if CONFIG.get("METRICS_SNAPSHOT_PATH"):
+            self.write_snapshot(Path(CONFIG["METRICS_SNAPSHOT_PATH"]))
+        if self.__server:
+            self.__server.close()
+            await self.__server.wait_closed()
+            self.__server = None
+
+
+METRICS = Metrics()
+
+
+@asynccontextmanager
+async def limited(limiter, **labels):
+    if limiter is None:
+        yield
+        return
+    started = time.monotonic()
+    async with limiter:
+        METRICS.observe("limiter_wait_seconds", time.monotonic() - started, **labels)
+        yield
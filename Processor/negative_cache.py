@@ -0,0 +1,104 @@
+import fcntl
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from Processor.artifacts import read_json, write_json
+from Processor.company_matcher import normalize_company_name
+from Processor.metrics import METRICS
+
+
+class NegativeCache:
+    """
+    Remembers lookups that an upstream answered with not-found, so retries, repeated
+    inputs and later runs do not spend requests or limiter tokens on them again.
+    Keys are normalized search terms; entries expire after `ttl` seconds and the
+    oldest are evicted beyond `max_entries`. The cache is persisted as JSON and
+    merged with the file on disk when saved, under an exclusive lock on a sidecar
+    file, so shard processes saving at once keep each other's entries.
+    """
+    def __init__(self, path: Optional[Path] = None, ttl: float = 30 * 86400, max_entries: int = 100_000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.__entries: Dict[str, Tuple[float, str]] = {}
+
+    def configure(self, CONFIG: Dict):
+        path = CONFIG.get("NEGATIVE_CACHE_PATH", CONFIG["CHECKPOINT_DIR"] / "negative_cache.json")
+        self.path = Path(path) if path else None
+        self.ttl = CONFIG.get("NEGATIVE_CACHE_TTL", self.ttl)
+        self.max_entries = CONFIG.get("NEGATIVE_CACHE_MAX_ENTRIES", self.max_entries)
+
+    @staticmethod
+    def _key(namespace: str, key: str) -> str:
+        return f"{namespace}:{normalize_company_name(key) or key.strip().lower()}"
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        cache_key = self._key(namespace, key)
+        entry = self.__entries.get(cache_key)
+        if entry is not None and entry[0] <= time.time():
+            del self.__entries[cache_key]
+            entry = None
+        METRICS.cache(f"negative_{namespace}", entry is not None)
+        return entry[1] if entry else None
+
+    def add(self, namespace: str, key: str, reason: str = "not found"):
+        cache_key = self._key(namespace, key)
+        self.__entries.pop(cache_key, None)
+        self.__entries[cache_key] = (time.time() + self.ttl, reason)
+        self.__evict()
+
+    def clear(self):
+        self.__entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __evict(self):
+        while len(self.__entries) > self.max_entries:
+            del self.__entries[next(iter(self.__entries))]
+
+    def __merge(self, entries: Dict[str, Tuple[float, str]]):
+        now = time.time()
+        merged = {k: v for k, v in entries.items() if v[0] > now}
+        for k, v in self.__entries.items():
+            if v[0] > now and (k not in merged or merged[k][0] < v[0]):
+                merged[k] = v
+        self.__entries = dict(sorted(merged.items(), key=lambda item: item[1][0]))
+        self.__evict()
+
+    def __read(self) -> Dict[str, Tuple[float, str]]:
+        if not self.path or not self.path.exists():
+            return {}
+        return {k: (expires, reason) for k, (expires, reason) in read_json(self.path).items()}
+
+    @contextmanager
+    def __locked(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_name(f"{self.path.name}.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def load(self, logger):
+        try:
+            self.__merge(self.__read())
+            logger.info(f"Negative cache loaded: {len(self.__entries)} entries")
+        except Exception as e:
+            logger.error(f"Failed to load negative cache: {e}", exc_info=True)
+
+    def save(self, logger):
+        if not self.path:
+            return
+        try:
+            with self.__locked():
+                self.__merge(self.__read())
+                write_json(self.path, self.__entries)
+            logger.info(f"Negative cache saved: {len(self.__entries)} entries")
+        except Exception as e:
+            logger.error(f"Failed to save negative cache: {e}", exc_info=True)
+
+
+NEGATIVE_CACHE = NegativeCache()
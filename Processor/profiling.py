@@ -0,0 +1,166 @@
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Optional
+
+
+def profile_dir(CONFIG: Dict) -> Path:
+    return Path(CONFIG.get("PROFILE_DIR") or Path(CONFIG["CHECKPOINT_DIR"]).parent / "profiles")
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the event loop thread, and of any busy helper threads such
+    as the `asyncio.to_thread` pool, every `interval` seconds. Stacks are kept in collapsed form ("a;b;c count"), which flamegraph
+    tools read directly.
+    """
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.__thread_id: Optional[int] = None
+        self.__thread: Optional[threading.Thread] = None
+        self.__running = threading.Event()
+
+    def enable(self):
+        self.__thread_id = threading.get_ident()
+        self.__running.set()
+        self.__thread = threading.Thread(target=self.__sample, name="sampling-profiler", daemon=True)
+        self.__thread.start()
+
+    def disable(self):
+        self.__running.clear()
+        if self.__thread:
+            self.__thread.join()
+            self.__thread = None
+
+    def __sample(self):
+        own_id = threading.get_ident()
+        while self.__running.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                # Idle worker threads (e.g. the to_thread pool) sit in a wait; only count threads doing work.
+                if stack and (thread_id == self.__thread_id or not stack[0].startswith(("wait ", "_worker ("))):
+                    self.stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def dump_stats(self, path: Path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def report(self, top_n: int) -> str:
+        total = sum(self.stacks.values()) or 1
+        own, inclusive = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        lines = [f"{total} samples every {self.interval * 1000:g}ms", "", "self%   total%  function"]
+        for frame, count in own.most_common(top_n):
+            lines.append(f"{100 * count / total:5.1f}  {100 * inclusive[frame] / total:6.1f}  {frame}")
+        return "\n".join(lines) + "\n"
+
+
+class StageProfiler:
+    """
+    Opt-in profiling for one pipeline stage, enabled by CONFIG["PROFILE"]
+    ("cprofile" or "sample"). The profiler covers everything the event loop runs
+    while the stage is active: the producer, the consumers and the process
+    callables. tracemalloc snapshots are taken at every checkpoint and the top-N
+    allocation sites are written next to the checkpoint directory.
+    """
+    def __init__(self, logger, CONFIG: Dict, stage: str):
+        self.logger = logger
+        self.stage = stage
+        self.mode = CONFIG.get("PROFILE")
+        self.top_n = CONFIG.get("PROFILE_TOP_N", 30)
+        self.sample_interval = CONFIG.get("PROFILE_SAMPLE_INTERVAL", 0.005)
+        self.traceback_frames = CONFIG.get("PROFILE_TRACEBACK_FRAMES", 1)
+        self.directory = profile_dir(CONFIG)
+        self.__profiler = None
+        self.__snapshots = 0
+        self.__previous: Optional[tracemalloc.Snapshot] = None
+        self.__started_tracemalloc = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.mode)
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.traceback_frames)
+            self.__started_tracemalloc = True
+        if self.mode == "sample":
+            self.__profiler = SamplingProfiler(self.sample_interval)
+        else:
+            self.__profiler = cProfile.Profile()
+        self.__profiler.enable()
+        self.logger.info(f"Profiling stage {self.stage} ({self.mode}) into {self.directory}")
+
+    def checkpoint(self, label: Optional[str] = None):
+        if not self.enabled or not tracemalloc.is_tracing():
+            return
+        self.__snapshots += 1
+        # Keep the snapshot itself out of the CPU profile.
+        if self.__profiler is not None:
+            self.__profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"stage={self.stage} checkpoint={label or self.__snapshots} current={current / 2**20:.1f}MiB peak={peak / 2**20:.1f}MiB", ""]
+        lines.append(f"Top {self.top_n} allocation sites")
+        lines.extend(str(stat) for stat in snapshot.statistics("lineno")[:self.top_n])
+        if self.__previous is not None:
+            lines.extend(["", f"Top {self.top_n} growth since previous checkpoint"])
+            lines.extend(str(stat) for stat in snapshot.compare_to(self.__previous, "lineno")[:self.top_n])
+        self.__previous = snapshot
+        path = self.directory / f"{self.stage}-alloc-{self.__snapshots:04d}.txt"
+        path.write_text("\n".join(lines) + "\n")
+        if self.__profiler is not None:
+            self.__profiler.enable()
+
+    def stop(self):
+        if not self.enabled or self.__profiler is None:
+            return
+        self.checkpoint("final")
+        self.__profiler.disable()
+        if self.__started_tracemalloc:
+            tracemalloc.stop()
+            self.__started_tracemalloc = False
+        if isinstance(self.__profiler, SamplingProfiler):
+            self.__profiler.dump_stats(self.directory / f"{self.stage}.collapsed")
+            report = self.__profiler.report(self.top_n)
+        else:
+            self.__profiler.dump_stats(self.directory / f"{self.stage}.prof")
+            out = io.StringIO()
+            stats = pstats.Stats(self.__profiler, stream=out)
+            stats.sort_stats("cumulative").print_stats(self.top_n)
+            stats.sort_stats("tottime").print_stats(self.top_n)
+            report = out.getvalue()
+        (self.directory / f"{self.stage}.txt").write_text(report)
+        self.__profiler = None
+        self.logger.info(f"Profile for stage {self.stage} written to {self.directory}")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return None
+
@@ -0,0 +1,195 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+from Processor.errors import TransientError, is_retryable
+from Processor.metrics import METRICS
+
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(TransientError):
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(f"Circuit for {endpoint} is open, retry in {retry_in:.1f}s", endpoint, retry_after=retry_in)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive upstream failures and rejects calls
+    for `recovery_seconds`. After that a single probe is let through (half-open):
+    success closes the circuit, failure opens it again.
+    """
+    def __init__(self, endpoint: str, failure_threshold: int = 5, recovery_seconds: float = 30.0):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.__probing = False
+
+    def before_call(self):
+        if self.state == CLOSED:
+            return
+        retry_in = self.opened_at + self.recovery_seconds - time.monotonic()
+        if self.state == OPEN and retry_in <= 0:
+            self.__set_state(HALF_OPEN)
+        if self.state == HALF_OPEN and not self.__probing:
+            self.__probing = True
+            return
+        METRICS.inc("circuit_rejections_total", endpoint=self.endpoint)
+        raise CircuitOpenError(self.endpoint, max(retry_in, 0.0))
+
+    def record_success(self):
+        self.failures = 0
+        self.__probing = False
+        if self.state != CLOSED:
+            self.__set_state(CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self.__probing = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self.__set_state(OPEN)
+
+    def release(self):
+        # A call that ended without telling us anything about upstream health (e.g. a 404).
+        self.__probing = False
+
+    def __set_state(self, state: str):
+        self.state = state
+        METRICS.set("circuit_state", STATE_VALUES[state], endpoint=self.endpoint)
+
+
+class HedgeBudget:
+    """
+    Token bucket that allows at most `ratio` hedges per request on average, with a
+    small burst, so hedging can never multiply upstream load.
+    """
+    def __init__(self, ratio: float = 0.05, burst: float = 10.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = 0.0
+
+    def deposit(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class Resilience:
+    """
+    Per-endpoint circuit breakers, call timeouts and optional hedged requests for
+    the HTTP clients. A hedge is a duplicate request fired once the original has
+    been outstanding for longer than the endpoint's observed `hedge_quantile`
+    latency; the first reply wins. Hedges are only sent while the hedge budget
+    and the rate limiter both have room.
+    """
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.budgets: Dict[str, HedgeBudget] = {}
+        self.failure_threshold = 5
+        self.recovery_seconds = 30.0
+        self.timeouts: Dict[str, float] = {}
+        self.hedge_endpoints = ()
+        self.hedge_quantile = 0.95
+        self.hedge_budget = 0.05
+        self.hedge_min_samples = 20
+
+    def configure(self, CONFIG: Dict):
+        self.failure_threshold = CONFIG.get("CIRCUIT_FAILURE_THRESHOLD", self.failure_threshold)
+        self.recovery_seconds = CONFIG.get("CIRCUIT_RECOVERY_SECONDS", self.recovery_seconds)
+        self.timeouts = dict(CONFIG.get("UPSTREAM_TIMEOUTS", self.timeouts))
+        self.hedge_endpoints = tuple(CONFIG.get("HEDGE_ENDPOINTS", self.hedge_endpoints))
+        self.hedge_quantile = CONFIG.get("HEDGE_QUANTILE", self.hedge_quantile)
+        self.hedge_budget = CONFIG.get("HEDGE_BUDGET", self.hedge_budget)
+        self.hedge_min_samples = CONFIG.get("HEDGE_MIN_SAMPLES", self.hedge_min_samples)
+        self.breakers.clear()
+        self.budgets.clear()
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker(endpoint, self.failure_threshold, self.recovery_seconds)
+        return breaker
+
+    def timeout(self, endpoint: str) -> Optional[float]:
+        matches = [prefix for prefix in self.timeouts if endpoint.startswith(prefix)]
+        return self.timeouts[max(matches, key=len)] if matches else None
+
+    def hedge_delay(self, endpoint: str) -> Optional[float]:
+        if not endpoint.startswith(self.hedge_endpoints):
+            return None
+        histogram = METRICS.histograms.get("http_request_seconds", {}).get(METRICS._labels({"endpoint": endpoint}))
+        if histogram is None or histogram.count < self.hedge_min_samples:
+            return None
+        return histogram.quantile(self.hedge_quantile)
+
+    async def call(self, endpoint: str, request: Callable[[], Awaitable[Any]], limiter=None,
+                   failed: Optional[Callable[[Any], bool]] = None) -> Any:
+        breaker = self.breaker(endpoint)
+        breaker.before_call()
+        try:
+            attempt = self.__hedged(endpoint, request, limiter)
+            timeout = self.timeout(endpoint)
+            result = await asyncio.wait_for(attempt, timeout) if timeout else await attempt
+        except Exception as e:
+            if is_retryable(e):
+                breaker.record_failure()
+            else:
+                breaker.release()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        if failed and failed(result):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return result
+
+    async def __hedged(self, endpoint: str, request: Callable[[], Awaitable[Any]], limiter=None) -> Any:
+        delay = self.hedge_delay(endpoint)
+        if delay is None:
+            return await request()
+
+        budget = self.budgets.get(endpoint)
+        if budget is None:
+            budget = self.budgets[endpoint] = HedgeBudget(self.hedge_budget)
+        budget.deposit()
+
+        primary = asyncio.ensure_future(request())
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+            if (limiter is not None and not limiter.has_capacity()) or not budget.withdraw():
+                METRICS.inc("hedges_skipped_total", endpoint=endpoint)
+                return await primary
+
+            if limiter is not None:
+                await limiter.acquire()
+            hedge = asyncio.ensure_future(request())
+            METRICS.inc("hedged_requests_total", endpoint=endpoint)
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        METRICS.inc("hedge_wins_total", endpoint=endpoint, winner="hedge" if task is hedge else "primary")
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+
+RESILIENCE = Resilience()
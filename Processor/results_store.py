@@ -0,0 +1,260 @@
+import argparse
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Collection, Dict, Iterator, List, Optional, Tuple
+from Processor.company_matcher import normalize_company_name
+from Processor.company_table import company_ref
+from Processor.serialization import dumps, loads
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    stage TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    source TEXT,
+    person_name TEXT,
+    person_key TEXT,
+    written_at REAL NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (stage, item_id)
+);
+CREATE TABLE IF NOT EXISTS record_companies (
+    stage TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    company_ref TEXT NOT NULL,
+    PRIMARY KEY (stage, item_id, company_ref)
+);
+CREATE TABLE IF NOT EXISTS companies (
+    company_ref TEXT PRIMARY KEY,
+    company_number TEXT,
+    company_name TEXT,
+    name_key TEXT,
+    active TEXT,
+    stage TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    position INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_source ON records (stage, source);
+CREATE INDEX IF NOT EXISTS records_person_key ON records (person_key);
+CREATE INDEX IF NOT EXISTS record_companies_ref ON record_companies (company_ref, stage, item_id);
+CREATE INDEX IF NOT EXISTS companies_number ON companies (company_number);
+CREATE INDEX IF NOT EXISTS companies_name_key ON companies (name_key);
+"""
+
+UPSERT_RECORD = "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?)"
+UPSERT_COMPANY = "INSERT OR REPLACE INTO companies VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+def person_key(name: Optional[str]) -> Optional[str]:
+    # "SMITH, Jane" and "Jane Smith" are the same person to a downstream lookup.
+    if not name:
+        return None
+    return " ".join(sorted(re.sub(r"[^\w\s]", " ", name.lower()).split())) or None
+
+
+class ResultsStore:
+    """
+    Stage outputs in SQLite, for downstream tools that need a few companies or a
+    streaming pass over everything without loading the JSON artifacts. Records are
+    keyed by (stage, item content hash) and indexed by source and normalized person
+    name. Company profiles are only stored inside the stage-one records that
+    produced them; the companies table indexes them by company number and
+    normalized name and points at the record and position holding each one, and
+    links them to the records that reference them.
+
+    Writes are buffered by `add` and committed in one transaction per checkpoint
+    from the checkpoint writer's thread. The database runs in WAL mode, so readers,
+    including other shard processes, are never blocked by a write in progress.
+    """
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        self.__pending: List[Tuple[str, str, float, Any, Any]] = []
+        self.__writer: Optional[sqlite3.Connection] = None
+        self.__reader: Optional[sqlite3.Connection] = None
+        self.__lock = threading.Lock()
+
+    def configure(self, CONFIG: Dict):
+        self.close()
+        path = CONFIG.get("RESULTS_DB_PATH")
+        self.path = Path(path) if path else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def __connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    def add(self, stage: str, item_id: str, result: Any, record: Any = None):
+        """Buffers one output; `record` is the input item, used for the source and name when the output lacks them."""
+        self.__pending.append((stage, item_id, time.time(), result, record))
+
+    def snapshot(self) -> List[Tuple[str, str, float, Any, Any]]:
+        pending, self.__pending = self.__pending, []
+        return pending
+
+    def write(self, pending: List[Tuple[str, str, float, Any, Any]]):
+        if not pending:
+            return
+        records, links, companies = [], [], {}
+        for stage, item_id, at, result, record in pending:
+            fields = result if isinstance(result, dict) else record if isinstance(record, dict) else {}
+            name = fields.get("full_name")
+            records.append((stage, item_id, fields.get("source"), name, person_key(name), at, dumps(result)))
+            refs = list(fields.get("matched_company_refs") or ())
+            if isinstance(result, list):
+                for position, profile in enumerate(result):
+                    ref = company_ref(profile) if isinstance(profile, dict) else None
+                    if ref:
+                        refs.append(ref)
+                        companies[ref] = self.__company_row(ref, profile, stage, item_id, position)
+            links.extend((stage, item_id, ref) for ref in dict.fromkeys(refs))
+        with self.__lock:
+            if self.__writer is None:
+                self.__writer = self.__connect()
+            with self.__writer:
+                self.__writer.executemany(
+                    "DELETE FROM record_companies WHERE stage = ? AND item_id = ?",
+                    ((stage, item_id) for stage, item_id, *_ in records)
+                )
+                self.__writer.executemany(UPSERT_RECORD, records)
+                self.__writer.executemany("INSERT OR IGNORE INTO record_companies VALUES (?, ?, ?)", links)
+                self.__writer.executemany(UPSERT_COMPANY, companies.values())
+
+    def __company_row(self, ref: str, profile: Dict[str, Any], stage: str, item_id: str, position: int) -> Tuple:
+        info = profile.get("company_info") or {}
+        name = info.get("company_name")
+        return (
+            ref, info.get("company_number"), name, normalize_company_name(name) if name else None,
+            info.get("is_the_company_active"), stage, item_id, position
+        )
+
+    def prune(self, stage: str, keep: Collection[str]) -> int:
+        """Drops records of `stage` whose item id is not in `keep`, i.e. inputs that are gone from a full re-run."""
+        stale = "SELECT item_id FROM records WHERE stage = ? AND item_id NOT IN (SELECT item_id FROM temp.keep_ids)"
+        with self.__lock:
+            if self.__writer is None:
+                self.__writer = self.__connect()
+            with self.__writer:
+                self.__writer.execute("CREATE TEMP TABLE IF NOT EXISTS keep_ids (item_id TEXT PRIMARY KEY)")
+                self.__writer.execute("DELETE FROM temp.keep_ids")
+                self.__writer.executemany("INSERT OR IGNORE INTO temp.keep_ids VALUES (?)", ((item_id,) for item_id in keep))
+                self.__writer.execute(f"DELETE FROM record_companies WHERE stage = ? AND item_id IN ({stale})", (stage, stage))
+                self.__writer.execute(f"DELETE FROM companies WHERE stage = ? AND item_id IN ({stale})", (stage, stage))
+                pruned = self.__writer.execute(f"DELETE FROM records WHERE stage = ? AND item_id IN ({stale})", (stage, stage)).rowcount
+                self.__writer.execute("DELETE FROM temp.keep_ids")
+                return pruned
+
+    def __query(self, sql: str, params: Tuple = ()) -> sqlite3.Cursor:
+        if self.__reader is None:
+            if not self.enabled or not self.path.exists():
+                raise FileNotFoundError(f"No results store at {self.path}")
+            self.__reader = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        return self.__reader.execute(sql, params)
+
+    def __stream(self, cursor: sqlite3.Cursor, batch_size: int) -> Iterator[Any]:
+        while rows := cursor.fetchmany(batch_size):
+            for (data,) in rows:
+                yield loads(data)
+
+    def __profiles(self, column: str, value: str, limit: int = -1) -> List[Dict[str, Any]]:
+        rows = self.__query(
+            "SELECT c.company_ref, c.position, r.data FROM companies c "
+            f"JOIN records r ON r.stage = c.stage AND r.item_id = c.item_id WHERE c.{column} = ? LIMIT ?",
+            (value, limit)
+        )
+        profiles = []
+        for ref, position, data in rows:
+            group = loads(data)
+            # The record may have been rewritten since; only trust a position that still holds the company.
+            if isinstance(group, list) and position < len(group) and company_ref(group[position]) == ref:
+                profiles.append(group[position])
+        return profiles
+
+    def get(self, ref: str) -> Optional[Dict[str, Any]]:
+        profiles = self.__profiles("company_ref", ref, 1)
+        return profiles[0] if profiles else None
+
+    def resolve(self, record: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Same contract as CompanyResolver.resolve, so converters can read companies from the store."""
+        if "matched_company_records" in record:
+            return record["matched_company_records"] or []
+        return [company for company in map(self.get, record.get("matched_company_refs") or []) if company is not None]
+
+    def company(self, company_number: str) -> Optional[Dict[str, Any]]:
+        profiles = self.__profiles("company_number", company_number, 1)
+        return profiles[0] if profiles else None
+
+    def companies_named(self, company_name: str) -> List[Dict[str, Any]]:
+        return self.__profiles("name_key", normalize_company_name(company_name))
+
+    def records(self, stage: str, source: Optional[str] = None, person: Optional[str] = None,
+                company_number: Optional[str] = None, company_name: Optional[str] = None,
+                batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Streams the outputs of `stage`, optionally filtered; every filter is answered from an index."""
+        where, params = ["stage = ?"], [stage]
+        if company_number or company_name:
+            column, value = ("company_number", company_number) if company_number else ("name_key", normalize_company_name(company_name))
+            where.append(
+                "item_id IN (SELECT l.item_id FROM companies c JOIN record_companies l ON l.company_ref = c.company_ref "
+                f"WHERE c.{column} = ? AND l.stage = ?)"
+            )
+            params.extend((value, stage))
+        if source:
+            where.append("source = ?")
+            params.append(source)
+        if person:
+            where.append("person_key = ?")
+            params.append(person_key(person))
+        sql = "SELECT data FROM records WHERE " + " AND ".join(where)
+        yield from self.__stream(self.__query(sql, tuple(params)), batch_size)
+
+    def count(self, stage: str) -> int:
+        return self.__query("SELECT COUNT(*) FROM records WHERE stage = ?", (stage,)).fetchone()[0]
+
+    def close(self):
+        with self.__lock:
+            if self.__writer is not None:
+                # Keeps the planner's statistics current for the indexes above.
+                self.__writer.execute("PRAGMA optimize")
+            for conn in (self.__writer, self.__reader):
+                if conn is not None:
+                    conn.close()
+            self.__writer = self.__reader = None
+
+
+RESULTS = ResultsStore()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query pipeline outputs stored in the results database")
+    parser.add_argument("--db", type=Path, default=Path("data/results.sqlite"))
+    parser.add_argument("--stage", default="enriched", help="data (Companies House), matched (ethnicity) or enriched (loan scoring)")
+    parser.add_argument("--company-number")
+    parser.add_argument("--company-name")
+    parser.add_argument("--person")
+    parser.add_argument("--source")
+    parser.add_argument("--profile", action="store_true", help="print the company profile instead of the records referencing it")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+    if args.profile:
+        profiles = [store.company(args.company_number)] if args.company_number else store.companies_named(args.company_name or "")
+        for profile in filter(None, profiles):
+            print(dumps(profile))
+    else:
+        for record in store.records(args.stage, args.source, args.person, args.company_number, args.company_name):
+            print(dumps(record))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
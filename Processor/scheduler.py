@@ -0,0 +1,106 @@
+import asyncio
+import heapq
+import itertools
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+
+def default_flow_key(item) -> Any:
+    data = item.data
+    if isinstance(data, dict) and data.get("source"):
+        return data["source"]
+    return item.dataset
+
+
+def high_value_priority(item) -> float:
+    data = item.data if isinstance(item.data, dict) else {}
+    priority = len(data.get("matched_company_refs") or data.get("matched_company_records") or data.get("companies") or [])
+    if data.get("source") == "Tax Default":
+        priority += 100
+    return priority
+
+
+class WeightedFairBuffer:
+    """
+    Items are grouped into flows (by source or dataset) and flows are served by
+    weighted fair queuing: each pop() takes from the flow with the smallest virtual
+    finish time, which then advances by 1 / weight. Within a flow the highest
+    `priority(item)` goes first. Shutdown sentinels (None) are only handed out once
+    every flow is drained.
+    """
+    def __init__(self, priority: Callable[[Any], float], flow_key: Callable[[Any], Any], weights: Dict[Any, float]):
+        self.priority = priority
+        self.flow_key = flow_key
+        self.weights = weights
+        self._flows: Dict[Any, List] = {}
+        self._finish: Dict[Any, float] = {}
+        self._virtual_time = 0.0
+        self._sentinels = deque()
+        self._seq = itertools.count()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size + len(self._sentinels)
+
+    def __iter__(self):
+        for heap in self._flows.values():
+            for _, _, item in sorted(heap):
+                yield item
+        yield from self._sentinels
+
+    def push(self, item):
+        if item is None:
+            self._sentinels.append(item)
+            return
+        flow = self.flow_key(item)
+        heap = self._flows.setdefault(flow, [])
+        if not heap:
+            # A flow coming back from idle must not cash in the turns it skipped.
+            self._finish[flow] = max(self._finish.get(flow, 0.0), self._virtual_time)
+        heapq.heappush(heap, (-self.priority(item), next(self._seq), item))
+        self._size += 1
+
+    def pop(self):
+        if not self._size:
+            return self._sentinels.popleft()
+        flow = min((f for f, heap in self._flows.items() if heap), key=self._finish.__getitem__)
+        _, _, item = heapq.heappop(self._flows[flow])
+        self._virtual_time = self._finish[flow]
+        self._finish[flow] += 1.0 / self.weights.get(flow, 1.0)
+        self._size -= 1
+        return item
+
+
+class FairPriorityQueue(asyncio.Queue):
+    def __init__(self, maxsize: int = 0, priority: Optional[Callable[[Any], float]] = None,
+                 flow_key: Optional[Callable[[Any], Any]] = None, weights: Optional[Dict[Any, float]] = None):
+        self.priority = priority or (lambda item: 0)
+        self.flow_key = flow_key or default_flow_key
+        self.weights = weights or {}
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self._queue = WeightedFairBuffer(self.priority, self.flow_key, self.weights)
+
+    def _put(self, item):
+        self._queue.push(item)
+
+    def _get(self):
+        return self._queue.pop()
+
+
+def create_queue(CONFIG: Dict) -> asyncio.Queue:
+    scheduler = CONFIG.get("SCHEDULER", "fifo")
+    if callable(scheduler):
+        return scheduler(CONFIG)
+    if scheduler == "fair":
+        # Bounded like the FIFO queue by default, so the producer waits on the consumers;
+        # a larger SCHEDULER_QUEUE_SIZE lets the scheduler reorder further ahead.
+        return FairPriorityQueue(
+            CONFIG.get("SCHEDULER_QUEUE_SIZE", CONFIG["QUEUE_SIZE"]),
+            priority=CONFIG.get("PRIORITY_FUNCTION"),
+            weights=CONFIG.get("FLOW_WEIGHTS")
+        )
+    if scheduler != "fifo":
+        raise ValueError(f"Unknown scheduler: {scheduler}")
+    return asyncio.Queue(maxsize=CONFIG["QUEUE_SIZE"])
@@ -0,0 +1,120 @@
+import importlib.util
+import json
+import os
+from dataclasses import fields
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+
+JSON_BACKEND = os.environ.get("JSON_BACKEND", "auto")
+BACKENDS = ("orjson", "msgspec", "json")
+
+Buffer = Union[str, bytes, bytearray, memoryview]
+
+_FIELD_NAMES: Dict[type, Tuple[str, ...]] = {}
+
+
+def _default(obj: Any) -> Any:
+    # Dataclasses become dicts one level at a time as the encoder reaches them, without asdict's deep copy.
+    cls = type(obj)
+    if hasattr(cls, "__dataclass_fields__"):
+        names = _FIELD_NAMES.get(cls)
+        if names is None:
+            names = _FIELD_NAMES[cls] = tuple(f.name for f in fields(cls))
+        return {name: getattr(obj, name) for name in names}
+    return str(obj)
+
+
+def _stdlib_dumps(obj: Any, indent: Optional[int] = None, sort_keys: bool = False) -> str:
+    separators = None if indent else (",", ":")
+    return json.dumps(obj, ensure_ascii=False, indent=indent, separators=separators, sort_keys=sort_keys, default=_default)
+
+
+def canonical(obj: Any) -> bytes:
+    """
+    Canonical encoding for content hashes (item identity, company digests). Always
+    the stdlib encoder: the backends disagree on details like float exponents, and
+    a hash that changed with the installed packages would make delta runs redo
+    every record.
+    """
+    return json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=_default).encode()
+
+
+class JsonBackend:
+    """
+    One JSON implementation behind a common interface. Encoders write UTF-8 without
+    escaping, compact unless `indent` is given, handle dataclasses natively and fall
+    back to `str` for other unknown types. Decoders accept str or bytes and raise
+    `json.JSONDecodeError`, so callers catch the same error whatever is installed.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.dumps_bytes: Callable[..., bytes]
+        self.loads: Callable[[Buffer], Any]
+        {"json": self.__init_json, "orjson": self.__init_orjson, "msgspec": self.__init_msgspec}[name]()
+
+    def dumps(self, obj: Any, indent: Optional[int] = None, sort_keys: bool = False) -> str:
+        return self.dumps_bytes(obj, indent, sort_keys).decode()
+
+    def __init_json(self):
+        def dumps_bytes(obj: Any, indent: Optional[int] = None, sort_keys: bool = False) -> bytes:
+            return _stdlib_dumps(obj, indent, sort_keys).encode()
+
+        def loads(data: Buffer) -> Any:
+            return json.loads(bytes(data) if isinstance(data, memoryview) else data)
+
+        self.dumps = _stdlib_dumps
+        self.dumps_bytes = dumps_bytes
+        self.loads = loads
+
+    def __init_orjson(self):
+        import orjson
+
+        def dumps_bytes(obj: Any, indent: Optional[int] = None, sort_keys: bool = False) -> bytes:
+            option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0) | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+            try:
+                return orjson.dumps(obj, default=_default, option=option)
+            except orjson.JSONEncodeError:
+                # Integers beyond 64 bits and the like, which the stdlib encoder still handles.
+                return _stdlib_dumps(obj, indent, sort_keys).encode()
+
+        self.dumps_bytes = dumps_bytes
+        # orjson.JSONDecodeError already subclasses json.JSONDecodeError.
+        self.loads = orjson.loads
+
+    def __init_msgspec(self):
+        import msgspec
+
+        encoder = msgspec.json.Encoder(enc_hook=str)
+        sorted_encoder = msgspec.json.Encoder(enc_hook=str, order="sorted")
+        decoder = msgspec.json.Decoder()
+
+        def dumps_bytes(obj: Any, indent: Optional[int] = None, sort_keys: bool = False) -> bytes:
+            try:
+                data = (sorted_encoder if sort_keys else encoder).encode(obj)
+            except (msgspec.EncodeError, OverflowError):
+                return _stdlib_dumps(obj, indent, sort_keys).encode()
+            return msgspec.json.format(data, indent=indent) if indent else data
+
+        def loads(data: Buffer) -> Any:
+            try:
+                return decoder.decode(data)
+            except msgspec.DecodeError as e:
+                raise json.JSONDecodeError(str(e), data if isinstance(data, str) else "", 0) from e
+
+        self.dumps_bytes = dumps_bytes
+        self.loads = loads
+
+
+def load_backend(name: str = "auto") -> JsonBackend:
+    """The backend called `name`, or with "auto" the first of orjson, msgspec and the stdlib that is installed."""
+    if name == "auto":
+        name = next(n for n in BACKENDS if n == "json" or importlib.util.find_spec(n) is not None)
+    if name not in BACKENDS:
+        raise ValueError(f"JSON_BACKEND must be one of {('auto',) + BACKENDS}, got {name!r}")
+    return JsonBackend(name)
+
+
+BACKEND = load_backend(JSON_BACKEND)
+dumps = BACKEND.dumps
+dumps_bytes = BACKEND.dumps_bytes
+loads = BACKEND.loads
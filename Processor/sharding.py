@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import math
+import multiprocessing
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+from aiolimiter import AsyncLimiter
+from Processor.artifacts import read_json, write_json
+from Processor.checkpoint_processor import ProcessingState
+from Processor.data_pipeline import DataPipeline
+from Processor.metrics import METRICS
+from Processor.profiling import StageProfiler
+from Processor.resilience import RESILIENCE
+from Processor.negative_cache import NEGATIVE_CACHE
+from Processor.eligibility import ELIGIBILITY
+from Processor.company_table import COMPANIES
+from Processor.results_store import RESULTS
+
+
+Address = Union[str, Tuple[str, int]]
+STAGE_LIMITER = "stage"
+
+# Limiters shared with the other shards, by name, in a shard process; see run_sharded's `shared_limits`.
+SHARED_LIMITERS: Dict[str, "RemoteLimiter"] = {}
+
+
+def parse_address(address: Union[str, Path, Tuple[str, int]]) -> Address:
+    if isinstance(address, tuple):
+        return address
+    address = str(address)
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return host, int(port)
+    return address
+
+
+class TokenServer:
+    """
+    Hands out rate-limit tokens to shard processes so they share one AsyncLimiter
+    per name: the stage limiter and any per-credential quotas. Clients send the
+    limiter name and the number of tokens wanted on a line and get a line back
+    once that limiter has granted them. Listens on a Unix socket path or a (host, port).
+    """
+    def __init__(self, limiters: Dict[str, AsyncLimiter], address: Address):
+        self.limiters = limiters
+        self.address = address
+        self.__server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        if isinstance(self.address, tuple):
+            self.__server = await asyncio.start_server(self.__handle, *self.address)
+        else:
+            self.__server = await asyncio.start_unix_server(self.__handle, self.address)
+
+    async def close(self):
+        if self.__server:
+            self.__server.close()
+            await self.__server.wait_closed()
+
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                name, _, amount = line.decode().strip().rpartition(" ")
+                await self.limiters[name or STAGE_LIMITER].acquire(int(amount or 1))
+                writer.write(b"1\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+class RemoteLimiter:
+    """
+    AsyncLimiter stand-in for shard processes; every acquire is granted by the
+    TokenServer in the coordinating process, from the limiter called `name`.
+    """
+    def __init__(self, address: Address, max_rate: float, time_period: float = 60, name: str = STAGE_LIMITER):
+        self.address = address
+        self.name = name
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self.__reader: Optional[asyncio.StreamReader] = None
+        self.__writer: Optional[asyncio.StreamWriter] = None
+        self.__lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self, amount: float = 1):
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        async with self.__lock:
+            if self.__writer is None:
+                if isinstance(self.address, tuple):
+                    self.__reader, self.__writer = await asyncio.open_connection(*self.address)
+                else:
+                    self.__reader, self.__writer = await asyncio.open_unix_connection(self.address)
+            self.__writer.write(f"{self.name} {math.ceil(amount)}\n".encode())
+            await self.__writer.drain()
+            if not await self.__reader.readline():
+                self.__reader = self.__writer = None
+                raise ConnectionError("Token server closed the connection")
+
+    def has_capacity(self, amount: float = 1) -> bool:
+        return True
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return None
+
+    async def close(self):
+        if self.__writer:
+            self.__writer.close()
+            self.__writer = None
+
+
+def shard_config(CONFIG: Dict, shard_index: int) -> Dict:
+    return {**CONFIG, "CHECKPOINT_DIR": CONFIG["CHECKPOINT_DIR"] / f"shard-{shard_index}"}
+
+
+async def run_shard(shard_index: int, num_shards: int, address: Address, rate_limit: Tuple[float, float],
+                    path: Path, file_name: str, logger, CONFIG: Dict, task_to_run, max_concurrent_sessions: Optional[int],
+                    shared_limits: Dict[str, Tuple[float, float]]):
+    config = shard_config(CONFIG, shard_index)
+    RESILIENCE.configure(config)
+    ELIGIBILITY.configure(config)
+    COMPANIES.configure(config)
+    RESULTS.configure(config)
+    NEGATIVE_CACHE.configure(CONFIG)
+    NEGATIVE_CACHE.load(logger)
+    profiler = StageProfiler(logger, CONFIG, f"{file_name}-shard-{shard_index}")
+    pipeline = DataPipeline(ProcessingState(), logger, dataset_paths=[path], CONFIG=config, resume=True, shard=(shard_index, num_shards), profiler=profiler)
+    limiter = RemoteLimiter(address, *rate_limit) if rate_limit else None
+    SHARED_LIMITERS.update((name, RemoteLimiter(address, *rate, name=name)) for name, rate in shared_limits.items())
+    sessions = math.ceil(max_concurrent_sessions / num_shards) if max_concurrent_sessions else None
+    semaphore = asyncio.Semaphore(sessions) if sessions else None
+    max_workers = min(config["MAX_CONCURRENT_REQUESTS"], sessions or config["MAX_CONCURRENT_REQUESTS"])
+    try:
+        with profiler:
+            await pipeline.run(file_name, path, task_to_run, limiter, semaphore, max_workers)
+    finally:
+        for remote in filter(None, (limiter, *SHARED_LIMITERS.values())):
+            await remote.close()
+        SHARED_LIMITERS.clear()
+        RESULTS.close()
+    pipeline.state.save_checkpoint(logger, config)
+    NEGATIVE_CACHE.save(logger)
+    write_json(config["CHECKPOINT_DIR"] / "results.json", pipeline.results)
+    write_json(config["CHECKPOINT_DIR"] / "input_ids.json", None if pipeline.input_ids is None else list(pipeline.input_ids))
+    write_json(config["CHECKPOINT_DIR"] / "metrics.json", METRICS.dump())
+
+
+def _shard_main(shard_index: int, *args):
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s - %(levelname)s - [shard-{shard_index}] %(message)s"
+    )
+    asyncio.run(run_shard(shard_index, *args))
+
+
+async def run_sharded(path: Path, file_name: str, logger, CONFIG: Dict, task_to_run,
+                      rate_limit: Optional[Tuple[float, float]], max_concurrent_sessions: Optional[int],
+                      shared_limits: Optional[Dict[str, Tuple[float, float]]] = None) -> DataPipeline:
+    """
+    Runs one worker process per shard, each with its own event loop, over a
+    stable-hash partition of the input items. The rate limit is enforced once, in
+    this process, by a TokenServer the shards draw from. So are `shared_limits`,
+    further quotas by name (e.g. one per API key) that would otherwise be granted
+    in full to every shard; shards find them in SHARED_LIMITERS. Shard checkpoints
+    and results are merged into the returned pipeline, and their metrics into METRICS.
+    """
+    num_shards = CONFIG["SHARDS"]
+    shared_limits = shared_limits or {}
+    address = CONFIG.get("COORDINATOR_ADDRESS")
+    socket_dir = None if address else tempfile.TemporaryDirectory()
+    address = parse_address(address) if address else str(Path(socket_dir.name) / "coordinator.sock")
+    limiters = {name: AsyncLimiter(*rate) for name, rate in shared_limits.items()}
+    if rate_limit:
+        limiters[STAGE_LIMITER] = AsyncLimiter(*rate_limit)
+    server = TokenServer(limiters, address) if limiters else None
+    if server:
+        await server.start()
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=_shard_main,
+            args=(i, num_shards, address, rate_limit, path, file_name, logger, CONFIG, task_to_run, max_concurrent_sessions, shared_limits),
+            name=f"shard-{i}"
+        )
+        for i in range(num_shards)
+    ]
+    try:
+        for process in processes:
+            process.start()
+        await asyncio.gather(*(asyncio.to_thread(process.join) for process in processes))
+    finally:
+        if server:
+            await server.close()
+        if socket_dir:
+            socket_dir.cleanup()
+
+    pipeline = DataPipeline(ProcessingState(), logger, dataset_paths=[path], CONFIG=CONFIG, resume=True)
+    metrics = []
+    for i, process in enumerate(processes):
+        if process.exitcode != 0:
+            logger.error(f"Shard {i} exited with code {process.exitcode}")
+        config = shard_config(CONFIG, i)
+        state = ProcessingState.load_checkpoint(logger, config)
+        merge_state(pipeline.state, state)
+        results_file = config["CHECKPOINT_DIR"] / "results.json"
+        if results_file.exists():
+            pipeline.results.extend(read_json(results_file))
+            results_file.unlink()
+        ids_file = config["CHECKPOINT_DIR"] / "input_ids.json"
+        ids = read_json(ids_file) if ids_file.exists() else None
+        pipeline.input_ids = None if ids is None or pipeline.input_ids is None else pipeline.input_ids | set(ids)
+        if ids_file.exists():
+            ids_file.unlink()
+        metrics_file = config["CHECKPOINT_DIR"] / "metrics.json"
+        if metrics_file.exists():
+            metrics.append(read_json(metrics_file))
+            metrics_file.unlink()
+    METRICS.merge(metrics)
+    NEGATIVE_CACHE.load(logger)
+    logger.info(f"Merged {num_shards} shards: {len(pipeline.results)} results")
+    return pipeline
+
+
+def merge_state(state: ProcessingState, shard_state: ProcessingState):
+    state.processed_files |= shard_state.processed_files
+    for key, ids in shard_state.processed_items.items():
+        if key in state.processed_items:
+            state.processed_items[key].update(ids)
+        else:
+            state.processed_items[key] = ids
+    state.total_processed = sum(len(ids) for ids in state.processed_items.values())
@@ -0,0 +1,54 @@
+import os
+import random
+from itertools import accumulate
+from typing import List, Optional
+
+
+HTTP_USER_AGENT = os.environ.get("HTTP_USER_AGENT")
+
+FALLBACK_USER_AGENTS = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Safari/605.1.15",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:125.0) Gecko/20100101 Firefox/125.0",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+)
+
+
+class UserAgentProvider:
+    """
+    Process-wide User-Agent source for the HTTP clients. The fake_useragent dataset
+    is read once, on first use, into a weighted pool; every later `get` is a single
+    weighted pick. If the library or its data is unavailable the built-in
+    `FALLBACK_USER_AGENTS` are used, and a `fixed` agent bypasses both.
+    """
+    def __init__(self, fixed: Optional[str] = None, pool_size: int = 64):
+        self.fixed = fixed
+        self.pool_size = pool_size
+        self.__pool: Optional[List[str]] = None
+        self.__cum_weights: Optional[List[float]] = None
+
+    def __load(self):
+        pool, weights = list(FALLBACK_USER_AGENTS), None
+        try:
+            from fake_useragent import UserAgent
+            ua = UserAgent()
+            entries = getattr(ua, "data_browsers", None)
+            if entries:
+                pool = [entry["useragent"] for entry in entries]
+                weights = [max(entry.get("percent", 0.0), 1e-6) for entry in entries]
+            else:
+                pool = [ua.random for _ in range(self.pool_size)]
+        except Exception:
+            pass
+        self.__cum_weights = list(accumulate(weights)) if weights else None
+        self.__pool = pool
+
+    def get(self) -> str:
+        if self.fixed:
+            return self.fixed
+        if self.__pool is None:
+            self.__load()
+        return random.choices(self.__pool, cum_weights=self.__cum_weights)[0]
+
+
+USER_AGENT = UserAgentProvider(HTTP_USER_AGENT)
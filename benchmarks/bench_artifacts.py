@@ -0,0 +1,63 @@
+import argparse
+import importlib.util
+import json
+import tempfile
+import time
+from pathlib import Path
+from benchmarks.bench_results_store import make_records
+from Processor.artifacts import read_json, write_json
+
+
+def write_indented(path: Path, data):
+    # How main.py wrote every artifact before: uncompressed, indent=4.
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+
+
+def read_plain(path: Path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def measure(label: str, path: Path, write, read, data, raw_bytes: int, baseline: int):
+    start = time.perf_counter()
+    write(path, data)
+    written = time.perf_counter() - start
+    start = time.perf_counter()
+    read(path)
+    read_seconds = time.perf_counter() - start
+    size = path.stat().st_size
+    print(
+        f"{label:<22} {size / 2**20:>9,.2f} MiB  {baseline / size:>6.1f}x smaller  "
+        f"write {raw_bytes / written / 2**20:>7,.1f} MiB/s  read {raw_bytes / read_seconds / 2**20:>7,.1f} MiB/s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Artifact size and read/write throughput per codec")
+    parser.add_argument("-n", type=int, default=20_000, help="synthetic people, each with one company")
+    parser.add_argument("--from", dest="source", type=Path, help="benchmark a real artifact (any supported codec) instead")
+    args = parser.parse_args()
+
+    if args.source:
+        data = read_json(args.source)
+    else:
+        profiles, people = make_records(args.n)
+        data = [{**person, "matched_company_records": [profile]} for person, profile in zip(people, profiles)]
+
+    workdir = Path(tempfile.mkdtemp(prefix="artifacts-bench-"))
+    baseline_path = workdir / "indent4.json"
+    write_indented(baseline_path, data)
+    baseline = baseline_path.stat().st_size
+    # Throughput is reported against the indented size, i.e. the bytes each run used to move.
+    print(f"{len(data):,} records, {baseline / 2**20:,.1f} MiB as indented JSON\n")
+
+    measure("json, indent=4", baseline_path, write_indented, read_plain, data, baseline, baseline)
+    suffixes = [".json", ".json.gz", ".json.bz2", ".json.xz"]
+    if importlib.util.find_spec("zstandard"):
+        suffixes.insert(2, ".json.zst")
+    else:
+        print("(zstandard not installed, skipping .zst)")
+    for suffix in suffixes:
+        measure(f"compact {suffix}", workdir / f"artifact{suffix}", write_json, read_json, data, baseline, baseline)
+    print(f"\nworkdir: {workdir}")
@@ -0,0 +1,81 @@
+import argparse
+import importlib.util
+import json
+import time
+from pathlib import Path
+from benchmarks.bench_records import make_profile
+from benchmarks.bench_results_store import make_records
+from Models.models import to_dict
+from Processor.artifacts import read_json
+from Processor.checkpoint_processor import ProcessedIds, ProcessingState
+from Processor.serialization import BACKENDS, load_backend
+
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def checkpoint(n: int):
+    state = ProcessingState()
+    ids = ProcessedIds(f"{i:032x}" for i in range(n))
+    state.processed_items = {"data:data.json.gz": ids}
+    state.processed_files = {"data.json.gz"}
+    state.total_processed = n
+    return state.snapshot()
+
+
+def shapes(n: int, source: Path = None):
+    profiles, people = make_records(n)
+    found = {
+        "API responses (fixtures)": [json.loads(path.read_text()) for path in sorted(FIXTURES.glob("*.json"))] * max(1, n // 50),
+        "stage one profile groups": [[profile] for profile in profiles],
+        "person records": people,
+        "checkpoint state": checkpoint(n * 5)
+    }
+    if source:
+        found[source.name] = read_json(source)
+    return found
+
+
+def timed(fn, payload, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(payload)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def indented(obj) -> bytes:
+    # What main.py used to do for every artifact.
+    return json.dumps(obj, indent=4, ensure_ascii=False).encode()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Encode/decode throughput of each installed JSON backend over the pipeline's data shapes")
+    parser.add_argument("-n", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--from", dest="source", type=Path, help="also benchmark a real artifact, e.g. data/result.json.gz")
+    args = parser.parse_args()
+
+    backends = [load_backend(name) for name in BACKENDS if name == "json" or importlib.util.find_spec(name)]
+    print(f"backends: {', '.join(b.name for b in backends)} (missing: {', '.join(n for n in BACKENDS if n not in {b.name for b in backends}) or 'none'})")
+    for label, payload in shapes(args.n, args.source).items():
+        encoded = backends[0].dumps_bytes(payload)
+        size = len(encoded) / 2**20
+        print(f"\n{label}: {size:,.1f} MiB compact")
+        print(f"  {'json indent=4':<10} encode {size / timed(indented, payload, args.repeat):>8,.0f} MiB/s")
+        for backend in backends:
+            encode = size / timed(backend.dumps_bytes, payload, args.repeat)
+            decode = size / timed(backend.loads, encoded, args.repeat)
+            print(f"  {backend.name:<13} encode {encode:>8,.0f} MiB/s  decode {decode:>8,.0f} MiB/s")
+
+    dataclasses = [make_profile(i) for i in range(args.n)]
+    print(f"\nBusinessProfile dataclasses, {args.n:,}:")
+    stdlib = load_backend("json")
+    start = time.perf_counter()
+    stdlib.dumps_bytes([to_dict(p) for p in dataclasses])
+    print(f"  {'to_dict + json':<22} {args.n / (time.perf_counter() - start):>10,.0f} profiles/s")
+    for backend in backends:
+        start = time.perf_counter()
+        backend.dumps_bytes(dataclasses)
+        print(f"  {backend.name + ' native':<22} {args.n / (time.perf_counter() - start):>10,.0f} profiles/s")
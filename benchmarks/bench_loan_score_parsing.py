@@ -0,0 +1,60 @@
+import argparse
+import json
+import time
+from typing import Dict
+from Loan_Scoring.loan_scoring import COMPLETION_ADAPTER, EVALUATION_ADAPTER, extract_json_payload
+
+
+SAMPLE_SCORE = {
+    "FDS": {"score": 62, "summary": "Late filing of 2024 accounts and a county court judgment registered in April 2025."},
+    "LUI": {"score": 71, "summary": "Payroll pressure flagged after loss of a key contract in May 2025."},
+    "Loan Capacity": {"score": 55, "funding_range": "£50k-£150k", "repayment": "Moderate"},
+    "Market Signals": {"score": 48, "summary": "Two senior hires announced, one director resignation."},
+    "Would work with a new loan broker": 68,
+    "Needs a loan today score": {"score": 74},
+    "Recommended Timing": "1-3 months",
+    "Top 3 Risks for Lender": ["Thin margins", "Customer concentration", "Outstanding charges"],
+    "Top 3 Loan Purposes": ["Working capital", "Equipment", "Contract mobilisation"],
+    "Sources": ["https://find-and-update.company-information.service.gov.uk/company/01234567"]
+}
+
+
+def make_response(n: int) -> bytes:
+    content = f"<think>reasoning for company {n}</think>\n```json\n{json.dumps(SAMPLE_SCORE)}\n```"
+    return json.dumps({"id": str(n), "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}).encode()
+
+
+def legacy_parse(raw: bytes) -> Dict:
+    result = json.loads(raw)
+    content = result.get("choices", [{}])[0].get("message", {}).get("content", {})
+    loan_info = json.loads(extract_json_payload(content))
+    row = {}
+    for column in ("FDS", "LUI", "Market Signals", "Would work with a new loan broker", "Needs a loan today score"):
+        value = loan_info.get(column, "")
+        row[column] = value.get("score", "") if isinstance(value, Dict) else value
+    loan_cap = loan_info.get("Loan Capacity", "")
+    row["Loan Capacity"] = loan_cap.get("funding_range") or loan_cap.get("range") if isinstance(loan_cap, Dict) else loan_cap
+    return row
+
+
+def adapter_parse(raw: bytes) -> Dict:
+    completion = COMPLETION_ADAPTER.validate_json(raw)
+    return EVALUATION_ADAPTER.validate_json(extract_json_payload(completion.choices[0].message.content)).model_dump()
+
+
+def run(label: str, parse, responses):
+    start = time.perf_counter()
+    for raw in responses:
+        parse(raw)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {len(responses) / elapsed:>12,.0f} responses/s  ({elapsed * 1e6 / len(responses):.1f} us each)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Loan score response parse + validate throughput")
+    parser.add_argument("-n", type=int, default=50_000)
+    args = parser.parse_args()
+
+    responses = [make_response(i) for i in range(args.n)]
+    run("json.loads + isinstance", legacy_parse, responses)
+    run("TypeAdapter.validate_json", adapter_parse, responses)
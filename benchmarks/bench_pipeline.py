@@ -0,0 +1,215 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+STAGE_ENDPOINTS = {
+    "data": "companies_house",
+    "matched": "gemini",
+    "enriched": "perplexity"
+}
+
+FIRST_NAMES = ["James", "Olivia", "Amit", "Chen", "Fatima", "Tom", "Grace", "Kwame", "Sofia", "Liam"]
+SURNAMES = ["Smith", "Patel", "Okafor", "Wong", "Jones", "Khan", "Brown", "Nowak", "Evans", "Ali"]
+WORDS = ["Acme", "Northern", "Bright", "Harbour", "Summit", "Oak", "Vertex", "Thames", "Cedar", "Pioneer"]
+KINDS = ["Trading", "Logistics", "Consulting", "Builders", "Foods", "Digital", "Engineering", "Retail"]
+
+
+def company_name(rng: random.Random) -> str:
+    return f"{rng.choice(WORDS)} {rng.choice(KINDS)} {rng.randint(1, 9999)} Ltd"
+
+
+def write_inputs(workspace: Path, items: int, seed: int):
+    rng = random.Random(seed)
+    per_source = max(1, items // 3)
+    sources = {
+        "trust_pilot": [
+            {"full_name": f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}", "companies": [company_name(rng)]}
+            for _ in range(per_source)
+        ],
+        "bidstats": [
+            {"suppliers": [{"name": company_name(rng)}]}
+            for _ in range(per_source)
+        ],
+        "tax_defaulters": [
+            {"Name": company_name(rng)}
+            for _ in range(items - 2 * per_source)
+        ]
+    }
+    for name, records in sources.items():
+        path = workspace / "data" / name / f"{name}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(records))
+    for name in ("matched", "enriched"):
+        (workspace / "data" / name).mkdir(parents=True, exist_ok=True)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock(args, port: int) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "benchmarks.mock_api", "--port", str(port),
+            "--latency-ms", str(args.latency_ms), "--sigma", str(args.sigma),
+            "--error-rate", str(args.error_rate), "--rate-429", str(args.rate_429),
+            "--miss-rate", str(args.miss_rate), "--padding-bytes", str(args.padding_bytes),
+            "--seed", str(args.seed), "--officers", str(args.officers),
+            "--key-quota", str(args.key_quota), "--key-window", str(args.key_window),
+            "--dissolved-rate", str(args.dissolved_rate)
+        ],
+        cwd=ROOT
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            fetch_stats(port)
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Mock API did not start")
+
+
+def fetch_stats(port: int) -> dict:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/__stats", timeout=1) as resp:
+        return json.load(resp)
+
+
+def report(metrics, stats: dict, items: int, shards: int = 1):
+    if shards > 1 and not any(g["name"] == "pipeline_workers" for g in metrics["gauges"]):
+        # Shard processes keep their own metrics; without them the latency and call columns would read as zero.
+        raise SystemExit("No pipeline metrics came back from the shards; the report would be empty")
+    gauges = {
+        (g["name"], g["labels"].get("stage")): g["value"]
+        for g in metrics["gauges"]
+    }
+    histograms = {
+        h["labels"].get("stage"): h
+        for h in metrics["histograms"] if h["name"] == "pipeline_item_seconds"
+    }
+    print(f"\n{'stage':<10} {'results':>8} {'seconds':>8} {'items/s':>9} {'p50':>8} {'p99':>8} {'calls/item':>10}")
+    for stage, prefix in STAGE_ENDPOINTS.items():
+        seconds = gauges.get(("stage_seconds", stage))
+        if seconds is None:
+            continue
+        results = gauges.get(("stage_results", stage), 0)
+        histogram = histograms.get(stage, {})
+        calls = sum(count for endpoint, count in stats.items() if endpoint.startswith(prefix))
+        p50 = histogram.get("p50") or 0
+        p99 = histogram.get("p99") or 0
+        items_in = histogram.get("count") or 1
+        print(
+            f"{stage:<10} {results:>8.0f} {seconds:>8.2f} {results / seconds if seconds else 0:>9.1f} "
+            f"{p50:>8.3f} {p99:>8.3f} {calls / items_in:>10.2f}"
+        )
+    print(f"\ninput companies: {items}")
+    print(f"API calls: {json.dumps(stats, sort_keys=True)}")
+    skips = {
+        f"{c['labels']['stage']}/{c['labels']['rule']}": c["value"]
+        for c in metrics["counters"] if c["name"] == "eligibility_skips_total"
+    }
+    if skips:
+        print(f"eligibility skips: {json.dumps(skips, sort_keys=True)}")
+    print(f"peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:,.1f} MiB")
+
+
+async def run(args, port: int):
+    os.environ.update({
+        "COMPANY_HOUSE_API_URL": f"http://127.0.0.1:{port}",
+        "PERPLEXITY_API_URL": f"http://127.0.0.1:{port}",
+        "GEMINI_API_URL": f"http://127.0.0.1:{port}",
+        "COMPANY_HOUSE_API_KEY": "",
+        "COMPANY_HOUSE_API_KEYS": ",".join(f"mock-{i}" for i in range(args.keys)),
+        "COMPANY_HOUSE_KEY_RATE_LIMIT": f"{args.key_quota}/{args.key_window}" if args.key_quota else "1000000/1",
+        "PERPLEXITY_API_KEY": os.environ.get("PERPLEXITY_API_KEY", "mock"),
+        "DANIEL_GEMINI_KEY": os.environ.get("DANIEL_GEMINI_KEY", "mock")
+    })
+    import main
+    from Processor.metrics import METRICS
+
+    for stage in main.CONFIG["STAGES"].values():
+        stage["rate_limit"] = (args.rate, 1) if args.rate else None
+        stage["max_concurrent_sessions"] = args.concurrency
+    main.CONFIG.update(
+        MAX_CONCURRENT_REQUESTS=args.concurrency,
+        MIN_CONCURRENT_REQUESTS=args.min_workers,
+        SHARDS=args.shards,
+        LOAN_SCORING_BATCH_SIZE=args.batch_size,
+        SCHEDULER=args.scheduler,
+        PROFILE=args.profile,
+        DELTA_MODE=args.delta,
+        RESULTS_DB_PATH=Path("data/results.sqlite") if args.results_store else None
+    )
+    main.logger.setLevel(args.log_level)
+    before = {}
+    for n in range(args.runs):
+        # Later runs reuse the workspace and checkpoints, like a daily rerun over unchanged inputs.
+        METRICS.reset()
+        await main.main()
+        stats = fetch_stats(port)
+        if args.runs > 1:
+            print(f"\nrun {n + 1}/{args.runs}")
+        report(METRICS.snapshot(), {k: v - before.get(k, 0) for k, v in stats.items()}, args.items, args.shards)
+        before = stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run main's three stages end to end against the local mock API")
+    parser.add_argument("--items", type=int, default=300, help="input companies across the three sources")
+    parser.add_argument("--rate", type=float, default=0, help="per-stage requests/s; 0 disables the limiter")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--min-workers", type=int, default=1, help="consumers started before autoscaling")
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--scheduler", default="fifo")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--miss-rate", type=float, default=0.1)
+    parser.add_argument("--padding-bytes", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--officers", type=int, default=0, help="officers per company served by the mock")
+    parser.add_argument("--dissolved-rate", type=float, default=0.0, help="share of companies the mock reports as dissolved")
+    parser.add_argument("--keys", type=int, default=1, help="Companies House API keys in the pool")
+    parser.add_argument("--key-quota", type=int, default=0, help="mock requests per key per window; 0 is unlimited")
+    parser.add_argument("--key-window", type=float, default=300)
+    parser.add_argument("--profile", choices=["cprofile", "sample"], help="write per-stage profiles next to the checkpoints")
+    parser.add_argument("--runs", type=int, default=1, help="run the pipeline this many times in the same workspace")
+    parser.add_argument("--delta", action="store_true", help="turn on DELTA_MODE, so later runs reuse unchanged outputs")
+    parser.add_argument("--results-store", action="store_true", help="also write stage outputs to data/results.sqlite")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    port = free_port()
+    mock = start_mock(args, port)
+    workspace = Path(tempfile.mkdtemp(prefix="pipeline-bench-"))
+    write_inputs(workspace, args.items, args.seed)
+    sys.path.insert(0, str(ROOT))
+    os.chdir(workspace)
+    try:
+        asyncio.run(run(args, port))
+    finally:
+        mock.terminate()
+        mock.wait()
+    print(f"workspace: {workspace}")
+
+
+if __name__ == "__main__":
+    main()
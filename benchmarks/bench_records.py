@@ -0,0 +1,70 @@
+import argparse
+import gc
+import time
+import tracemalloc
+from dataclasses import asdict
+from Models.models import CompanyInfo, DirectorInfo, FilingInfo, LegalInfo, BusinessProfile, to_dict
+from Processor.data_pipeline import PipelineItem
+
+
+def make_profile(n: int) -> BusinessProfile:
+    return BusinessProfile(
+        company_info=CompanyInfo(
+            company_name=f"Company {n} Ltd",
+            company_number=f"{n:08d}",
+            uk_city_location="London",
+            registered_address={"address_line_1": f"{n} High Street", "locality": "London", "postal_code": "EC1A 1BB"},
+            active_since_date="2015-04-01",
+            currently_active="Yes",
+            is_the_company_active="Yes",
+            industry_of_the_company_from_sic=[{"Sector": "Information and communication", "Sub-sector": "Business and domestic software development", "Sic Code": "62012"}],
+        ),
+        director_info=DirectorInfo(
+            number_of_directors=2,
+            names_of_other_directors=["SMITH, Jane", "JONES, Tom"],
+            director_age_years=[{"SMITH, Jane": 44}, {"JONES, Tom": 51}],
+        ),
+        filing_info=FilingInfo(latest_account_filing_date="2025-03-31", account_filing_in_past_month="No", months_since_last_filing=3),
+        legal_info=LegalInfo(outstanding_count=1, satisfied_count=2, has_debentures_or_charges="Yes", debentures_status="Has Outstanding"),
+    )
+
+
+def measure(label: str, build, n: int):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    items = build(n)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<24} {n / elapsed:>12,.0f} items/s  {current / n:>7.1f} B/item  peak {peak / 2**20:,.1f} MiB")
+    del items
+
+
+def dict_items(n: int):
+    return [{"dataset": "data", "file": "data.json", "id": i, "data": None} for i in range(n)]
+
+
+def slot_items(n: int):
+    return [PipelineItem("data", "data.json", i, None) for i in range(n)]
+
+
+def serialize(label: str, convert, profiles):
+    start = time.perf_counter()
+    for profile in profiles:
+        convert(profile)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {len(profiles) / elapsed:>12,.0f} profiles/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queue item memory and profile serialisation throughput")
+    parser.add_argument("-n", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    measure("dict queue items", dict_items, args.n)
+    measure("PipelineItem (slots)", slot_items, args.n)
+
+    profiles = [make_profile(i) for i in range(min(args.n, 200_000))]
+    serialize("dataclasses.asdict", asdict, profiles)
+    serialize("Models.models.to_dict", to_dict, profiles)
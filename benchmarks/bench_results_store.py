@@ -0,0 +1,88 @@
+import argparse
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+from benchmarks.bench_records import make_profile
+from Models.models import to_dict
+from Processor.results_store import ResultsStore
+
+
+def make_records(n: int):
+    profiles = [to_dict(make_profile(i)) for i in range(n)]
+    people = [
+        {
+            "full_name": f"Person {i}",
+            "all_companies": [profiles[i]["company_info"]["company_name"]],
+            "matched_company_refs": [profiles[i]["company_info"]["company_number"]],
+            "source": ("Trust Pilot", "BidStats", "Tax Default")[i % 3],
+            "Ethnicity of SMITH, Jane": {"full_name": "SMITH, Jane", "ethnicity": "White British", "skin_colour": "Unavailable"}
+        }
+        for i in range(n)
+    ]
+    return profiles, people
+
+
+def timed(label: str, fn, n: int = 1):
+    start = time.perf_counter()
+    for _ in range(n):
+        result = fn()
+    elapsed = (time.perf_counter() - start) / n
+    print(f"{label:<40} {elapsed * 1e3:>10,.2f} ms")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Results store vs JSON artifacts: write throughput, point lookups and full scans")
+    parser.add_argument("-n", type=int, default=50_000, help="people, each with one company")
+    parser.add_argument("--batch", type=int, default=50, help="records per transaction, i.e. CHECKPOINT_INTERVAL")
+    parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="results-store-bench-"))
+    profiles, people = make_records(args.n)
+
+    def write_json():
+        with open(workdir / "data.json", "w", encoding="utf-8") as f:
+            json.dump([[profile] for profile in profiles], f, indent=4, ensure_ascii=False)
+        with open(workdir / "result.json", "w", encoding="utf-8") as f:
+            json.dump(people, f, indent=4, ensure_ascii=False)
+
+    def write_store():
+        store = ResultsStore(workdir / "results.sqlite")
+        for i in range(0, args.n, args.batch):
+            for j in range(i, min(i + args.batch, args.n)):
+                store.add("data", f"c{j}", [profiles[j]])
+                store.add("enriched", f"p{j}", people[j])
+            store.write(store.snapshot())
+        store.close()
+
+    timed("write data.json + result.json (indent=4)", write_json)
+    start = time.perf_counter()
+    write_store()
+    elapsed = time.perf_counter() - start
+    print(f"{'write results store':<40} {elapsed * 1e3:>10,.2f} ms  ({2 * args.n / elapsed:,.0f} rows/s in batches of {args.batch})")
+    json_size = sum((workdir / name).stat().st_size for name in ("data.json", "result.json"))
+    print(f"{'size':<40} json {json_size / 2**20:,.1f} MiB, sqlite {(workdir / 'results.sqlite').stat().st_size / 2**20:,.1f} MiB")
+
+    numbers = [f"{random.randrange(args.n):08d}" for _ in range(args.lookups)]
+
+    def lookup_json():
+        with open(workdir / "result.json", "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return [p for p in data if numbers[0] in p["matched_company_refs"]]
+
+    timed("json: load + find one company's people", lookup_json)
+
+    store = ResultsStore(workdir / "results.sqlite")
+    timed("store: people by company number", lambda: list(store.records("enriched", company_number=numbers[0])))
+    start = time.perf_counter()
+    for number in numbers:
+        store.company(number)
+    print(f"{'store: company profile by number':<40} {(time.perf_counter() - start) * 1e3 / len(numbers):>10,.3f} ms each")
+    timed("store: people by person name", lambda: list(store.records("enriched", person=f"Person {args.n // 2}")))
+    timed("store: people by source", lambda: sum(1 for _ in store.records("enriched", source="BidStats")))
+    timed("store: stream every person", lambda: sum(1 for _ in store.records("enriched")))
+    store.close()
+    print(f"workdir: {workdir}")
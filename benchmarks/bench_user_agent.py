@@ -0,0 +1,36 @@
+import argparse
+import time
+from fake_useragent import UserAgent
+from Ethnicity_Profile.ethnicity_profile import GeminiChat, Prompt
+from Processor.user_agent import UserAgentProvider, USER_AGENT
+
+
+def per_request_library() -> str:
+    return UserAgent().random
+
+
+def run(label: str, get_ua, n: int):
+    start = time.perf_counter()
+    for _ in range(n):
+        get_ua()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {n / elapsed:>12,.0f}/s  ({elapsed * 1e6 / n:,.1f} us each)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="User-Agent cost per request: per-request fake_useragent vs the shared provider")
+    parser.add_argument("-n", type=int, default=100_000)
+    parser.add_argument("--library-n", type=int, default=50, help="iterations for the slow per-request library path")
+    args = parser.parse_args()
+
+    run("UserAgent().random per request", per_request_library, args.library_n)
+
+    start = time.perf_counter()
+    provider = UserAgentProvider()
+    provider.get()
+    print(f"{'provider first use (pool load)':<32} {(time.perf_counter() - start) * 1e3:>12,.1f} ms")
+    run("provider.get()", provider.get, args.n)
+    run("fixed agent", UserAgentProvider("pipeline/1.0").get, args.n)
+
+    USER_AGENT.get()
+    run("GeminiChat construction", lambda: GeminiChat("key", Prompt("Jane Smith")), args.n)
@@ -0,0 +1,218 @@
+import argparse
+import asyncio
+import base64
+import copy
+import json
+import math
+import random
+import re
+import time
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Tuple
+from aiohttp import web
+
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def load_fixture(name: str) -> Dict:
+    with open(FIXTURES / f"{name}.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class MockAPI:
+    """
+    Local stand-in for the Companies House, Perplexity and Gemini endpoints the
+    pipeline calls. Responses are built from the recorded fixtures; latency is
+    log-normal around `latency_ms`, and a share of requests fail with 500 or 429.
+    """
+    def __init__(self, latency_ms: float = 50, sigma: float = 0.5, error_rate: float = 0.0,
+                 rate_429: float = 0.0, miss_rate: float = 0.1, padding_bytes: int = 0, seed: int = 0,
+                 officers: int = 0, key_quota: int = 0, key_window: float = 300, dissolved_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.miss_rate = miss_rate
+        self.padding = "x" * padding_bytes
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.key_quota = key_quota
+        self.dissolved_rate = dissolved_rate
+        self.key_window = key_window
+        self.key_usage: Dict[str, Tuple[float, int]] = {}
+        self.names: Dict[str, str] = {}
+        self.fixtures = {
+            name: load_fixture(name)
+            for name in (
+                "companies_house_search", "companies_house_company", "companies_house_officers",
+                "companies_house_charges", "companies_house_filing_history",
+                "perplexity_completion", "gemini_generate"
+            )
+        }
+        if officers:
+            # Repeat the recorded officers so large boards span several pages.
+            listing = self.fixtures["companies_house_officers"]
+            recorded = listing["items"]
+            listing["items"] = [dict(recorded[i % len(recorded)]) for i in range(officers)]
+            listing["total_results"] = officers
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.companies_house_quota])
+        app.router.add_get("/advanced-search/companies", self.search)
+        app.router.add_get("/company/{number}", self.company)
+        app.router.add_get("/company/{number}/{section}", self.company_section)
+        app.router.add_post("/chat/completions", self.chat_completion)
+        app.router.add_post("/v1beta/models/{model}", self.generate_content)
+        app.router.add_get("/__stats", self.stats)
+        return app
+
+    @web.middleware
+    async def companies_house_quota(self, request: web.Request, handler):
+        """Per-key quota on the Companies House routes, reported in X-Ratelimit-* headers like the real API."""
+        if not (request.path.startswith("/company") or request.path.startswith("/advanced-search")):
+            return await handler(request)
+        key = base64.b64decode(request.headers.get("Authorization", "Basic ").split(" ", 1)[-1] or b"").decode(errors="replace").rstrip(":")
+        if "revoked" in key:
+            self.calls["companies_house_unauthorized"] += 1
+            raise web.HTTPUnauthorized(text='{"error": "Invalid Authorization"}')
+        if not self.key_quota:
+            return await handler(request)
+        now = time.time()
+        window_start, used = self.key_usage.get(key, (now, 0))
+        if now - window_start >= self.key_window:
+            window_start, used = now, 0
+        used += 1
+        self.key_usage[key] = (window_start, used)
+        headers = {
+            "X-Ratelimit-Limit": str(self.key_quota),
+            "X-Ratelimit-Remain": str(max(self.key_quota - used, 0)),
+            "X-Ratelimit-Reset": str(int(window_start + self.key_window)),
+            "X-Ratelimit-Window": f"{self.key_window:g}s"
+        }
+        if used > self.key_quota:
+            self.calls["companies_house_key_429"] += 1
+            raise web.HTTPTooManyRequests(headers=headers, text='{"error": "rate limited"}')
+        try:
+            response = await handler(request)
+        except web.HTTPException as e:
+            e.headers.update(headers)
+            raise
+        response.headers.update(headers)
+        return response
+
+    async def simulate(self, endpoint: str):
+        self.calls[endpoint] += 1
+        delay = self.random.lognormvariate(math.log(self.latency_ms / 1000), self.sigma) if self.latency_ms else 0
+        await asyncio.sleep(delay)
+        roll = self.random.random()
+        if roll < self.rate_429:
+            raise web.HTTPTooManyRequests(headers={"Retry-After": "1"}, text='{"error": "rate limited"}')
+        if roll < self.rate_429 + self.error_rate:
+            raise web.HTTPInternalServerError(text='{"error": "internal"}')
+
+    def respond(self, body: Dict) -> web.Response:
+        if self.padding:
+            body["_padding"] = self.padding
+        return web.json_response(body)
+
+    def company_number(self, name: str) -> str:
+        number = f"{zlib.crc32(name.encode()) % 10**8:08d}"
+        self.names[number] = name
+        return number
+
+    def company_status(self, number: str) -> str:
+        return "dissolved" if zlib.crc32(number.encode()) % 1000 < self.dissolved_rate * 1000 else "active"
+
+    async def search(self, request: web.Request) -> web.Response:
+        await self.simulate("companies_house_search")
+        name = request.query.get("company_name_includes", "")
+        if zlib.crc32(name.encode()) % 1000 < self.miss_rate * 1000:
+            raise web.HTTPNotFound(text='{"errors": [{"error": "no-results-found"}]}')
+        body = copy.deepcopy(self.fixtures["companies_house_search"])
+        number = self.company_number(name)
+        body["top_hit"].update(company_name=name, company_number=number, company_status=self.company_status(number), links={"company_profile": f"/company/{number}"})
+        return self.respond(body)
+
+    async def company(self, request: web.Request) -> web.Response:
+        await self.simulate("companies_house_company")
+        number = request.match_info["number"]
+        body = copy.deepcopy(self.fixtures["companies_house_company"])
+        body["company_number"] = number
+        body["company_status"] = self.company_status(number)
+        body["company_name"] = self.names.get(number, body["company_name"])
+        body["links"] = {key: link.replace("01234567", number) for key, link in body["links"].items()}
+        return self.respond(body)
+
+    async def company_section(self, request: web.Request) -> web.Response:
+        section = request.match_info["section"].replace("-", "_")
+        fixture = self.fixtures.get(f"companies_house_{section}")
+        if fixture is None:
+            raise web.HTTPNotFound()
+        await self.simulate(f"companies_house_{section}")
+        body = copy.deepcopy(fixture)
+        if section == "officers":
+            start = int(request.query.get("start_index", 0))
+            per_page = min(int(request.query.get("items_per_page", 35)), 100)
+            body["items"] = body["items"][start:start + per_page]
+            body.update(start_index=start, items_per_page=per_page)
+        elif section == "filing_history":
+            body["items"] = body["items"][:int(request.query.get("items_per_page", 25))]
+        return self.respond(body)
+
+    async def chat_completion(self, request: web.Request) -> web.Response:
+        await self.simulate("perplexity_chat")
+        payload = await request.json()
+        body = copy.deepcopy(self.fixtures["perplexity_completion"])
+        if payload.get("response_format"):
+            prompt = payload["messages"][-1]["content"]
+            companies = json.loads(prompt.split("COMPANIES:\n", 1)[1])
+            message = body["choices"][0]["message"]
+            think, _, score = message["content"].partition("</think>")
+            score = json.loads(score)
+            message["content"] = f"{think}</think>" + json.dumps(
+                {"results": [{**score, "company_number": company["company_number"]} for company in companies]}
+            )
+        return self.respond(body)
+
+    async def generate_content(self, request: web.Request) -> web.Response:
+        await self.simulate("gemini_generate")
+        payload = await request.json()
+        prompt = payload["contents"][0]["parts"][0]["text"]
+        match = re.search(r"Full Name: (.*)", prompt)
+        body = copy.deepcopy(self.fixtures["gemini_generate"])
+        part = body["candidates"][0]["content"]["parts"][0]
+        answer = json.loads(part["text"])
+        answer["Full Name"] = match.group(1) if match else answer["Full Name"]
+        part["text"] = json.dumps(answer)
+        return self.respond(body)
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.calls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Companies House / Perplexity / Gemini API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--miss-rate", type=float, default=0.1)
+    parser.add_argument("--padding-bytes", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--officers", type=int, default=0, help="officers per company; 0 keeps the recorded fixture")
+    parser.add_argument("--key-quota", type=int, default=0, help="Companies House requests per key per window; 0 is unlimited")
+    parser.add_argument("--key-window", type=float, default=300)
+    parser.add_argument("--dissolved-rate", type=float, default=0.0, help="share of companies reported as dissolved")
+    args = parser.parse_args()
+    mock = MockAPI(args.latency_ms, args.sigma, args.error_rate, args.rate_429, args.miss_rate, args.padding_bytes, args.seed,
+                   args.officers, args.key_quota, args.key_window, args.dissolved_rate)
+    web.run_app(mock.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,16 @@
-import json
 import pandas as pd
 from typing import List, Dict, Any
 from datetime import datetime
+from pathlib import Path
+from pydantic import ValidationError
+from Models.models import EvaluationResponse
+from Processor.artifacts import read_json
+from Processor.company_table import COMPANIES, CompanyResolver
+from Processor.results_store import ResultsStore
+
+
+COMPANIES_PATH = Path("data/companies/companies.lkt")
+RESULTS_DB_PATH = Path("data/results.sqlite")
 
 
 def months_active(active_since_str, date_format="%Y-%m-%d"):
@@ -14,20 +23,43 @@ def months_active(active_since_str, date_format="%Y-%m-%d"):
         total_months -= 1
     return total_months
 
-def process_per_director(record):
+LOAN_SCORE_COLUMNS = {
+    "FDS": "fds_score",
+    "LUI": "lui_score",
+    "Loan Capacity": "loan_capacity_range",
+    "Market Signals": "market_signals_score",
+    "Would work with a new loan broker": "would_work_with_new_loan_broker_score",
+    "Needs a loan today score": "needs_a_loan_today_score",
+    "Recommended Timing": "recommended_timing",
+    "Top 3 Risks for Lender": "top_3_risks_for_lender",
+    "Top 3 Loan Purposes": "top_3_loan_purposes"
+}
+
+def loan_fields(loan_info: Dict[str, Any]) -> Dict[str, Any]:
+    # Results written before the flat layout keep the scoring prompt's labels, with scores nested in objects.
+    if not any(column in loan_info for column in LOAN_SCORE_COLUMNS):
+        return loan_info
+    try:
+        return EvaluationResponse.model_validate(loan_info).model_dump()
+    except ValidationError:
+        return {field: loan_info.get(column) for column, field in LOAN_SCORE_COLUMNS.items()}
+
+def process_per_director(record, companies=COMPANIES):
     all_data = []
     full_name = record.get("full_name", "")
-    matched_company_records = record.get("matched_company_records", [])
+    matched_company_records = companies.resolve(record)
     companies_count = len(matched_company_records)
     all_companies = record.get("all_companies")
     source = record.get("source")
     if companies_count >= 1:
         for company in matched_company_records:
+            if company.get("skip_reason"):
+                continue
             company_info = company.get("company_info", {})
             director_info = company.get("director_info", {})
             filing_info = company.get("filing_info", {})
             legal_info = company.get("legal_info", {})
-            loan_info = record.get(f"Loan Score for {company_info.get('company_name')}", {})
+            loan_info = loan_fields(record.get(f"Loan Score for {company_info.get('company_name')}") or {})
 
             if company_info:
                 company_name = company_info.get("company_name", "")
@@ -70,62 +102,8 @@ def process_per_director(record):
                 has_ccjs = ""
                 ccjs_status = ""
 
-            if loan_info:
-                fds = loan_info.get("FDS", "")
-                if fds and isinstance(fds, Dict):
-                    fds_score = fds.get("score", "") or ""
-                else:
-                    fds_score = fds
-                                
-                lui = loan_info.get("LUI", "")
-                if lui and isinstance(lui, Dict):
-                    lui_score = lui.get("score", "") or ""
-                else:
-                    lui_score = lui
-                
-                loan_cap = loan_info.get("Loan Capacity", "")
-                if loan_cap and isinstance(loan_cap, Dict):
-                    if loan_cap.get("funding_range", None):
-                        loan_cap_score = loan_cap["funding_range"]
-                    elif loan_cap.get("range", None):
-                        loan_cap_score = loan_cap["range"]
-                    else:
-                        loan_cap_score = ""
-
-                else:
-                    loan_cap_score = loan_cap
-                                    
-                market_signals = loan_info.get("Market Signals", "")
-                if market_signals and isinstance(market_signals, Dict):
-                    market_signal_score = market_signals.get("score", "") or ""
-                else:
-                    market_signal_score = market_signals
-                
-                new_broker = loan_info.get("Would work with a new loan broker", "")
-                if new_broker and isinstance(new_broker, Dict):
-                    new_broker_score = new_broker.get("score", "") or ""
-                else:
-                    new_broker_score = new_broker
-
-                loan_need_today = loan_info.get("Needs a loan today score", "")
-                if loan_need_today and isinstance(loan_need_today, Dict):
-                    loan_need_today_score = loan_need_today.get("score", "") or ""
-                else:
-                    loan_need_today_score = loan_need_today
-
-                timing = loan_info.get("Recommended Timing", "")
-                top_3_risks = loan_info.get("Top 3 Risks for Lender", "")
-                top_3_purposes = loan_info.get("Top 3 Loan Purposes", "")
-            else:
-                fds_score = ""
-                lui_score = ""
-                loan_cap_score = ""
-                market_signal_score = ""
-                new_broker_score = ""
-                loan_need_today_score = ""
-                timing = ""
-                top_3_risks = ""
-                top_3_purposes = ""
+            loan_columns = {column: loan_info.get(field) or "" for column, field in LOAN_SCORE_COLUMNS.items()}
+            loan_columns["Loan Capacity"] = loan_columns["Loan Capacity"] or loan_info.get("loan_capacity_score") or ""
 
             if director_info:
                 director_ages = director_info.get("director_age_years", [])
@@ -176,22 +154,14 @@ def process_per_director(record):
                         "Charges Status": debentures_status,
                         "Has CCJS": has_ccjs,
                         "CCJS Status": ccjs_status,
-                        "FDS": fds_score or "",
-                        "LUI": lui_score or "",
-                        "Loan Capacity": loan_cap_score or "",
-                        "Market Signals": market_signal_score or "",
-                        "Would work with a new loan broker": new_broker_score or "",
-                        "Needs a loan today score": loan_need_today_score or "",
-                        "Recommended Timing": timing or "",
-                        "Top 3 Risks for Lender": top_3_risks or "",
-                        "Top 3 Loan Purposes": top_3_purposes or ""
+                        **loan_columns
                     })
     return all_data
 
 
-def process_json_in_batches(input_path: str, output_csv: str, batch_size: int = 1000):
-    with open(input_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+def process_json_in_batches(input_path: str, output_csv: str, batch_size: int = 1000, companies_path: Path = COMPANIES_PATH):
+    data = read_json(input_path)
+    companies = CompanyResolver(Path(companies_path))
 
     total = len(data)
     print(f"Total records: {total}")
@@ -202,14 +172,41 @@ def process_json_in_batches(input_path: str, output_csv: str, batch_size: int =
 
         all_rows = []
         for record in batch:
-            all_rows.extend(process_per_director(record))
+            all_rows.extend(process_per_director(record, companies))
 
         df = pd.DataFrame(all_rows)
         df.to_csv(output_csv, mode='a', index=False, header=(i == 0))
 
+    companies.close()
+    print(f"CSV successfully written to {output_csv}")
+
+
+def process_store_in_batches(db_path: Path, output_csv: str, batch_size: int = 1000, stage: str = "enriched"):
+    # Streams records out of the results store, so memory stays at one batch however large the run was.
+    store = ResultsStore(Path(db_path))
+    print(f"Total records: {store.count(stage)}")
+
+    header = True
+    all_rows = []
+    for n, record in enumerate(store.records(stage, batch_size=batch_size), 1):
+        all_rows.extend(process_per_director(record, store))
+        if n % batch_size == 0:
+            print(f"Processed {n} records")
+            # A batch without rows is skipped; written, it would put a blank line before the header.
+            if all_rows:
+                pd.DataFrame(all_rows).to_csv(output_csv, mode='a', index=False, header=header)
+                header = False
+                all_rows = []
+    if all_rows:
+        pd.DataFrame(all_rows).to_csv(output_csv, mode='a', index=False, header=header)
+
+    store.close()
     print(f"CSV successfully written to {output_csv}")
 
 
 
 if __name__ == "__main__":
-    process_json_in_batches("result.json", "new_directors_output.csv", batch_size=1000)
+    if RESULTS_DB_PATH.exists():
+        process_store_in_batches(RESULTS_DB_PATH, "new_directors_output.csv", batch_size=1000)
+    else:
+        process_json_in_batches("result.json", "new_directors_output.csv", batch_size=1000)
@@ -1,13 +1,25 @@
 import asyncio
-import json
 import logging
+import os
+import time
+from functools import partial
 from pathlib import Path
+from Processor.artifacts import read_json, write_json
 from Processor.data_pipeline import DataPipeline
 from Processor.checkpoint_processor import ProcessingState
 from Processor.company_matcher import match_companies
+from Processor.company_table import COMPANIES, write_company_table
+from Processor.results_store import RESULTS
+from Processor.sharding import run_sharded
+from Processor.metrics import METRICS
+from Processor.profiling import StageProfiler
+from Processor.resilience import RESILIENCE
+from Processor.negative_cache import NEGATIVE_CACHE
+from Processor.eligibility import ELIGIBILITY
 from Company_House.company_house import run_business_profiling
+from Company_House.credentials import COMPANY_HOUSE_KEYS
 from Ethnicity_Profile.ethnicity_profile import run_ethnicity_check
-from Loan_Scoring.loan_scoring import run_loan_scoring
+from Loan_Scoring.loan_scoring import run_loan_scoring, LoanScoringBatcher
 from typing import List
 from aiolimiter import AsyncLimiter
 
@@ -23,19 +35,62 @@ CONFIG = {
     "TRUSTPILOT_DATA_PATH": Path("data/trust_pilot/trust_pilot.json"),
     "TAX_DEFAULTERS_DATA_PATH": Path("data/tax_defaulters/tax_defaulters.json"),
     "BIDSTATS_DATA_PATH": Path("data/bidstats/bidstats.json"),
-    "MATCHED": Path("data/matched/matched.json"),
-    "SOURCE_DATA_PATH": Path("data/data.json"),
-    "RESPONSE_DATA_PATH": Path("data/result.json"),
-    "ENRICHED_DATA_PATH": Path("data/enriched/enriched.json"),
+    "MATCHED": Path("data/matched/matched.json.gz"),
+    "COMPANIES_PATH": Path("data/companies/companies.lkt"),
+    "SOURCE_DATA_PATH": Path("data/data.json.gz"),
+    "RESPONSE_DATA_PATH": Path("data/result.json.gz"),
+    "ENRICHED_DATA_PATH": Path("data/enriched/enriched.json.gz"),
+    # Optional SQLite copy of every stage's outputs for indexed queries, e.g. Path("data/results.sqlite").
+    "RESULTS_DB_PATH": None,
     "CHECKPOINT_DIR": Path("checkpoints/"),
     "CHECKPOINT_INTERVAL": 50,
+    "CHECKPOINT_FSYNC": "on_flush",
+    "DELTA_MODE": False,
+    "DELTA_MAX_AGE": None,
     "QUEUE_SIZE": 100,
-    "MAX_CONCURRENT_REQUESTS": 50
+    "MAX_CONCURRENT_REQUESTS": 50,
+    "STAGES": {
+        "one": {"rate_limit": (2, 1), "max_concurrent_sessions": 1},
+        "two": {"rate_limit": (20, 1), "max_concurrent_sessions": 50},
+        "three": {"rate_limit": (6, 1), "max_concurrent_sessions": 20}
+    },
+    "MIN_CONCURRENT_REQUESTS": 1,
+    "AUTOSCALE_INTERVAL": 1.0,
+    "WORKER_IDLE_TIMEOUT": 10.0,
+    "SCHEDULER": "fifo",
+    "PRIORITY_FUNCTION": None,
+    "FLOW_WEIGHTS": {},
+    "SHARDS": 1,
+    "COORDINATOR_ADDRESS": None,
+    "METRICS_PORT": None,
+    "METRICS_SNAPSHOT_PATH": None,
+    "METRICS_SNAPSHOT_INTERVAL": 30,
+    "PROFILE": None,
+    "PROFILE_DIR": None,
+    "PROFILE_TOP_N": 30,
+    "CIRCUIT_FAILURE_THRESHOLD": 5,
+    "CIRCUIT_RECOVERY_SECONDS": 30,
+    "UPSTREAM_TIMEOUTS": {"companies_house": 30, "gemini": 30, "perplexity": 100},
+    "HEDGE_ENDPOINTS": [],
+    "HEDGE_QUANTILE": 0.95,
+    "HEDGE_BUDGET": 0.05,
+    "NEGATIVE_CACHE_PATH": Path("checkpoints/negative_cache.json"),
+    "NEGATIVE_CACHE_TTL": 30 * 86400,
+    "NEGATIVE_CACHE_MAX_ENTRIES": 100_000,
+    "ELIGIBILITY": {
+        "statuses": ["active"],
+        "min_age_years": None,
+        "max_age_years": None,
+        "sectors": None,
+        "excluded_sectors": [],
+        "sources": None
+    },
+    "LOAN_SCORING_BATCH_SIZE": 1,
+    "LOAN_SCORING_BATCH_LINGER": 0.5
 }
 
 def prepare_file(file_path: Path, result_data: List):
-    with open(file_path, "r") as f:
-        file_content = json.loads(f.read())
+    file_content = read_json(file_path)
 
     if "trust_pilot" in file_path:
         for content in file_content:
@@ -65,58 +120,75 @@ def prepare_file(file_path: Path, result_data: List):
             result_data.append(data)
 
 async def runner(path, file_name, log_file, config, task_to_run, rate_limit, max_concurrent_sessions):
+    started = time.monotonic()
+    if config["SHARDS"] > 1:
+        pipeline = await run_sharded(path, file_name, log_file, config, task_to_run, rate_limit, max_concurrent_sessions, COMPANY_HOUSE_KEYS.rates())
+    else:
+        with StageProfiler(log_file, config, file_name) as profiler:
+            pipeline = await run_pipeline(path, file_name, log_file, config, task_to_run, rate_limit, max_concurrent_sessions, profiler)
+    NEGATIVE_CACHE.save(log_file)
+    if RESULTS.enabled and config.get("DELTA_MODE"):
+        # A delta run re-reads every input record, so stored rows for ids it did not see belong to records that are gone.
+        if pipeline.input_ids is None:
+            log_file.warning(f"Results store: not pruning {file_name}, some input files could not be read")
+        else:
+            pruned = await asyncio.to_thread(RESULTS.prune, file_name, pipeline.input_ids)
+            if pruned:
+                log_file.info(f"Results store: removed {pruned} stale {file_name} records")
+    METRICS.set("stage_seconds", time.monotonic() - started, stage=file_name)
+    METRICS.set("stage_results", len(pipeline.results), stage=file_name)
+    return pipeline
+
+async def run_pipeline(path, file_name, log_file, config, task_to_run, rate_limit, max_concurrent_sessions, profiler=None):
     ps = ProcessingState()
-    pipeline = DataPipeline(ps, log_file, dataset_paths=[path], CONFIG=config, resume=True)
+    pipeline = DataPipeline(ps, log_file, dataset_paths=[path], CONFIG=config, resume=True, profiler=profiler)
 
     limiter = AsyncLimiter(*rate_limit) if rate_limit else None
     semaphore = asyncio.Semaphore(max_concurrent_sessions) if max_concurrent_sessions else None
 
-    producer_tasks = [
-        asyncio.create_task(pipeline.producer(file_name, path))
-    ]
-
-    consumer_tasks = [
-        asyncio.create_task(pipeline.consumer(task_to_run, i, limiter, semaphore))
-            for i in range(CONFIG["MAX_CONCURRENT_REQUESTS"])
-    ]
-
-    await asyncio.gather(*producer_tasks)
-
-    for _ in range(CONFIG["MAX_CONCURRENT_REQUESTS"]):
-        await pipeline.queue.put(None)
-
-    await asyncio.gather(*consumer_tasks)
+    max_workers = min(config["MAX_CONCURRENT_REQUESTS"], max_concurrent_sessions or config["MAX_CONCURRENT_REQUESTS"])
+    await pipeline.run(file_name, path, task_to_run, limiter, semaphore, max_workers)
     return pipeline
 
+def scale_by_keys(stage: dict, keys: int) -> dict:
+    # STAGES["one"] is sized for a single Companies House key; each extra key adds its own quota.
+    if keys <= 1:
+        return stage
+    rate_limit = stage.get("rate_limit")
+    sessions = stage.get("max_concurrent_sessions")
+    return {
+        "rate_limit": (rate_limit[0] * keys, rate_limit[1]) if rate_limit else None,
+        "max_concurrent_sessions": sessions * keys if sessions else None
+    }
+
 async def stage_one(path, file_name, log_file, config, run_process, match_data):
-    runner_instance = await runner(path, file_name, log_file, config, run_process, rate_limit=(2, 1), max_concurrent_sessions=1)
+    stage = scale_by_keys(config["STAGES"]["one"], len(COMPANY_HOUSE_KEYS))
+    runner_instance = await runner(path, file_name, log_file, config, run_process, **stage)
     runner_instance.state.save_checkpoint(log_file, config)
 
-    ret = Path("data/matched/matched.json")
-    matched = match_companies(runner_instance.results, match_data)
-    with open(ret, "w") as f:
-        json.dump(matched, f, indent=4)
-    log_file.info("Stage One complete")
+    matched, companies = match_companies(runner_instance.results, match_data)
+    write_json(config["MATCHED"], matched)
+    write_company_table(config["COMPANIES_PATH"], companies)
+    COMPANIES.configure(config)
+    log_file.info(f"Stage One complete: {len(matched)} people, {len(companies)} companies")
     return matched
 
 async def stage_two(path, file_name, log_file, config, run_process):
-    runner_instance = await runner(path, file_name, log_file, config, run_process, rate_limit=(20, 1), max_concurrent_sessions=50)
+    runner_instance = await runner(path, file_name, log_file, config, run_process, **config["STAGES"]["two"])
     runner_instance.state.save_checkpoint(log_file, config)
     try:
-        ret = Path("data/enriched/enriched.json")
-        with open(ret, "w", encoding="utf-8") as f:
-            json.dump(runner_instance.results, f, indent=4, ensure_ascii=False)
+        ret = config["ENRICHED_DATA_PATH"]
+        write_json(ret, runner_instance.results)
         log_file.info("Stage Two Completed")
         return ret
     except Exception as e:
         log_file.error(f"Failed to save results: {e}", exc_info=True)
 
 async def stage_three(path, file_name, log_file, config, run_process):
-    runner_instance = await runner(path, file_name, log_file, config, run_process, rate_limit=(6, 1), max_concurrent_sessions=20)
+    runner_instance = await runner(path, file_name, log_file, config, run_process, **config["STAGES"]["three"])
     runner_instance.state.save_checkpoint(log_file, config)
     try:
-        with open(config["RESPONSE_DATA_PATH"], "w", encoding="utf-8") as f:
-            json.dump(runner_instance.results, f, indent=4, ensure_ascii=False)
+        write_json(config["RESPONSE_DATA_PATH"], runner_instance.results)
         log_file.info(f"Results saved to {config['RESPONSE_DATA_PATH']}")
         return config["RESPONSE_DATA_PATH"]
     except Exception as e:
@@ -136,10 +208,14 @@ async def main():
     first_stage_list = ["trust_pilot", "bidstats", "tax_defaulters"]
     dt = []
 
+    source_files = {
+        "trust_pilot": CONFIG["TRUSTPILOT_DATA_PATH"],
+        "bidstats": CONFIG["BIDSTATS_DATA_PATH"],
+        "tax_defaulters": CONFIG["TAX_DEFAULTERS_DATA_PATH"]
+    }
     for n in range(len(dataset_paths)):
-        pth = f"{dataset_paths[n][1]}/{dataset_paths[n][0]}.json"
         if dataset_paths[n][0] in first_stage_list:
-            prepare_file(pth, dt)
+            prepare_file(str(source_files[dataset_paths[n][0]]), dt)
 
     stage_one_file_name = dataset_paths[0][0]
     stage_one_path = dataset_paths[0][1]
@@ -148,14 +224,38 @@ async def main():
     stage_two_file_name = dataset_paths[4][0]
     stage_two_path = dataset_paths[4][1]
 
-    with open(stage_one_file, "w") as ff:
-        json.dump(dt, ff, indent=4)
-    
+    write_json(stage_one_file, dt)
+
+    RESILIENCE.configure(CONFIG)
+    ELIGIBILITY.configure(CONFIG)
+    COMPANIES.configure(CONFIG)
+    RESULTS.configure(CONFIG)
+    NEGATIVE_CACHE.configure(CONFIG)
+    NEGATIVE_CACHE.load(logger)
+    await METRICS.start(logger, CONFIG)
     await stage_one(stage_one_path, stage_one_file_name, logger, CONFIG, run_business_profiling, dt)
     await stage_two(stage_two_path, stage_two_file_name, logger, CONFIG, run_ethnicity_check)
     stage_three_file_name = dataset_paths[5][0]
     stage_three_path = dataset_paths[5][1]
-    await stage_three(stage_three_path, stage_three_file_name, logger, CONFIG, run_loan_scoring)
+    loan_scoring = run_loan_scoring
+    stage_three_config = CONFIG
+    if CONFIG["LOAN_SCORING_BATCH_SIZE"] > 1:
+        batcher = LoanScoringBatcher(
+            os.environ.get("PERPLEXITY_API_KEY"),
+            logger,
+            batch_size=CONFIG["LOAN_SCORING_BATCH_SIZE"],
+            linger=CONFIG["LOAN_SCORING_BATCH_LINGER"]
+        )
+        loan_scoring = partial(run_loan_scoring, batcher=batcher)
+        # A batch fills only from concurrent callers, so the pool starts at the batch size instead of growing into it.
+        stage_three_config = {
+            **CONFIG,
+            "MIN_CONCURRENT_REQUESTS": max(CONFIG["MIN_CONCURRENT_REQUESTS"], CONFIG["LOAN_SCORING_BATCH_SIZE"])
+        }
+    await stage_three(stage_three_path, stage_three_file_name, logger, stage_three_config, loan_scoring)
+    ELIGIBILITY.report(logger)
+    RESULTS.close()
+    await METRICS.stop(CONFIG)
 
     return
 
@@ -1,8 +1,11 @@
 import pandas as pd
-import json
 from datetime import datetime
 from dateutil import parser
 import re
+import sys
+from pathlib import Path
+from Processor.artifacts import read_json
+from Processor.lookup_table import LookupTable, build_lookup_table
 
 
 def months_active(active_since_str, date_format="%Y-%m-%d"):
@@ -25,46 +28,6 @@ def convert_iso_to_ddmmyyyy(iso_str):
     date_obj = parser.isoparse(iso_str)
     return date_obj.strftime("%d-%m-%Y")
 
-df_main = pd.read_csv("new_directors_output.csv")
-
-# === Load BIDSTATS ===
-with open("tz/data/bidstats/bidstats.json", "r", encoding="utf-8") as f:
-    bidstats_raw = json.load(f)
-
-# Build lookup: supplier name → bidstats record
-bidstats_lookup = {}
-for record in bidstats_raw:
-    supplier_list = record.get("suppliers", [])
-    for supplier in supplier_list:
-        supplier_name = supplier.get("name", "").strip().lower()
-        if supplier_name:
-            bidstats_lookup[supplier_name] = record
-
-# === Load TRUST PILOT DEFAULT ===
-with open("tz/NA/trust_pilot.json", "r", encoding="utf-8") as f:
-    tax_default_raw = json.load(f)
-
-# Build lookup: name → trust_pilot default record
-trust_pilot_lookup = {}
-for record in tax_default_raw:
-    results = record.get("results", [])
-    if results:
-        company_names = [company_obj.get("company_name", "").strip().lower() for company_obj in results if company_obj.get("company_name", None)]
-        if company_names:
-            for name in company_names:
-                trust_pilot_lookup[name] = record
-
-# === Load TAX DEFAULT ===
-with open("tz/data/tax_defaulters/tax_defaulters.json", "r", encoding="utf-8") as f:
-    tax_default_raw = json.load(f)
-
-# Build lookup: name → tax default record
-tax_lookup = {
-    entry["Name"].strip().lower(): entry
-    for entry in tax_default_raw
-    if "Name" in entry
-}
-
 def format_amount(amount_str):
     if not amount_str or not isinstance(amount_str, str):
         return None
@@ -116,22 +79,82 @@ def normalize_company_name(name):
     return name.strip()
     # return name
 
-
-
-normalized_bidstats_lookup = {
-    normalize_company_name(name): record
-    for name, record in bidstats_lookup.items()
+LOOKUP_DIR = Path("tz/data/lookups")
+SOURCES = {
+    "bidstats": Path("tz/data/bidstats/bidstats.json"),
+    "trust_pilot": Path("tz/NA/trust_pilot.json"),
+    "tax_defaulters": Path("tz/data/tax_defaulters/tax_defaulters.json")
 }
 
-normalized_tax_lookup = {
-    normalize_company_name(name): record
-    for name, record in tax_lookup.items()
+def bidstats_entries(bidstats_raw):
+    # Build lookup: supplier name → bidstats record
+    bidstats_lookup = {}
+    for record in bidstats_raw:
+        supplier_list = record.get("suppliers", [])
+        for supplier in supplier_list:
+            supplier_name = supplier.get("name", "").strip().lower()
+            if supplier_name:
+                bidstats_lookup[supplier_name] = record
+    return ((normalize_company_name(name), record) for name, record in bidstats_lookup.items())
+
+def trust_pilot_entries(trust_pilot_raw):
+    # Build lookup: name → trust_pilot default record
+    trust_pilot_lookup = {}
+    for record in trust_pilot_raw:
+        results = record.get("results", [])
+        if results:
+            company_names = [company_obj.get("company_name", "").strip().lower() for company_obj in results if company_obj.get("company_name", None)]
+            if company_names:
+                for name in company_names:
+                    trust_pilot_lookup[name] = record
+    return ((normalize_company_name(name), record) for name, record in trust_pilot_lookup.items())
+
+def tax_entries(tax_default_raw):
+    # Build lookup: name → tax default record
+    tax_lookup = {
+        entry["Name"].strip().lower(): entry
+        for entry in tax_default_raw
+        if "Name" in entry
+    }
+    return ((normalize_company_name(name), record) for name, record in tax_lookup.items())
+
+ENTRIES = {
+    "bidstats": bidstats_entries,
+    "trust_pilot": trust_pilot_entries,
+    "tax_defaulters": tax_entries
 }
 
-normalized_trust_pilot_lookup = {
-    normalize_company_name(name): record
-    for name, record in trust_pilot_lookup.items()
-}
+def build_lookup(name):
+    raw = read_json(SOURCES[name])
+    table = LOOKUP_DIR / f"{name}.lkt"
+    count = build_lookup_table(table, ENTRIES[name](raw))
+    print(f"Compiled {count} {name} keys into {table}")
+    return table
+
+def open_lookup(name):
+    # Compiled tables are memory-mapped, so repeated runs skip parsing the JSON sources; rebuilt when a source changes.
+    table = LOOKUP_DIR / f"{name}.lkt"
+    if not table.exists() or table.stat().st_mtime < SOURCES[name].stat().st_mtime:
+        build_lookup(name)
+    return LookupTable(table)
+
+if "--build-lookups" in sys.argv:
+    for source_name in SOURCES:
+        build_lookup(source_name)
+    sys.exit(0)
+
+df_main = pd.read_csv("new_directors_output.csv")
+company_keys = df_main["Company Name"].astype(str).str.strip().str.lower().map(normalize_company_name)
+
+# === Probe each source once for every company in the input ===
+with open_lookup("bidstats") as table:
+    normalized_bidstats_lookup = table.get_many(company_keys)
+
+with open_lookup("tax_defaulters") as table:
+    normalized_tax_lookup = table.get_many(company_keys)
+
+with open_lookup("trust_pilot") as table:
+    normalized_trust_pilot_lookup = table.get_many(company_keys)
 
 # === Enrichment function ===
 def enrich_row(row):